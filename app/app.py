@@ -1,12 +1,38 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-from mangum import Mangum
-import json
-from collections import deque
+from fastapi.responses import PlainTextResponse, Response
+from time import monotonic, perf_counter, time
+import sys
+import asyncio
+
+from app import config, metrics
+from app.backplane import create_backplane
+from app.codec import Envelope, codec
+from app.fanout import Connection
+from app.heartbeat import Heartbeat
+from app.history import MAX_SEQ
+from app.ingest import IngestBudget, IngestQueue
+from app.media import router as media_router
+from app.presence import Presence
+from app.ratelimit import RATE_LIMIT_CLOSE_CODE, limiter_factory
+from app.rooms import DEFAULT_ROOM, ROOM_NAME_RE, Room, RoomRegistry, page_frame, resolve_reply, search_frame
+from app.schema import MessageError, decode_message
+from app.search import parse_query, parse_time
+from app.static import router as static_router
 
 app = FastAPI()
-handler = Mangum(app=app)
+
+
+def __getattr__(name: str):
+    # The Lambda handler: Mangum is only imported when it is asked for, so
+    # uvicorn workers never load it.
+    global handler
+    if name == "handler":
+        from mangum import Mangum
+        handler = Mangum(app=app)
+        return handler
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,619 +41,378 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.include_router(media_router)
+app.include_router(static_router)
 
-html = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Restaurant Chat App</title>
-    <link href="https://fonts.googleapis.com/css2?family=Roboto:wght@300;400;500;700&display=swap" rel="stylesheet">
-    <link href="https://fonts.googleapis.com/icon?family=Material+Icons" rel="stylesheet">
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            font-family: 'Roboto', sans-serif;
-        }
-
-        body {
-            background-color: #f5f5f5;
-        }
-
-        .dialog-overlay {
-            position: fixed;
-            top: 0;
-            left: 0;
-            right: 0;
-            bottom: 0;
-            background-color: rgba(0, 0, 0, 0.5);
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            z-index: 1000;
-        }
-
-        .dialog-card {
-            background: white;
-            padding: 24px;
-            border-radius: 8px;
-            width: 90%;
-            max-width: 400px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-        }
-
-        .dialog-title {
-            font-size: 1.5rem;
-            color: #1a73e8;
-            margin-bottom: 16px;
-            font-weight: 500;
-        }
-
-        .dialog-input {
-            width: 100%;
-            padding: 12px;
-            border: 1px solid #dadce0;
-            border-radius: 4px;
-            margin-bottom: 16px;
-            font-size: 1rem;
-            outline: none;
-            transition: border-color 0.2s;
-        }
-
-        .dialog-input:focus {
-            border-color: #1a73e8;
-        }
-
-        .dialog-button {
-            background-color: #1a73e8;
-            color: white;
-            border: none;
-            padding: 12px 24px;
-            border-radius: 4px;
-            font-size: 0.875rem;
-            font-weight: 500;
-            text-transform: uppercase;
-            cursor: pointer;
-            transition: background-color 0.2s;
-        }
-
-        .dialog-button:hover {
-            background-color: #1557b0;
-        }
-
-        .chat-container {
-            max-width: 1200px;
-            margin: 0 auto;
-            height: 100vh;
-            display: flex;
-            flex-direction: column;
-            background: white;
-            box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
-        }
-
-        .chat-header {
-            padding: 16px;
-            background: #1a73e8;
-            color: white;
-            display: flex;
-            align-items: center;
-            box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
-        }
-
-        .chat-header h2 {
-            margin-left: 12px;
-            font-weight: 500;
-        }
-
-        #messages {
-            flex-grow: 1;
-            overflow-y: auto;
-            padding: 16px;
-            display: flex;
-            flex-direction: column;
-            gap: 16px;
-            list-style: none;
-        }
-
-        .message-card {
-            padding: 12px 16px;
-            border-radius: 8px;
-            background: #f8f9fa;
-            max-width: 80%;
-            align-self: flex-start;
-            box-shadow: 0 1px 2px rgba(0, 0, 0, 0.1);
-            position: relative;
-        }
-
-        .message-card.self {
-            background: #e3f2fd;
-            align-self: flex-end;
-        }
-
-        .username {
-            font-size: 0.875rem;
-            color: #5f6368;
-            margin-bottom: 4px;
-            font-weight: 500;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-
-        .message-actions {
-            display: none;
-            gap: 8px;
-        }
-
-        .message-card:hover .message-actions {
-            display: flex;
-        }
-
-        .action-button {
-            background: none;
-            border: none;
-            cursor: pointer;
-            color: #5f6368;
-            padding: 4px;
-            border-radius: 50%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-        }
-
-        .action-button:hover {
-            background: rgba(0, 0, 0, 0.04);
-        }
-
-        .message-content {
-            color: #202124;
-            line-height: 1.4;
-        }
-
-        .message-content img {
-            max-width: 100%;
-            border-radius: 4px;
-            margin-top: 8px;
-        }
-
-        .reply-content {
-            margin-bottom: 8px;
-            padding: 8px;
-            background: rgba(0, 0, 0, 0.04);
-            border-left: 3px solid #1a73e8;
-            border-radius: 4px;
-            font-size: 0.875rem;
-        }
-
-        .reply-username {
-            font-weight: 500;
-            color: #1a73e8;
-            margin-bottom: 4px;
-        }
-
-        .message-input-container {
-            padding: 16px;
-            background: white;
-            border-top: 1px solid #dadce0;
-            display: flex;
-            flex-direction: column;
-            gap: 8px;
-        }
-
-        .reply-preview {
-            padding: 8px 16px;
-            background: #f8f9fa;
-            border-radius: 4px;
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-            font-size: 0.875rem;
-        }
-
-        .reply-preview-content {
-            display: flex;
-            align-items: center;
-            gap: 8px;
-        }
-
-        .input-actions {
-            display: flex;
-            gap: 12px;
-            align-items: center;
-        }
-
-        .message-input {
-            flex-grow: 1;
-            padding: 12px;
-            border: 1px solid #dadce0;
-            border-radius: 24px;
-            outline: none;
-            font-size: 1rem;
-            transition: border-color 0.2s;
-        }
-
-        .message-input:focus {
-            border-color: #1a73e8;
-        }
-
-        .send-button {
-            background: #1a73e8;
-            color: white;
-            border: none;
-            width: 40px;
-            height: 40px;
-            border-radius: 50%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            cursor: pointer;
-            transition: background-color 0.2s;
-        }
-
-        .send-button:hover {
-            background-color: #1557b0;
-        }
-
-        .file-input-container {
-            position: relative;
-            width: 40px;
-            height: 40px;
-        }
-
-        .file-input {
-            position: absolute;
-            width: 100%;
-            height: 100%;
-            opacity: 0;
-            cursor: pointer;
-        }
-
-        .file-button {
-            width: 100%;
-            height: 100%;
-            background: #f1f3f4;
-            border: none;
-            border-radius: 50%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            color: #5f6368;
-            cursor: pointer;
-            transition: background-color 0.2s;
-        }
-
-        .file-button:hover {
-            background-color: #e8eaed;
-        }
-    </style>
-</head>
-<body>
-    <div id="usernameDialog" class="dialog-overlay">
-        <div class="dialog-card">
-            <h3 class="dialog-title">Welcome to Chat</h3>
-            <input type="text" id="usernameInput" class="dialog-input" placeholder="Enter your username">
-            <button id="setUsername" class="dialog-button">Join Chat</button>
-        </div>
-    </div>
-
-    <div class="chat-container">
-        <div class="chat-header">
-            <span class="material-icons">chat</span>
-            <h2>Restaurant Chat App</h2>
-        </div>
-        <ul id="messages"></ul>
-        <form class="message-input-container" onsubmit="sendMessage(event)">
-            <div id="replyPreview" style="display: none;" class="reply-preview">
-                <div class="reply-preview-content">
-                    <span class="material-icons">reply</span>
-                    <div>
-                        <div style="font-weight: 500;" id="replyToUsername"></div>
-                        <div id="replyToContent"></div>
-                    </div>
-                </div>
-                <button type="button" class="action-button" onclick="cancelReply()">
-                    <span class="material-icons">close</span>
-                </button>
-            </div>
-            <div class="input-actions">
-                <input type="text" id="messageText" class="message-input" placeholder="Type a message">
-                <div class="file-input-container">
-                    <input type="file" id="imageInput" class="file-input" accept="image/*">
-                    <button type="button" class="file-button">
-                        <span class="material-icons">image</span>
-                    </button>
-                </div>
-                <button type="submit" class="send-button">
-                    <span class="material-icons">send</span>
-                </button>
-            </div>
-        </form>
-    </div>
-
-    <script>
-        const ws = new WebSocket(`wss://${window.location.host}/ws/chat`);
-        const messages = document.getElementById("messages");
-        const messageInput = document.getElementById("messageText");
-        const imageInput = document.getElementById("imageInput");
-        const usernameInput = document.getElementById("usernameInput");
-        const usernameDialog = document.getElementById("usernameDialog");
-        const setUsernameButton = document.getElementById("setUsername");
-        const replyPreview = document.getElementById("replyPreview");
-        const replyToUsername = document.getElementById("replyToUsername");
-        const replyToContent = document.getElementById("replyToContent");
-
-        let username = localStorage.getItem("username");
-        let replyingTo = null;
-
-        if (username) {
-            usernameDialog.style.display = "none";
-        }
-
-        setUsernameButton.addEventListener("click", () => {
-            username = usernameInput.value.trim();
-            if (username) {
-                localStorage.setItem("username", username);
-                usernameDialog.style.display = "none";
-            } else {
-                usernameInput.classList.add("error");
-            }
-        });
-        
-        function compressImage(file) {
-            return new Promise((resolve) => {
-                const reader = new FileReader();
-                reader.onload = (e) => {
-                    const img = new Image();
-                    img.onload = () => {
-                        const canvas = document.createElement('canvas');
-                        let width = img.width;
-                        let height = img.height;
-                        
-                        // Max dimensions
-                        const MAX_WIDTH = 1200;
-                        const MAX_HEIGHT = 1200;
-                        
-                        if (width > height) {
-                            if (width > MAX_WIDTH) {
-                                height *= MAX_WIDTH / width;
-                                width = MAX_WIDTH;
-                            }
-                        } else {
-                            if (height > MAX_HEIGHT) {
-                                width *= MAX_HEIGHT / height;
-                                height = MAX_HEIGHT;
-                            }
-                        }
-                        
-                        canvas.width = width;
-                        canvas.height = height;
-                        
-                        const ctx = canvas.getContext('2d');
-                        ctx.drawImage(img, 0, 0, width, height);
-                        
-                        resolve(canvas.toDataURL('image/jpeg', 0.8));
-                    };
-                    img.src = e.target.result;
-                };
-                reader.readAsDataURL(file);
-            });
-        }
-
-        function createThumbnail(imgSrc) {
-            return new Promise((resolve) => {
-                const img = new Image();
-                img.onload = () => {
-                    const canvas = document.createElement('canvas');
-                    const THUMB_SIZE = 100;
-                    let width = img.width;
-                    let height = img.height;
-                    
-                    if (width > height) {
-                        height *= THUMB_SIZE / width;
-                        width = THUMB_SIZE;
-                    } else {
-                        width *= THUMB_SIZE / height;
-                        height = THUMB_SIZE;
-                    }
-                    
-                    canvas.width = width;
-                    canvas.height = height;
-                    
-                    const ctx = canvas.getContext('2d');
-                    ctx.drawImage(img, 0, 0, width, height);
-                    
-                    resolve(canvas.toDataURL('image/jpeg', 0.7));
-                };
-                img.src = imgSrc;
-            });
-        }
-
-        async function setReply(messageId, replyUsername, content, type) {
-            replyingTo = messageId;
-            replyToUsername.textContent = replyUsername;
-            
-            if (type === 'image') {
-                const thumbnail = await createThumbnail(content);
-                replyToContent.innerHTML = `<img src="${thumbnail}" style="max-height: 50px;">`;
-            } else {
-                replyToContent.textContent = content;
-            }
-            
-            replyPreview.style.display = "flex";
-            messageInput.focus();
-        }
-
-        function cancelReply() {
-            replyingTo = null;
-            replyPreview.style.display = "none";
-        }
-
-        ws.onmessage = (event) => {
-            const data = JSON.parse(event.data);
-            const messageCard = document.createElement("li");
-            messageCard.classList.add("message-card");
-            messageCard.setAttribute("data-message-id", data.id);
-            messageCard.setAttribute("data-message-type", data.type);
-            
-            if (data.username === username) {
-                messageCard.classList.add("self");
-            }
-
-            const usernameDiv = document.createElement("div");
-            usernameDiv.classList.add("username");
-            
-            const usernameText = document.createElement("span");
-            usernameText.textContent = data.username;
-            usernameDiv.appendChild(usernameText);
-
-            const actions = document.createElement("div");
-            actions.classList.add("message-actions");
-            
-            const replyButton = document.createElement("button");
-            replyButton.classList.add("action-button");
-            replyButton.innerHTML = '<span class="material-icons">reply</span>';
-            replyButton.onclick = () => setReply(data.id, data.username, data.content, data.type);
-            actions.appendChild(replyButton);
-            
-            usernameDiv.appendChild(actions);
-
-            const messageContentDiv = document.createElement("div");
-            messageContentDiv.classList.add("message-content");
-
-            if (data.replyTo) {
-                const replyDiv = document.createElement("div");
-                replyDiv.classList.add("reply-content");
-                
-                const replyUsername = document.createElement("div");
-                replyUsername.classList.add("reply-username");
-                replyUsername.textContent = data.replyTo.username;
-                
-                const replyContent = document.createElement("div");
-                if (data.replyTo.type === 'image') {
-                    replyContent.innerHTML = `<img src="${data.replyTo.thumbnail}" style="max-height: 50px;">`;
-                } else {
-                    replyContent.textContent = data.replyTo.content;
-                }
-                
-                replyDiv.appendChild(replyUsername);
-                replyDiv.appendChild(replyContent);
-                messageContentDiv.appendChild(replyDiv);
-            }
-
-            if (data.type === "text") {
-                messageContentDiv.appendChild(document.createTextNode(data.content));
-            } else if (data.type === "image") {
-                const img = document.createElement("img");
-                img.src = data.content;
-                messageContentDiv.appendChild(img);
-            }
-
-            messageCard.appendChild(usernameDiv);
-            messageCard.appendChild(messageContentDiv);
-            messages.appendChild(messageCard);
-            messages.scrollTop = messages.scrollHeight;
-        };
-
-        async function sendMessage(event) {
-            event.preventDefault();
-            
-            if (!username) {
-                alert("Please set your username first!");
-                return;
-            }
-
-            const messageId = Date.now().toString();
-            const messageData = {
-                id: messageId,
-                username: username,
-                timestamp: new Date().toISOString()
-            };
-
-            if (replyingTo) {
-                const replyMessage = document.querySelector(`[data-message-id="${replyingTo}"]`);
-                if (replyMessage) {
-                    const messageType = replyMessage.getAttribute('data-message-type');
-                    const content = messageType === 'image' ? 
-                        replyMessage.querySelector(".message-content img").src :
-                        replyMessage.querySelector(".message-content").textContent;
-                        
-                    messageData.replyTo = {
-                        id: replyingTo,
-                        username: replyMessage.querySelector(".username span").textContent,
-                        content: content,
-                        type: messageType,
-                        thumbnail: messageType === 'image' ? await createThumbnail(content) : null
-                    };
-                }
-                cancelReply();
-            }
-
-            if (messageInput.value) {
-                ws.send(JSON.stringify({
-                    ...messageData,
-                    type: "text",
-                    content: messageInput.value
-                }));
-                messageInput.value = "";
-            }
-
-            if (imageInput.files.length > 0) {
-                const compressedImage = await compressImage(imageInput.files[0]);
-                ws.send(JSON.stringify({
-                    ...messageData,
-                    type: "image",
-                    content: compressedImage
-                }));
-                imageInput.value = "";
-            }
-        }
-    </script>
-</body>
-</html>
-"""
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+def _open_log_store():
+    if not config.LOG_DIR:
+        return None
+    from app.chatlog import ChatLogStore
+    return ChatLogStore(config.LOG_DIR, config.LOG_SEGMENT_BYTES, config.LOG_FSYNC)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            await connection.send_text(json.dumps(message))
+def _client_seq(seq):
+    """A seq the client sent, clamped to what can cross the backplane."""
+    return min(max(seq, 0), MAX_SEQ) if seq is not None else None
 
 
-manager = ConnectionManager()
-chat_history = deque(maxlen=100)  # Stores the last 100 messages
+class ConnectionManager:
+    def __init__(self, queue_size: int = config.SEND_QUEUE_SIZE,
+                 policy: str = config.SEND_QUEUE_POLICY,
+                 backplane_url: str = config.BACKPLANE):
+        self.connections = {}  # connection id -> Connection
+        self.rooms = RoomRegistry(config.ROOM_HISTORY_SIZE, config.ROOM_IDLE_TTL,
+                                  on_reclaim=self._unsubscribe, join_size=config.JOIN_HISTORY_SIZE,
+                                  limiter_factory=limiter_factory(
+                                      config.ROOM_RATE_LIMIT_MESSAGES, config.ROOM_RATE_LIMIT_MESSAGE_BURST,
+                                      config.ROOM_RATE_LIMIT_BYTES, config.ROOM_RATE_LIMIT_BYTE_BURST,
+                                      config.RATE_LIMIT_MAX_DELAY, config.RATE_LIMIT_GRACE),
+                                  batch_window=config.BROADCAST_BATCH_WINDOW_MS / 1000,
+                                  batch_bytes=config.BROADCAST_BATCH_MAX_BYTES,
+                                  history_bytes=config.ROOM_HISTORY_BYTES)
+        self.backplane = create_backplane(backplane_url, config.ROOM_HISTORY_SIZE, _open_log_store,
+                                          config.ROOM_HISTORY_BYTES, config.HISTORY_SPILL)
+        self.queue_size = queue_size
+        self.policy = policy
+        self.ingest_budget = IngestBudget(config.INGEST_MAX_PENDING)
+        self.heartbeat = (Heartbeat(config.HEARTBEAT_INTERVAL, config.IDLE_TIMEOUT)
+                          if config.HEARTBEAT_INTERVAL > 0 else None)
+        self._started = None
+
+    def __len__(self):
+        return len(self.connections)
+
+    def __contains__(self, connection: Connection):
+        return connection.id in self.connections
+
+    async def start(self):
+        if self._started is None:
+            self._started = asyncio.ensure_future(self.backplane.start(self._deliver, self._restore,
+                                                                         self._deliver_presence))
+            if self.heartbeat is not None:
+                self.heartbeat.start()
+        await self._started
+
+    async def stop(self):
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+        for room in self.rooms.rooms.values():
+            self._close_ingest(room)
+            if room.presence is not None:
+                room.presence.close()
+        await self.backplane.close()
+        self._started = None
+
+    async def _subscribe(self, room: Room):
+        await self.start()
+        if room.subscription is None:
+            room.subscription = asyncio.ensure_future(self.backplane.subscribe(room.name))
+        await room.subscription
+
+    def _unsubscribe(self, room: Room):
+        self._close_ingest(room)
+        if room.presence is not None:
+            room.presence.close()
+            room.presence = None
+        self.backplane.unsubscribe(room.name)
+
+    def _presence(self, room: Room) -> Presence:
+        if room.presence is None:
+            room.presence = Presence(lambda delta: self.backplane.publish_presence(room.name, delta),
+                                     config.PRESENCE_WINDOW_MS / 1000, config.TYPING_TIMEOUT)
+        return room.presence
+
+    def _close_ingest(self, room: Room):
+        if room.ingest is not None:
+            room.ingest.close()
+            room.ingest = None
+
+    def _restore(self, room_name: str, envelopes: list):
+        room = self.rooms.find(room_name)
+        if room is not None:
+            room.restore(envelopes)
+            # Report our members again, to a broker that may have lost them.
+            if room.presence is not None and (delta := room.presence.state()) is not None:
+                self.backplane.publish_presence(room_name, delta)
+
+    def _deliver(self, room_name: str, envelope: Envelope):
+        room = self.rooms.find(room_name)
+        if room is not None:
+            room.append(envelope)
+            room.broadcast(envelope)
+
+    def _deliver_presence(self, room_name: str, frame: str):
+        room = self.rooms.find(room_name)
+        if room is not None and self._presence(room).apply(codec.loads(frame)):
+            room.broadcast(Envelope(text=frame))
+
+    async def _missed(self, room: Room, resume_from: int):
+        """What a client that last saw ``resume_from`` missed, or None."""
+        missed = room.since(resume_from)
+        if missed is not None:
+            return missed
+        # Older than the local ring: ask the backplane (and its durable log).
+        first_seq, has_more, envelopes = await self.backplane.page(
+            room.name, after_seq=resume_from, limit=config.RESUME_MAX_MESSAGES)
+        if first_seq is None or has_more:
+            return None
+        # Plus anything delivered to the room while we waited.
+        newer = room.since(envelopes[-1].seq if envelopes else resume_from)
+        return None if newer is None else envelopes + newer
+
+    async def connect(self, websocket: WebSocket, room: Room, username: str = None,
+                      resume_from: int = None) -> Connection:
+        await websocket.accept()
+        await self._subscribe(room)
+        missed = None
+        if resume_from is not None:
+            missed = await self._missed(room, _client_seq(resume_from))
+        connection = Connection(websocket, self.queue_size, self.policy,
+                                on_close=self.disconnect)
+        connection.room = room
+        connection.username = username
+        # Queue the backlog before joining so it precedes live messages.
+        if missed:
+            connection.send("[" + ",".join(e.text for e in missed) + "]")
+        elif missed is None and (room.history or resume_from is not None):
+            connection.send(room.snapshot())
+        connection.start()
+        self.connections[connection.id] = connection
+        self.rooms.join(room, connection)
+        presence = self._presence(room)
+        if username is not None:
+            presence.join(username)
+        connection.send(presence.roster())
+        if self.heartbeat is not None:
+            self.heartbeat.track(connection)
+        return connection
+
+    def identify(self, connection: Connection, username: str):
+        """Name a connection that joined without one, from its first message."""
+        connection.username = username
+        self._presence(connection.room).join(username)
+
+    def typing(self, connection: Connection, active: bool = True):
+        if connection.username is not None:
+            self._presence(connection.room).set_typing(connection.username, active)
+
+    def disconnect(self, connection: Connection):
+        if self.connections.pop(connection.id, None) is not None:
+            if connection.username is not None and connection.room.presence is not None:
+                connection.room.presence.leave(connection.username)
+            self.rooms.leave(connection.room, connection)
+            if self.heartbeat is not None:
+                self.heartbeat.forget(connection)
+        connection.close()
+
+    async def history_page(self, room_name: str, before=None, before_seq=None,
+                           limit: int = config.HISTORY_PAGE_MAX) -> str:
+        await self.start()
+        limit = max(1, min(limit, config.HISTORY_PAGE_MAX))
+        first_seq, has_more, envelopes = await self.backplane.page(
+            room_name, before=before, before_seq=_client_seq(before_seq), limit=limit)
+        return page_frame(first_seq, has_more, envelopes)
+
+    async def search(self, room_name: str, query: str, username: str = None, since: float = None,
+                     until: float = None, before_seq: int = None, limit: int = 20):
+        """A search results frame, or None while the room's index is being built."""
+        await self.start()
+        limit = max(1, min(limit, config.HISTORY_PAGE_MAX))
+        result = await self.backplane.search(room_name, query, username, since, until,
+                                             _client_seq(before_seq), limit)
+        return None if result is None else search_frame(*result)
+
+    async def submit(self, room: Room, message: dict) -> bool:
+        """Queue a validated message for the room's dispatcher; False if busy."""
+        if room.ingest is None:
+            room.ingest = IngestQueue(lambda message: self._dispatch(room, message),
+                                      config.INGEST_QUEUE_SIZE, self.ingest_budget)
+        return await room.ingest.put(message, config.INGEST_WAIT)
+
+    async def _dispatch(self, room: Room, message: dict):
+        if "replyTo" in message:
+            resolve_reply(message, room.lookup)
+        # Server receive time, which search filters by.
+        message["ts"] = round(time(), 3)
+        start = perf_counter()
+        envelope = Envelope(message)
+        metrics.serialize_seconds.observe(perf_counter() - start)
+        # Delivery to this room's local members (and history) happens when
+        # the backplane hands the message back, in the same order everywhere.
+        await self.backplane.publish(room.name, envelope)
+
+    def collect_metrics(self) -> list:
+        rooms = list(self.rooms.rooms.values())
+        connections = list(self.connections.values())
+        depths = [len(connection.pending) for connection in connections]
+        lines = []
+        lines += metrics.gauge("chat_connections", "Open websocket connections per room.",
+                               (({"room": room.name}, len(room.members)) for room in rooms))
+        lines += metrics.gauge("chat_send_queue_frames", "Frames waiting in per-socket send queues.",
+                               [(None, sum(depths))])
+        lines += metrics.gauge("chat_send_queue_max_depth", "Deepest per-socket send queue.",
+                               [(None, max(depths, default=0))])
+        lines += metrics.gauge("chat_send_queue_dropped", "Frames dropped by open connections' send queues.",
+                               [(None, sum(connection.dropped for connection in connections))])
+        lines += metrics.gauge("chat_ingest_pending", "Inbound messages waiting for a room dispatcher.",
+                               [(None, self.ingest_budget.pending)])
+        lines += metrics.gauge("chat_presence_online", "Distinct usernames online per room.",
+                               (({"room": room.name}, len(room.presence.online))
+                                for room in rooms if room.presence is not None))
+        lines += metrics.gauge("chat_history_messages", "Messages in each room's in-memory history.",
+                               (({"room": room.name}, len(room.history)) for room in rooms))
+        lines += metrics.gauge("chat_history_bytes", "Memory held by each room's in-memory history, in bytes.",
+                               (({"room": room.name}, room.history_bytes()) for room in rooms))
+        return lines
 
 
-@app.get("/")
-async def get():
-    return HTMLResponse(html)
+manager = ConnectionManager()
+metrics.register_collector(manager.collect_metrics)
+
+new_connection_limiter = limiter_factory(
+    config.RATE_LIMIT_MESSAGES, config.RATE_LIMIT_MESSAGE_BURST,
+    config.RATE_LIMIT_BYTES, config.RATE_LIMIT_BYTE_BURST,
+    config.RATE_LIMIT_MAX_DELAY, config.RATE_LIMIT_GRACE)
+
+
+@app.on_event("shutdown")
+async def stop_manager():
+    await manager.stop()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    lines = metrics.render()
+    compression = sys.modules.get("app.compression")
+    if compression is not None:
+        stats = compression.stats
+        lines += "\n".join(
+            metrics.counter("chat_deflate_bytes_in_total", "Bytes given to permessage-deflate.", stats.bytes_in)
+            + metrics.counter("chat_deflate_bytes_out_total", "Bytes produced by permessage-deflate.", stats.bytes_out)
+            + metrics.counter("chat_deflate_seconds_total", "Time spent compressing.", stats.seconds)
+            + metrics.counter("chat_deflate_skipped_total", "Messages sent uncompressed.", stats.skipped)
+        ) + "\n"
+    return PlainTextResponse(lines, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats/compression")
+async def compression_stats():
+    # Imported here: the protocol (and uvicorn) is only loaded by app.serve.
+    from app.compression import stats
+    return stats.as_dict()
+
+
+@app.get("/rooms/{room_name}/messages")
+async def get_messages(room_name: str, before: str = None, before_seq: int = None, limit: int = 50):
+    if not ROOM_NAME_RE.match(room_name):
+        raise HTTPException(status_code=404, detail="Room not found")
+    frame = await manager.history_page(room_name, before, before_seq, limit)
+    return Response(frame, media_type="application/json")
+
+
+@app.get("/rooms/{room_name}/search")
+async def search_messages(room_name: str, q: str, username: str = None, since: str = None,
+                          until: str = None, before_seq: int = None, limit: int = 20):
+    """Messages matching ``q`` (words and "quoted phrases"), newest first.
+
+    ``since`` and ``until`` take epoch seconds or ISO 8601 times; page with
+    ``before_seq`` set to the last result's seq. Answers 503 while a large
+    room's index is built on its first search.
+    """
+    if not ROOM_NAME_RE.match(room_name):
+        raise HTTPException(status_code=404, detail="Room not found")
+    if not parse_query(q):
+        raise HTTPException(status_code=400, detail="Empty query")
+    bounds = []
+    for value in (since, until):
+        bound = parse_time(value) if value is not None else None
+        if value is not None and bound is None:
+            raise HTTPException(status_code=400, detail=f"Invalid time: {value}")
+        bounds.append(bound)
+    frame = await manager.search(room_name, q, username, bounds[0], bounds[1], before_seq, limit)
+    if frame is None:
+        raise HTTPException(status_code=503, detail="Search index is being built",
+                            headers={"Retry-After": "1"})
+    return Response(frame, media_type="application/json")
+
+
+async def send_history_page(connection: Connection, request: dict):
+    before = request.get("before")
+    before_seq = request.get("before_seq")
+    limit = request.get("limit")
+    frame = await manager.history_page(
+        connection.room.name,
+        str(before) if before is not None else None,
+        before_seq if isinstance(before_seq, int) else None,
+        limit if isinstance(limit, int) else config.JOIN_HISTORY_SIZE,
+    )
+    connection.send(frame)
 
 
 @app.websocket("/ws/chat")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+@app.websocket("/ws/chat/{room_name}")
+async def websocket_endpoint(websocket: WebSocket, room_name: str = DEFAULT_ROOM):
+    if not ROOM_NAME_RE.match(room_name):
+        await websocket.close(code=1008)
+        return
+    room = manager.rooms.get(room_name)
+    resume_from = websocket.query_params.get("resume_from", "")
+    username = websocket.query_params.get("username")
+    if username is not None and not 0 < len(username) <= config.USERNAME_MAX_LENGTH:
+        username = None
+    # Send the room's chat history (or just what was missed) to the new user
+    connection = await manager.connect(websocket, room, username,
+                                       int(resume_from) if resume_from.isascii() and resume_from.isdecimal() else None)
+    limiter = new_connection_limiter() if new_connection_limiter is not None else None
 
     try:
-        # Send chat history to the new user
-        for message in chat_history:
-            await websocket.send_text(json.dumps(message))
-
         while True:
             data = await websocket.receive_text()
-            message = json.loads(data)
-            chat_history.append(message)
-            await manager.broadcast(message)
+            connection.last_seen = monotonic()
+            metrics.messages_in.value += 1
+            metrics.bytes_in.value += metrics.utf8_len(data)
+            if limiter is not None:
+                # Throttle by not reading further until the bucket allows it.
+                wait = limiter.take(len(data))
+                if wait is None:
+                    await connection.close_and_wait(RATE_LIMIT_CLOSE_CODE)
+                    return
+                if wait:
+                    await asyncio.sleep(wait)
+            start = perf_counter()
+            try:
+                message = decode_message(data)
+                metrics.decode_seconds.observe(perf_counter() - start)
+            except MessageError as e:
+                if e.too_big:
+                    await connection.close_and_wait(1009)
+                    return
+                connection.send(codec.dumps({"type": "error", "reason": str(e)}))
+                continue
+            if message["type"] == "pong":
+                continue
+            if message["type"] == "history":
+                await send_history_page(connection, message)
+                continue
+            if message["type"] == "typing":
+                manager.typing(connection, message["active"])
+                continue
+            if connection.username is None:
+                manager.identify(connection, message["username"])
+            if room.limiter is not None:
+                wait = room.limiter.take(len(data))
+                if wait is None:
+                    connection.send('{"type":"error","reason":"room is busy; message dropped"}')
+                    continue
+                if wait:
+                    await asyncio.sleep(wait)
+            if not await manager.submit(room, message):
+                connection.send('{"type":"error","reason":"server busy; message dropped"}')
+                continue
+            manager.typing(connection, False)
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
\ No newline at end of file
+        pass
+    finally:
+        manager.disconnect(connection)
@@ -0,0 +1,555 @@
+"""Room pub/sub shared by every worker serving the chat.
+
+A backplane carries published messages to every process with members in the
+room and owns the authoritative room history (the ``Hub``). Subscribers get
+three callbacks, always invoked in stream order:
+
+* ``restore(room, envelopes)`` with the room's history when a subscription
+  starts (or restarts after a reconnect),
+* ``deliver(room, envelope)`` for every message published afterwards, and
+* ``presence(room, frame)`` with the room-wide roster when a subscription
+  starts, then each room-wide presence delta, merged from what every worker
+  reports with ``publish_presence`` (see ``app.presence``).
+
+``InProcessBackplane`` is the single-worker default. ``UnixSocketBackplane``
+lets several uvicorn workers on one host share rooms: the first worker to take
+the lock file runs a small broker on a Unix-domain socket and every worker,
+including that one, connects to it as a client. If the broker's worker dies,
+another one takes over.
+"""
+import asyncio
+import fcntl
+import os
+import itertools
+import logging
+import struct
+
+from app.codec import Envelope, codec
+from app.history import RoomHistory
+from app.presence import PresenceHub
+
+logger = logging.getLogger(__name__)
+
+# Wire frame: length of the rest, opcode, room name length, then the room name
+# and the payload.
+_FRAME = struct.Struct("!IBH")
+_ITEM = struct.Struct("!I")
+_PAGE = struct.Struct("!IqB")  # request id, first seq (-1 for none), has more
+_FAILED = -2  # first seq of the reply to a request the broker could not answer
+
+SUBSCRIBE = 1
+UNSUBSCRIBE = 2
+PUBLISH = 3
+MESSAGE = 4
+HISTORY = 5
+PAGE = 6
+PAGE_REPLY = 7
+SEARCH = 8
+PRESENCE = 9
+
+
+class Hub:
+    """Per-room history, kept by whichever process sequences the messages.
+
+    With a ``ChatLogStore`` (made by ``store_factory`` when the hub first
+    needs it) every message is also appended to the room's durable log, and a
+    room's recent history is reloaded from it on first use.
+    Such a room is closed again once no subscriber is left (``release``);
+    reads of a room that has nothing stored see it empty without creating it.
+    """
+
+    def __init__(self, history_size: int = 100, store_factory=None, history_bytes: int = None,
+                 spill: bool = False):
+        self.history_size = history_size
+        self.history_bytes = history_bytes
+        self.spill = spill
+        self.histories = {}
+        self._store_factory = store_factory
+        self._store = None
+        self._closing = {}  # room -> task closing its log
+
+    @property
+    def store(self):
+        if self._store_factory is not None:
+            self._store, self._store_factory = self._store_factory(), None
+        return self._store
+
+    async def room(self, room: str) -> RoomHistory:
+        """The room's history, loaded on first use.
+
+        Its log is opened (and recovered) on the store's IO pool; callers
+        that arrive meanwhile wait for the same open.
+        """
+        history = self.histories.get(room)
+        if history is None:
+            closing = self._closing.get(room)
+            if closing is not None:
+                await asyncio.shield(closing)
+            log = await self.store.open(room) if self.store is not None else None
+            history = self.histories.get(room)
+            if history is None:
+                history = self.histories[room] = RoomHistory(self.history_size, log, self.history_bytes,
+                                                             self.spill)
+        return history
+
+    async def _stored(self, room: str) -> RoomHistory:
+        # For reads: an empty, throwaway history stands in for a room that
+        # has nothing stored, so unknown room names open no logs.
+        if room in self.histories or (self.store is not None and self.store.exists(room)):
+            return await self.room(room)
+        return RoomHistory(self.history_size)
+
+    def release(self, room: str):
+        """Close a room nobody subscribes to any more; its log keeps the history.
+
+        Without a store the hub holds the only copy of it, which is kept.
+        """
+        if self.store is None:
+            return
+        history = self.histories.pop(room, None)
+        if history is not None:
+            self._closing[room] = asyncio.ensure_future(self._close(room, history))
+
+    async def _close(self, room: str, history: RoomHistory):
+        try:
+            history.close()
+            await self.store.release(room)
+        finally:
+            del self._closing[room]
+
+    async def append(self, room: str, envelope: Envelope) -> Envelope:
+        return (await self.room(room)).append(envelope)
+
+    async def history(self, room: str) -> list:
+        return list((await self.room(room)).recent)
+
+    async def page(self, room: str, before: str = None, before_seq: int = None,
+                   after_seq: int = None, limit: int = 50):
+        """Return ``(first_seq, has_more, envelopes)`` for one page of history.
+
+        ``before`` is a message ID, ``before_seq`` a sequence number; with
+        neither, the newest page is returned. ``after_seq`` instead pages
+        forward (for resuming); there ``first_seq`` is None if the messages
+        right after it are gone and ``has_more`` means the page was cut short.
+        """
+        history = await self._stored(room)
+        if after_seq is not None:
+            # Past the end there is nothing yet; the cursor stays in range.
+            after_seq = min(max(after_seq, 0), history.last_seq)
+            envelopes = history.since(after_seq, limit)
+            if envelopes is None:
+                return None, False, []
+            return after_seq + 1, history.last_seq > after_seq + len(envelopes), envelopes
+        if before is not None:
+            before_seq = await history.seq_of(before)
+            if before_seq is None:
+                return None, False, []
+        if before_seq is not None:
+            before_seq = max(before_seq, history.first_seq)
+        first_seq, envelopes = history.page(before_seq, limit)
+        return first_seq, first_seq > history.first_seq, envelopes
+
+    async def search(self, room: str, query: str, username: str = None, since: float = None,
+                     until: float = None, before_seq: int = None, limit: int = 20):
+        """Return ``(has_more, envelopes)``: matches for ``query``, newest first.
+
+        None while the room's search index is being built.
+        """
+        return (await self._stored(room)).search(query, username, since, until, before_seq, limit)
+
+    async def close(self):
+        for history in self.histories.values():
+            history.close()
+        await asyncio.gather(*self._closing.values(), return_exceptions=True)
+        # A store never used is never created.
+        if self._store is not None:
+            try:
+                await self._store.flush()
+            finally:
+                self._store.close()
+
+
+class InProcessBackplane:
+    def __init__(self, history_size: int = 100, store_factory=None, history_bytes: int = None,
+                 spill: bool = False):
+        self.hub = Hub(history_size, store_factory, history_bytes, spill)
+        self.presence = PresenceHub()
+        self.rooms = set()
+        self._deliver = None
+        self._restore = None
+        self._presence = None
+
+    @property
+    def started(self) -> bool:
+        return self._deliver is not None
+
+    async def start(self, deliver, restore, presence):
+        self._deliver = deliver
+        self._restore = restore
+        self._presence = presence
+
+    async def subscribe(self, room: str):
+        self.rooms.add(room)
+        history = await self.hub.history(room)
+        self._presence(room, codec.dumps(self.presence.roster(room)))
+        self._restore(room, history)
+
+    def unsubscribe(self, room: str):
+        self.rooms.discard(room)
+        self.presence.drop(None, room)
+        self.hub.release(room)
+
+    def publish_presence(self, room: str, delta: dict):
+        update = self.presence.update(room, None, delta)
+        if update is not None and room in self.rooms:
+            self._presence(room, codec.dumps(update))
+
+    async def publish(self, room: str, envelope: Envelope):
+        envelope = await self.hub.append(room, envelope)
+        if room in self.rooms:
+            self._deliver(room, envelope)
+
+    async def page(self, room: str, before: str = None, before_seq: int = None,
+                   after_seq: int = None, limit: int = 50):
+        return await self.hub.page(room, before, before_seq, after_seq, limit)
+
+    async def search(self, room: str, query: str, username: str = None, since: float = None,
+                     until: float = None, before_seq: int = None, limit: int = 20):
+        return await self.hub.search(room, query, username, since, until, before_seq, limit)
+
+    async def close(self):
+        self._deliver = self._restore = self._presence = None
+        await self.hub.close()
+
+
+def _encode_frame(op: int, room: str, payload: bytes = b"") -> bytes:
+    room_bytes = room.encode()
+    return _FRAME.pack(3 + len(room_bytes) + len(payload), op, len(room_bytes)) + room_bytes + payload
+
+
+async def _read_frame(reader: asyncio.StreamReader):
+    header = await reader.readexactly(_FRAME.size)
+    length, op, room_length = _FRAME.unpack(header)
+    body = await reader.readexactly(length - 3)
+    return op, body[:room_length].decode(), body[room_length:]
+
+
+def _pack_items(items) -> bytes:
+    return b"".join(_ITEM.pack(len(item)) + item for item in items)
+
+
+def _unpack_items(payload: bytes) -> list:
+    items = []
+    offset = 0
+    while offset < len(payload):
+        (length,) = _ITEM.unpack_from(payload, offset)
+        offset += _ITEM.size
+        items.append(payload[offset:offset + length])
+        offset += length
+    return items
+
+
+class Broker:
+    def __init__(self, hub: Hub):
+        self.hub = hub
+        self.presence = PresenceHub()
+        self.subscribers = {}
+        self.handlers = {}  # writer -> the task reading from that worker
+        self.closed = False
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        rooms = set()
+        self.handlers[writer] = asyncio.current_task()
+        try:
+            while True:
+                op, room, payload = await _read_frame(reader)
+                if self.closed:
+                    break
+                try:
+                    await self._dispatch(op, room, payload, writer, rooms)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    raise
+                except Exception:
+                    # One bad request or failed log must not cost the worker
+                    # its connection, and with it every other room.
+                    logger.exception("backplane broker failed op %d for room %r", op, room)
+                    self._failed(op, room, payload, writer, rooms)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for room in rooms:
+                self._leave(room, writer)
+            del self.handlers[writer]
+            writer.close()
+
+    async def _dispatch(self, op: int, room: str, payload: bytes, writer: asyncio.StreamWriter,
+                        rooms: set):
+        if op == PUBLISH:
+            envelope = await self.hub.append(room, Envelope.decode(payload.decode()))
+            frame = _encode_frame(MESSAGE, room, envelope.data)
+            for subscriber in self.subscribers.get(room, ()):
+                subscriber.write(frame)
+            await writer.drain()
+        elif op == SUBSCRIBE:
+            history = await self.hub.history(room)
+            # The roster first: the history completes the subscription.
+            writer.write(_encode_frame(PRESENCE, room, codec.dumps(self.presence.roster(room)).encode()))
+            writer.write(_encode_frame(HISTORY, room, _pack_items(e.data for e in history)))
+            self.subscribers.setdefault(room, set()).add(writer)
+            rooms.add(room)
+        elif op == UNSUBSCRIBE:
+            self._leave(room, writer)
+            rooms.discard(room)
+        elif op == PRESENCE:
+            update = self.presence.update(room, writer, codec.loads(payload))
+            if update is not None:
+                self._send_presence(room, update)
+        elif op == PAGE:
+            request = codec.loads(payload)
+            first_seq, has_more, envelopes = await self.hub.page(
+                room, request.get("before"), request.get("before_seq"),
+                request.get("after_seq"), request["limit"])
+            reply = _PAGE.pack(request["id"], -1 if first_seq is None else first_seq, has_more)
+            writer.write(_encode_frame(PAGE_REPLY, room, reply + _pack_items(e.data for e in envelopes)))
+        elif op == SEARCH:
+            # Answered like a page, without a cursor: -1 while the index is
+            # being built, else 0.
+            request = codec.loads(payload)
+            result = await self.hub.search(
+                room, request["query"], request.get("username"), request.get("since"),
+                request.get("until"), request.get("before_seq"), request["limit"])
+            has_more, envelopes = result or (False, [])
+            reply = _PAGE.pack(request["id"], -1 if result is None else 0, has_more)
+            writer.write(_encode_frame(PAGE_REPLY, room, reply + _pack_items(e.data for e in envelopes)))
+
+    def _failed(self, op: int, room: str, payload: bytes, writer: asyncio.StreamWriter, rooms: set):
+        # Answer what the worker is waiting for. A publish is lost (it was
+        # logged); a subscription goes ahead without history.
+        if op in (PAGE, SEARCH):
+            try:
+                request_id = codec.loads(payload)["id"]
+            except Exception:
+                return
+            writer.write(_encode_frame(PAGE_REPLY, room, _PAGE.pack(request_id, _FAILED, 0)))
+        elif op == SUBSCRIBE and room not in rooms:
+            writer.write(_encode_frame(PRESENCE, room, codec.dumps(self.presence.roster(room)).encode()))
+            writer.write(_encode_frame(HISTORY, room, _pack_items(())))
+            self.subscribers.setdefault(room, set()).add(writer)
+            rooms.add(room)
+
+    def _leave(self, room: str, writer: asyncio.StreamWriter):
+        members = self.subscribers.get(room)
+        if members is not None:
+            members.discard(writer)
+            if not members:
+                del self.subscribers[room]
+                self.hub.release(room)
+        # The worker's members are gone from the room with it.
+        for _, update in self.presence.drop(writer, room):
+            self._send_presence(room, update)
+
+    def _send_presence(self, room: str, update: dict):
+        frame = _encode_frame(PRESENCE, room, codec.dumps(update).encode())
+        for subscriber in self.subscribers.get(room, ()):
+            subscriber.write(frame)
+
+    async def close(self):
+        """Drop every worker connection, so nothing reaches the hub after this.
+
+        ``Server.close`` only stops accepting; connections it already
+        accepted would keep publishing into a closed hub.
+        """
+        self.closed = True
+        handlers = list(self.handlers.values())
+        for writer in list(self.handlers):
+            writer.close()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+
+class UnixSocketBackplane:
+    def __init__(self, path: str, history_size: int = 100, store_factory=None,
+                 history_bytes: int = None, spill: bool = False):
+        self.path = path
+        self.history_size = history_size
+        self.history_bytes = history_bytes
+        self.spill = spill
+        # Only the broker persists, so there is a single writer per log.
+        self.store_factory = store_factory
+        self.hub = None
+        self.rooms = set()
+        self.is_broker = False
+        self._deliver = None
+        self._restore = None
+        self._presence = None
+        self._waiters = {}
+        self._requests = {}
+        self._request_ids = itertools.count(1)
+        self._lock_fd = None
+        self._server = None
+        self._broker = None
+        self._reader = None
+        self._writer = None
+        self._connected = asyncio.Event()
+        self._reader_task = None
+
+    @property
+    def started(self) -> bool:
+        return self._reader_task is not None
+
+    async def start(self, deliver, restore, presence):
+        self._deliver = deliver
+        self._restore = restore
+        self._presence = presence
+        await self._connect()
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    def _try_become_broker(self) -> bool:
+        if self._lock_fd is None:
+            fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._lock_fd = fd
+        return True
+
+    async def _connect(self):
+        while True:
+            if self._server is None and self._try_become_broker():
+                if os.path.exists(self.path):
+                    os.unlink(self.path)  # left behind by a dead broker
+                self.hub = Hub(self.history_size, self.store_factory, self.history_bytes, self.spill)
+                self._broker = Broker(self.hub)
+                self._server = await asyncio.start_unix_server(self._broker.handle, self.path)
+                self.is_broker = True
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.05)
+                continue
+            self._reader, self._writer = reader, writer
+            for room in self.rooms:
+                writer.write(_encode_frame(SUBSCRIBE, room))
+            self._connected.set()
+            return
+
+    async def _read_loop(self):
+        while True:
+            try:
+                op, room, payload = await _read_frame(self._reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                # The broker went away: reconnect, possibly taking over.
+                self._connected.clear()
+                for waiter in self._requests.values():
+                    if not waiter.done():
+                        waiter.set_exception(ConnectionError("backplane broker went away"))
+                self._writer.close()
+                await self._connect()
+                continue
+            if op == PAGE_REPLY:
+                request_id, first_seq, has_more = _PAGE.unpack_from(payload)
+                envelopes = [Envelope.decode(item.decode()) for item in _unpack_items(payload[_PAGE.size:])]
+                waiter = self._requests.pop(request_id, None)
+                if waiter is None or waiter.done():
+                    pass
+                elif first_seq == _FAILED:
+                    waiter.set_exception(RuntimeError("backplane broker failed the request; see its log"))
+                else:
+                    waiter.set_result((None if first_seq < 0 else first_seq, bool(has_more), envelopes))
+                continue
+            if room not in self.rooms:
+                continue
+            if op == MESSAGE:
+                self._deliver(room, Envelope.decode(payload.decode()))
+            elif op == HISTORY:
+                self._restore(room, [Envelope.decode(item.decode()) for item in _unpack_items(payload)])
+                for waiter in self._waiters.pop(room, ()):
+                    if not waiter.done():
+                        waiter.set_result(None)
+            elif op == PRESENCE:
+                self._presence(room, payload.decode())
+
+    async def _send(self, frame: bytes):
+        await self._connected.wait()
+        self._writer.write(frame)
+        await self._writer.drain()
+
+    async def subscribe(self, room: str):
+        if room in self.rooms and room not in self._waiters:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(room, []).append(waiter)
+        if room not in self.rooms:
+            self.rooms.add(room)
+            await self._send(_encode_frame(SUBSCRIBE, room))
+        await waiter
+
+    def unsubscribe(self, room: str):
+        # Synchronous so that a later subscribe to the same room is always
+        # ordered after it on the wire.
+        if room in self.rooms:
+            self.rooms.discard(room)
+            if self._connected.is_set():
+                self._writer.write(_encode_frame(UNSUBSCRIBE, room))
+
+    async def publish(self, room: str, envelope: Envelope):
+        await self._send(_encode_frame(PUBLISH, room, envelope.data))
+
+    def publish_presence(self, room: str, delta: dict):
+        # Dropped while disconnected: members are reported afresh when the
+        # room is restored after reconnecting.
+        if room in self.rooms and self._connected.is_set():
+            self._writer.write(_encode_frame(PRESENCE, room, codec.dumps(delta).encode()))
+
+    async def page(self, room: str, before: str = None, before_seq: int = None,
+                   after_seq: int = None, limit: int = 50):
+        return await self._request(PAGE, room, {"before": before, "before_seq": before_seq,
+                                                "after_seq": after_seq, "limit": limit})
+
+    async def search(self, room: str, query: str, username: str = None, since: float = None,
+                     until: float = None, before_seq: int = None, limit: int = 20):
+        first_seq, has_more, envelopes = await self._request(SEARCH, room, {
+            "query": query, "username": username, "since": since, "until": until,
+            "before_seq": before_seq, "limit": limit})
+        # No cursor means the broker's index is still being built.
+        return None if first_seq is None else (has_more, envelopes)
+
+    async def _request(self, op: int, room: str, request: dict):
+        request_id = next(self._request_ids)
+        waiter = asyncio.get_running_loop().create_future()
+        self._requests[request_id] = waiter
+        try:
+            await self._send(_encode_frame(op, room, codec.dumps({"id": request_id, **request}).encode()))
+            return await waiter
+        finally:
+            self._requests.pop(request_id, None)
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            await self._broker.close()
+            await self.hub.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+def create_backplane(url: str, history_size: int = 100, store_factory=None, history_bytes: int = None,
+                     spill: bool = False):
+    """Build a backplane from ``memory`` or ``unix:/path/to/broker.sock``.
+
+    ``store_factory`` returns the durable ``ChatLogStore`` for the process
+    that ends up owning the history, if persistence is enabled.
+    """
+    if url in ("", "memory"):
+        return InProcessBackplane(history_size, store_factory, history_bytes, spill)
+    if url.startswith("unix:"):
+        return UnixSocketBackplane(url[len("unix:"):], history_size, store_factory, history_bytes, spill)
+    raise ValueError(f"unknown backplane: {url!r}")
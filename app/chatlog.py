@@ -0,0 +1,388 @@
+"""Durable, append-only chat log.
+
+Each room gets a directory of segment files. A segment ``<base>.log`` holds
+length-prefixed, CRC-checked records; its sidecar ``<base>.idx`` holds the
+byte position of every record, so reading the last N records (or any offset
+range) touches only those records. Records are addressed by their offset, a
+dense counter starting at 0, and may carry a short key (the client's message
+ID) that ``find`` maps back to an offset.
+
+Appends return immediately. Everything appended during one event loop turn
+is written and fsynced as a single group commit on a background thread, and
+the next batch forms while that one is in flight. Reads come straight out of
+memory-mapped segments.
+
+A group commit that fails leaves the log unusable until it is reopened.
+Records after the failed batch already have file positions reserved behind
+it, so nothing more can be written in order. From then on appends and
+flushes raise, and reopening the log recovers whatever reached the disk.
+"""
+import array
+import asyncio
+import bisect
+import fcntl
+import mmap
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+_RECORD = struct.Struct("!IIH")  # body length, crc32 of body, key length
+_POSITION_SIZE = array.array("Q").itemsize
+
+_io_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chatlog")
+
+
+class Segment:
+    def __init__(self, directory: str, base: int):
+        self.base = base
+        self.log_path = os.path.join(directory, f"{base:020d}.log")
+        self.idx_path = os.path.join(directory, f"{base:020d}.idx")
+        self.positions = array.array("Q")
+        self.size = 0  # bytes assigned, including records not yet written
+        self.sealed = False
+        self._log = None
+        self._idx = None
+        self._map = None
+
+    def open(self):
+        self._log = open(self.log_path, "ab")
+        self._idx = open(self.idx_path, "ab")
+
+    def recover(self):
+        """Load the index and drop any torn or unindexed tail left by a crash."""
+        with open(self.idx_path, "rb") as f:
+            raw = f.read()
+        raw = raw[:len(raw) - len(raw) % _POSITION_SIZE]
+        self.positions.frombytes(raw)
+        file_size = os.path.getsize(self.log_path)
+        with open(self.log_path, "rb") as f:
+            data = f.read()
+        valid = []
+        position = 0
+        for expected in self.positions:
+            if expected != position or not self._valid_at(data, position):
+                break
+            valid.append(position)
+            position += _RECORD.size + _RECORD.unpack_from(data, position)[0]
+        # Records written after the last index flush can still be recovered.
+        while self._valid_at(data, position):
+            valid.append(position)
+            position += _RECORD.size + _RECORD.unpack_from(data, position)[0]
+        self.positions = array.array("Q", valid)
+        self.size = position
+        if position != file_size:
+            with open(self.log_path, "r+b") as f:
+                f.truncate(position)
+        with open(self.idx_path, "wb") as f:
+            f.write(self.positions.tobytes())
+
+    @staticmethod
+    def _valid_at(data: bytes, position: int) -> bool:
+        if position + _RECORD.size > len(data):
+            return False
+        length, crc, key_length = _RECORD.unpack_from(data, position)
+        end = position + _RECORD.size + length
+        return (key_length <= length and end <= len(data)
+                and zlib.crc32(data[position + _RECORD.size:end]) == crc)
+
+    def write(self, chunk: bytes, positions: bytes, sync: bool):
+        if self._log is None:
+            self.open()
+        self._log.write(chunk)
+        self._log.flush()
+        if sync:
+            os.fsync(self._log.fileno())
+        # The index is rebuilt from the log after a crash, so it is flushed
+        # but never fsynced.
+        self._idx.write(positions)
+        self._idx.flush()
+        if self.sealed:
+            # Usually its last write; a straggler just reopens it.
+            self._close_files()
+
+    def _body(self, position: int):
+        if self._map is None or position + _RECORD.size > len(self._map):
+            self._remap()
+        length, _, key_length = _RECORD.unpack_from(self._map, position)
+        start = position + _RECORD.size
+        if start + length > len(self._map):
+            self._remap()
+        return start, start + key_length, start + length
+
+    def view(self, position: int) -> memoryview:
+        _, payload_start, end = self._body(position)
+        return memoryview(self._map)[payload_start:end]
+
+    def key(self, position: int) -> bytes:
+        start, key_end, _ = self._body(position)
+        return self._map[start:key_end]
+
+    def _remap(self):
+        with open(self.log_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _close_files(self):
+        for f in (self._log, self._idx):
+            if f is not None:
+                f.close()
+        self._log = self._idx = None
+
+    def close(self):
+        self._close_files()
+        # Views handed out by ``view`` keep their own reference to the map.
+        self._map = None
+
+
+class SegmentedLog:
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024, sync: bool = True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync = sync
+        self.segments = []
+        self._bases = []
+        self._next_offset = 0
+        self._durable_offset = 0
+        self._unflushed = {}
+        self._keys = None
+        self._keys_loaded = None
+        self._batch = []
+        self._flushing = None
+        self._waiters = []
+        self._error = None  # why a group commit failed, if one did
+        os.makedirs(directory, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(directory, ".lock"), os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._lock_fd)
+            raise RuntimeError(
+                f"chat log {directory} is in use by another process; "
+                "run multiple workers with the unix backplane") from None
+        self._recover()
+
+    def __len__(self):
+        return self._next_offset
+
+    @property
+    def durable_offset(self) -> int:
+        return self._durable_offset
+
+    def _recover(self):
+        bases = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".log"))
+        for base in bases:
+            segment = Segment(self.directory, base)
+            if not os.path.exists(segment.idx_path):
+                open(segment.idx_path, "wb").close()
+            segment.recover()
+            if base != self._next_offset:
+                # A gap means a later segment can't be trusted; stop here.
+                break
+            self._add_segment(segment)
+            self._next_offset = base + len(segment.positions)
+        if not self.segments:
+            self._add_segment(Segment(self.directory, 0))
+        self.segments[-1].open()
+        self._durable_offset = self._next_offset
+
+    def _add_segment(self, segment: Segment):
+        self.segments.append(segment)
+        self._bases.append(segment.base)
+
+    def append(self, payload: bytes, key: bytes = b"") -> int:
+        """Queue ``payload`` for the next group commit and return its offset."""
+        self._check()
+        segment = self.segments[-1]
+        body = key + payload
+        record_size = _RECORD.size + len(body)
+        if segment.size and segment.size + record_size > self.segment_bytes:
+            segment.sealed = True
+            segment = Segment(self.directory, self._next_offset)
+            segment.open()
+            self._add_segment(segment)
+        offset = self._next_offset
+        self._next_offset += 1
+        segment.positions.append(segment.size)
+        self._batch.append((segment, segment.size, _RECORD.pack(len(body), zlib.crc32(body), len(key)) + body))
+        segment.size += record_size
+        self._unflushed[offset] = (key, payload)
+        if key and self._keys is not None:
+            self._keys[key] = offset
+        if self._flushing is None:
+            self._flushing = asyncio.get_running_loop().call_soon(self._commit)
+        return offset
+
+    def _commit(self):
+        batch, self._batch = self._batch, []
+        last_offset = self._next_offset
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_io_pool, self._write_batch, batch)
+        future.add_done_callback(lambda f: self._committed(f, last_offset))
+
+    def _write_batch(self, batch: list):
+        # Runs on the IO thread: one write and at most one fsync per segment.
+        by_segment = {}
+        for segment, position, record in batch:
+            chunks, positions = by_segment.setdefault(segment, ([], array.array("Q")))
+            chunks.append(record)
+            positions.append(position)
+        for segment, (chunks, positions) in by_segment.items():
+            segment.write(b"".join(chunks), positions.tobytes(), self.sync)
+
+    def _committed(self, future, last_offset: int):
+        error = future.exception()
+        if error is None:
+            for offset in range(self._durable_offset, last_offset):
+                self._unflushed.pop(offset, None)
+            self._durable_offset = last_offset
+        else:
+            # What was appended is still readable from ``_unflushed``, but
+            # none of it is ever marked durable.
+            self._error = error
+            self._batch = []
+        waiters, self._waiters = self._waiters, []
+        for offset, waiter in waiters:
+            if waiter.done():
+                continue
+            if error is not None:
+                waiter.set_exception(error)
+            elif offset <= last_offset:
+                waiter.set_result(None)
+            else:
+                self._waiters.append((offset, waiter))
+        if self._batch:
+            self._commit()
+        else:
+            self._flushing = None
+
+    async def flush(self):
+        """Wait until everything appended so far is durable."""
+        self._check()
+        target = self._next_offset
+        if self._durable_offset >= target:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((target, waiter))
+        await waiter
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError(f"chat log {self.directory} failed a write; reopen it to recover") from self._error
+
+    def read(self, start: int, stop: int) -> list:
+        """Return the payloads of records ``start`` up to ``stop``.
+
+        Durable records are zero-copy views into the memory-mapped segment.
+        """
+        start = max(start, 0)
+        stop = min(stop, self._next_offset)
+        records = []
+        for offset in range(start, stop):
+            pending = self._unflushed.get(offset)
+            if pending is None:
+                segment = self.segments[bisect.bisect_right(self._bases, offset) - 1]
+                records.append(segment.view(segment.positions[offset - segment.base]))
+            else:
+                records.append(pending[1])
+        return records
+
+    async def find(self, key: bytes):
+        """Offset of the latest record appended with ``key``, or None.
+
+        The key index is built on first use by reading only the record keys,
+        on the IO pool, then kept up to date by ``append``.
+        """
+        if self._keys_loaded is None:
+            self._keys_loaded = asyncio.ensure_future(self._load_keys())
+        await asyncio.shield(self._keys_loaded)
+        return self._keys.get(key)
+
+    async def _load_keys(self):
+        # Keys appended from now on land in ``_keys`` directly; records still
+        # waiting to be committed are taken from memory, the rest read from
+        # the segments.
+        self._keys = {}
+        durable = self._durable_offset
+        pending = sorted((offset, key) for offset, (key, _) in self._unflushed.items() if key)
+        keys = await asyncio.get_running_loop().run_in_executor(_io_pool, self._read_keys, durable)
+        keys.update((bytes(key), offset) for offset, key in pending)
+        keys.update(self._keys)
+        self._keys = keys
+
+    def _read_keys(self, stop: int) -> dict:
+        # Runs on the IO thread, over records that are already on disk.
+        keys = {}
+        for segment in list(self.segments):
+            for i in range(min(len(segment.positions), stop - segment.base)):
+                record_key = segment.key(segment.positions[i])
+                if record_key:
+                    keys[record_key] = segment.base + i
+        return keys
+
+    def tail(self, count: int) -> list:
+        return self.read(self._next_offset - count, self._next_offset)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+class ChatLogStore:
+    """One ``SegmentedLog`` per room under ``root``, opened on first use."""
+
+    def __init__(self, root: str, segment_bytes: int = 64 * 1024 * 1024, sync: bool = True):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.sync = sync
+        self.logs = {}
+        self._opening = {}  # room -> future of the log being opened
+
+    def log(self, room: str) -> SegmentedLog:
+        log = self.logs.get(room)
+        if log is None:
+            log = self.logs[room] = SegmentedLog(os.path.join(self.root, room), self.segment_bytes, self.sync)
+        return log
+
+    async def open(self, room: str) -> SegmentedLog:
+        """``log`` for the event loop: opening a log reads and checks every
+        segment, so it runs on the IO pool, once however many callers wait.
+        """
+        log = self.logs.get(room)
+        if log is not None:
+            return log
+        opening = self._opening.get(room)
+        if opening is None:
+            opening = self._opening[room] = asyncio.get_running_loop().run_in_executor(
+                _io_pool, SegmentedLog, os.path.join(self.root, room), self.segment_bytes, self.sync)
+            opening.add_done_callback(lambda future: self._opened(room, future))
+        return await asyncio.shield(opening)
+
+    def _opened(self, room: str, future):
+        del self._opening[room]
+        if not future.cancelled() and future.exception() is None:
+            self.logs[room] = future.result()
+
+    def exists(self, room: str) -> bool:
+        """Whether the room has a log, without opening (or creating) it."""
+        return room in self.logs or os.path.isdir(os.path.join(self.root, room))
+
+    async def release(self, room: str):
+        """Flush and close the room's log, if it is open."""
+        log = self.logs.pop(room, None)
+        if log is not None:
+            try:
+                await log.flush()
+            finally:
+                log.close()
+
+    async def flush(self):
+        for log in list(self.logs.values()):
+            await log.flush()
+
+    def close(self):
+        for log in self.logs.values():
+            log.close()
+        self.logs.clear()
@@ -0,0 +1,144 @@
+"""JSON codec shared by both apps, plus the pre-encoded message envelope.
+
+The fastest available backend is picked at import time (orjson, then msgspec,
+then the stdlib) unless ``CHAT_JSON_BACKEND`` names one explicitly.
+"""
+import json
+import os
+
+
+class StdlibCodec:
+    name = "json"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+        self._decoder = json.JSONDecoder()
+
+    def dumps(self, obj) -> str:
+        return self._encoder.encode(obj)
+
+    def loads(self, data):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data).decode()
+        return self._decoder.decode(data)
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, obj) -> str:
+        return self._orjson.dumps(obj).decode()
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+
+class MsgspecCodec:
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj) -> str:
+        return self._encoder.encode(obj).decode()
+
+    def loads(self, data):
+        return self._decoder.decode(data)
+
+
+BACKENDS = {
+    "orjson": OrjsonCodec,
+    "msgspec": MsgspecCodec,
+    "json": StdlibCodec,
+}
+
+
+def get_codec(name: str = None):
+    if name:
+        return BACKENDS[name]()
+    for backend in BACKENDS.values():
+        try:
+            return backend()
+        except ImportError:
+            continue
+    return StdlibCodec()
+
+
+codec = get_codec(os.environ.get("CHAT_JSON_BACKEND") or None)
+
+
+_SEQ_PREFIX = '{"seq":'
+
+
+class Envelope:
+    """A message encoded exactly once.
+
+    ``text`` goes to every socket and history replay; ``data`` is the UTF-8
+    form used for persistence and is only produced when first needed. An
+    envelope built from text alone (e.g. read back from another process)
+    decodes ``message`` lazily.
+    """
+
+    __slots__ = ("_message", "text", "_data", "_seq")
+
+    def __init__(self, message: dict = None, text: str = None):
+        self._message = message
+        self.text = codec.dumps(message) if text is None else text
+        self._data = None
+        self._seq = None
+
+    @classmethod
+    def decode(cls, text: str) -> "Envelope":
+        return cls(text=text)
+
+    @property
+    def message(self) -> dict:
+        if self._message is None:
+            self._message = codec.loads(self.text)
+        return self._message
+
+    @property
+    def seq(self):
+        """The room sequence number stamped by ``sequenced``, if any."""
+        if self._seq is None:
+            if self.text.startswith(_SEQ_PREFIX):
+                self._seq = int(self.text[len(_SEQ_PREFIX):self.text.index(",", len(_SEQ_PREFIX))])
+            else:
+                self._seq = self.message.get("seq")
+        return self._seq
+
+    def sequenced(self, seq: int) -> "Envelope":
+        """A copy stamped with its room sequence number, which is also its ID.
+
+        The stamp is spliced onto the front of the encoded text rather than
+        re-encoding the message.
+        """
+        stamp = '%s%d,"id":"%d"' % (_SEQ_PREFIX, seq, seq)
+        text = stamp + ("}" if self.text == "{}" else "," + self.text[1:])
+        message = None
+        if self._message is not None:
+            message = {"seq": seq, "id": str(seq), **self._message}
+        envelope = Envelope(message, text)
+        envelope._seq = seq
+        return envelope
+
+    def compact(self) -> "Envelope":
+        """Drop the decoded and UTF-8 forms, keeping just the text, for storage."""
+        self._message = None
+        self._data = None
+        return self
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = self.text.encode()
+        return self._data
+
+    def __len__(self):
+        return len(self.text)
@@ -0,0 +1,133 @@
+"""permessage-deflate tuned for chat traffic.
+
+uvicorn's websockets protocol offers permessage-deflate with zlib's defaults,
+which cost about 300 KB of compressor and decompressor state per socket and
+compress every frame. ``WebSocketProtocol`` replaces that offer with one built
+from ``app.config``:
+
+* frames under ``WS_DEFLATE_MIN_BYTES`` and frames carrying image data, which
+  is already compressed, are sent as-is;
+* window bits and zlib ``memLevel`` bound the per-connection memory, and
+  context takeover can be turned off to drop it between messages;
+* ``stats`` counts what went in and out and the time spent compressing.
+
+uvicorn's CLI only accepts its built-in protocol names, so ``app.serve``
+starts the server with this class.
+"""
+from time import perf_counter
+
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol as _UvicornWebSocketProtocol
+from websockets import frames
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+
+from app import config
+
+# Leading bytes of binary image formats; text frames with an inline data: URL
+# are recognised by the URL scheme.
+_IMAGE_MAGIC = (b"\xff\xd8\xff", b"\x89PNG", b"GIF8", b"RIFF")
+_DATA_URL = b'"data:image/'
+
+
+class CompressionStats:
+    __slots__ = ("messages", "skipped", "bytes_in", "bytes_out", "seconds")
+
+    def __init__(self):
+        self.messages = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    @property
+    def ratio(self) -> float:
+        """Compressed size over original size, for the frames compressed."""
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+    def as_dict(self) -> dict:
+        return {
+            "compressed_messages": self.messages,
+            "skipped_messages": self.skipped,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.ratio, 4),
+            "cpu_seconds": round(self.seconds, 6),
+            "us_per_message": round(self.seconds / self.messages * 1e6, 2) if self.messages else 0.0,
+        }
+
+
+stats = CompressionStats()
+
+
+def _incompressible(data, min_size: int) -> bool:
+    if len(data) < min_size:
+        return True
+    head = bytes(data[:4])
+    return head.startswith(_IMAGE_MAGIC) or _DATA_URL in data
+
+
+class SelectiveDeflate(PerMessageDeflate):
+    """``PerMessageDeflate`` that leaves small and image frames uncompressed.
+
+    RFC 7692 allows any message to go out uncompressed (RSV1 unset); skipping
+    one doesn't touch the compression context.
+    """
+
+    def __init__(self, *args, min_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self._skipping = False
+
+    def encode(self, frame: frames.Frame) -> frames.Frame:
+        if frame.opcode in frames.CTRL_OPCODES:
+            return frame
+        if frame.opcode is not frames.OP_CONT:
+            self._skipping = _incompressible(frame.data, self.min_size)
+            if self._skipping:
+                stats.skipped += 1
+        if self._skipping:
+            return frame
+        start = perf_counter()
+        encoded = super().encode(frame)
+        stats.seconds += perf_counter() - start
+        if frame.opcode is not frames.OP_CONT:
+            stats.messages += 1
+        stats.bytes_in += len(frame.data)
+        stats.bytes_out += len(encoded.data)
+        return encoded
+
+
+class SelectiveDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self, min_size: int = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        response, extension = super().process_request_params(params, accepted_extensions)
+        return response, SelectiveDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size,
+        )
+
+
+def deflate_factory() -> SelectiveDeflateFactory:
+    return SelectiveDeflateFactory(
+        min_size=config.WS_DEFLATE_MIN_BYTES,
+        server_no_context_takeover=config.WS_DEFLATE_SERVER_NO_CONTEXT_TAKEOVER,
+        client_no_context_takeover=config.WS_DEFLATE_CLIENT_NO_CONTEXT_TAKEOVER,
+        server_max_window_bits=config.WS_DEFLATE_SERVER_WINDOW_BITS,
+        client_max_window_bits=config.WS_DEFLATE_CLIENT_WINDOW_BITS,
+        compress_settings={"level": config.WS_DEFLATE_LEVEL, "memLevel": config.WS_DEFLATE_MEM_LEVEL},
+    )
+
+
+class WebSocketProtocol(_UvicornWebSocketProtocol):
+    """uvicorn's websockets protocol with the deflate offer from ``app.config``."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        enabled = config.WS_DEFLATE and self.config.ws_per_message_deflate
+        self.available_extensions = [deflate_factory()] if enabled else []
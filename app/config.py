@@ -0,0 +1,109 @@
+import os
+
+# Outbound fan-out: every connection gets its own bounded send queue.
+SEND_QUEUE_SIZE = int(os.environ.get("CHAT_SEND_QUEUE_SIZE", "256"))
+# What to do when a connection's send queue is full:
+# "drop_oldest", "coalesce" or "disconnect".
+SEND_QUEUE_POLICY = os.environ.get("CHAT_SEND_QUEUE_POLICY", "drop_oldest")
+
+# Uploaded images, stored content-addressed on local disk.
+MEDIA_DIR = os.environ.get("CHAT_MEDIA_DIR", os.path.join("data", "media"))
+MEDIA_MAX_BYTES = int(os.environ.get("CHAT_MEDIA_MAX_BYTES", str(10 * 1024 * 1024)))
+# Reply thumbnails kept in memory (LRU) and worker processes rendering them.
+THUMBNAIL_CACHE_SIZE = int(os.environ.get("CHAT_THUMBNAIL_CACHE_SIZE", "1024"))
+THUMBNAIL_WORKERS = int(os.environ.get("CHAT_THUMBNAIL_WORKERS", "2"))
+
+# Rooms: history kept per room, and how long an empty room lingers before
+# it is reclaimed.
+ROOM_HISTORY_SIZE = int(os.environ.get("CHAT_ROOM_HISTORY_SIZE", "100"))
+# Memory budget for each room's in-memory history, in bytes (0 for count
+# only); whichever of this and ROOM_HISTORY_SIZE is hit first evicts.
+ROOM_HISTORY_BYTES = int(os.environ.get("CHAT_ROOM_HISTORY_BYTES", str(1024 * 1024))) or None
+# With a durable log, write messages to it only as they are evicted from
+# memory (and at shutdown) instead of as they arrive.
+HISTORY_SPILL = os.environ.get("CHAT_HISTORY_SPILL", "0") == "1"
+ROOM_IDLE_TTL = float(os.environ.get("CHAT_ROOM_IDLE_TTL", "3600"))
+# Messages sent on join (roughly one screenful) and the largest page a
+# scrollback request may ask for.
+JOIN_HISTORY_SIZE = int(os.environ.get("CHAT_JOIN_HISTORY_SIZE", "30"))
+HISTORY_PAGE_MAX = int(os.environ.get("CHAT_HISTORY_PAGE_MAX", "100"))
+# A reconnecting client that missed more than this gets a fresh snapshot
+# instead of the delta.
+RESUME_MAX_MESSAGES = int(os.environ.get("CHAT_RESUME_MAX_MESSAGES", "500"))
+
+# Incoming messages: frames over MESSAGE_MAX_BYTES are refused unparsed.
+MESSAGE_MAX_BYTES = int(os.environ.get("CHAT_MESSAGE_MAX_BYTES", str(16 * 1024)))
+TEXT_MAX_LENGTH = int(os.environ.get("CHAT_TEXT_MAX_LENGTH", "4000"))
+USERNAME_MAX_LENGTH = int(os.environ.get("CHAT_USERNAME_MAX_LENGTH", "64"))
+
+# Token-bucket rate limits on incoming messages, per connection and per room
+# (per worker). A sender over its limit is slowed down by up to
+# RATE_LIMIT_MAX_DELAY seconds per message; once it needs longer, or has been
+# over the limit for RATE_LIMIT_GRACE seconds straight, a connection is closed
+# and a room drops the message. A rate of 0 disables a limit.
+RATE_LIMIT_MESSAGES = float(os.environ.get("CHAT_RATE_LIMIT_MESSAGES", "5"))
+RATE_LIMIT_MESSAGE_BURST = float(os.environ.get("CHAT_RATE_LIMIT_MESSAGE_BURST", "10"))
+RATE_LIMIT_BYTES = float(os.environ.get("CHAT_RATE_LIMIT_BYTES", str(32 * 1024)))
+RATE_LIMIT_BYTE_BURST = float(os.environ.get("CHAT_RATE_LIMIT_BYTE_BURST", str(64 * 1024)))
+ROOM_RATE_LIMIT_MESSAGES = float(os.environ.get("CHAT_ROOM_RATE_LIMIT_MESSAGES", "100"))
+ROOM_RATE_LIMIT_MESSAGE_BURST = float(os.environ.get("CHAT_ROOM_RATE_LIMIT_MESSAGE_BURST", "200"))
+ROOM_RATE_LIMIT_BYTES = float(os.environ.get("CHAT_ROOM_RATE_LIMIT_BYTES", str(1024 * 1024)))
+ROOM_RATE_LIMIT_BYTE_BURST = float(os.environ.get("CHAT_ROOM_RATE_LIMIT_BYTE_BURST", str(2 * 1024 * 1024)))
+RATE_LIMIT_MAX_DELAY = float(os.environ.get("CHAT_RATE_LIMIT_MAX_DELAY", "1.0"))
+RATE_LIMIT_GRACE = float(os.environ.get("CHAT_RATE_LIMIT_GRACE", "5.0"))
+
+# Micro-batching of broadcasts: messages to a room within this many
+# milliseconds go out as one array frame per connection, trading up to that
+# much added latency for fewer frames and writes. 0 sends each immediately.
+BROADCAST_BATCH_WINDOW_MS = float(os.environ.get("CHAT_BROADCAST_BATCH_WINDOW_MS", "0"))
+# A batch is sent early once it holds this many bytes.
+BROADCAST_BATCH_MAX_BYTES = int(os.environ.get("CHAT_BROADCAST_BATCH_MAX_BYTES", str(64 * 1024)))
+
+# permessage-deflate (when served through app.serve). Frames smaller than
+# WS_DEFLATE_MIN_BYTES, and image data, are sent uncompressed. Window bits
+# (8-15) and memLevel (1-9) bound compressor memory per connection, roughly
+# 2**(window bits + 2) + 2**(memLevel + 9) bytes; turning off server context
+# takeover frees it between messages at some cost in ratio.
+WS_DEFLATE = os.environ.get("CHAT_WS_DEFLATE", "1") not in ("0", "false", "no")
+WS_DEFLATE_MIN_BYTES = int(os.environ.get("CHAT_WS_DEFLATE_MIN_BYTES", "256"))
+WS_DEFLATE_LEVEL = int(os.environ.get("CHAT_WS_DEFLATE_LEVEL", "6"))
+WS_DEFLATE_MEM_LEVEL = int(os.environ.get("CHAT_WS_DEFLATE_MEM_LEVEL", "5"))
+WS_DEFLATE_SERVER_WINDOW_BITS = int(os.environ.get("CHAT_WS_DEFLATE_SERVER_WINDOW_BITS", "12"))
+WS_DEFLATE_CLIENT_WINDOW_BITS = int(os.environ.get("CHAT_WS_DEFLATE_CLIENT_WINDOW_BITS", "12"))
+WS_DEFLATE_SERVER_NO_CONTEXT_TAKEOVER = os.environ.get(
+    "CHAT_WS_DEFLATE_SERVER_NO_CONTEXT_TAKEOVER", "0") not in ("0", "false", "no")
+WS_DEFLATE_CLIENT_NO_CONTEXT_TAKEOVER = os.environ.get(
+    "CHAT_WS_DEFLATE_CLIENT_NO_CONTEXT_TAKEOVER", "0") not in ("0", "false", "no")
+
+# Heartbeat: a connection quiet for HEARTBEAT_INTERVAL seconds is pinged, and
+# one silent for IDLE_TIMEOUT seconds is closed. 0 turns heartbeats off.
+HEARTBEAT_INTERVAL = float(os.environ.get("CHAT_HEARTBEAT_INTERVAL", "25"))
+IDLE_TIMEOUT = float(os.environ.get("CHAT_IDLE_TIMEOUT", "60"))
+
+# Inbound messages wait in a bounded queue per room for that room's
+# dispatcher, with at most INGEST_MAX_PENDING queued across all rooms. A
+# sender is held up to INGEST_WAIT seconds when they are full, then told the
+# server is busy.
+INGEST_QUEUE_SIZE = int(os.environ.get("CHAT_INGEST_QUEUE_SIZE", "1000"))
+INGEST_MAX_PENDING = int(os.environ.get("CHAT_INGEST_MAX_PENDING", "20000"))
+INGEST_WAIT = float(os.environ.get("CHAT_INGEST_WAIT", "0.5"))
+
+# Presence: joins, leaves and typing changes are coalesced for this long
+# before one delta goes to the room; a typing indicator lapses unless the
+# client renews it within TYPING_TIMEOUT seconds.
+PRESENCE_WINDOW_MS = float(os.environ.get("CHAT_PRESENCE_WINDOW_MS", "250"))
+TYPING_TIMEOUT = float(os.environ.get("CHAT_TYPING_TIMEOUT", "6"))
+
+# Pub/sub backplane shared by workers: "memory" for a single process, or
+# "unix:/path/to/broker.sock" to share rooms between workers on one host.
+BACKPLANE = os.environ.get("CHAT_BACKPLANE", "memory")
+
+# Durable per-room chat log; set CHAT_LOG_DIR to an empty string to keep
+# history in memory only.
+LOG_DIR = os.environ.get("CHAT_LOG_DIR", os.path.join("data", "log"))
+LOG_SEGMENT_BYTES = int(os.environ.get("CHAT_LOG_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+LOG_FSYNC = os.environ.get("CHAT_LOG_FSYNC", "1") not in ("0", "false", "no")
+
+# Connections and history for the serverless websocket handler
+# (app.serverless), which keeps no state between invocations.
+SERVERLESS_DB = os.environ.get("CHAT_SERVERLESS_DB", os.path.join("data", "chat.sqlite3"))
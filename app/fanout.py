@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+from collections import deque
+from time import monotonic, time
+
+from fastapi import WebSocket
+
+from app import metrics
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+# 1013 "Try Again Later": the client was too slow to keep up with the room.
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+_connection_ids = itertools.count(1)
+
+
+class Connection:
+    """A websocket plus its bounded outbound queue and writer task.
+
+    ``send`` never awaits the network: it enqueues the already-encoded frame
+    and wakes the writer, so one slow client cannot stall everyone else.
+    """
+
+    __slots__ = ("id", "websocket", "username", "room", "joined_at", "last_seen", "maxsize", "policy",
+                 "pending", "dropped", "closed", "_on_close", "_wakeup", "_task")
+
+    def __init__(self, websocket: WebSocket, maxsize: int = 256,
+                 policy: str = DROP_OLDEST, on_close=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown send queue policy: {policy!r}")
+        self.id = next(_connection_ids)
+        self.websocket = websocket
+        self.username = None
+        self.room = None
+        self.joined_at = time()
+        # Last time anything arrived from the client (monotonic clock).
+        self.last_seen = monotonic()
+        self.maxsize = maxsize
+        self.policy = policy
+        self.pending = deque()
+        self.dropped = 0
+        self.closed = False
+        self._on_close = on_close
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    def send(self, frame: str) -> bool:
+        if self.closed:
+            return False
+        if len(self.pending) >= self.maxsize:
+            if self.policy == DROP_OLDEST:
+                self.pending.popleft()
+                self.dropped += 1
+            elif self.policy == COALESCE:
+                self._coalesce()
+            else:
+                self.close(SLOW_CONSUMER_CLOSE_CODE)
+                return False
+        self.pending.append(frame)
+        self._wakeup.set()
+        return True
+
+    def _coalesce(self):
+        # Fold the backlog into a single batch frame (a JSON array the client
+        # unpacks), keeping at most ``maxsize`` of the newest messages.
+        batch = []
+        for item in self.pending:
+            if isinstance(item, list):
+                batch.extend(item)
+            elif item.startswith("["):
+                batch.append(item[1:-1])  # already a batch frame; splice it in
+            else:
+                batch.append(item)
+        if len(batch) > self.maxsize:
+            self.dropped += len(batch) - self.maxsize
+            del batch[:len(batch) - self.maxsize]
+        self.pending.clear()
+        self.pending.append(batch)
+
+    async def _writer(self):
+        try:
+            while True:
+                if not self.pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                item = self.pending.popleft()
+                if isinstance(item, list):
+                    item = "[" + ",".join(item) + "]"
+                await self.websocket.send_text(item)
+                metrics.frames_out.value += 1
+                metrics.bytes_out.value += metrics.utf8_len(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket is gone; let the owner forget about it.
+            self._finish()
+
+    def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self._finish()
+        asyncio.ensure_future(self._close_socket(code))
+
+    async def close_and_wait(self, code: int = 1000):
+        """``close`` for the socket's own handler, which must not return until
+        the close frame is out: the server drops it once the handler is done.
+        """
+        if self.closed:
+            return
+        self._finish()
+        await self._close_socket(code)
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def _finish(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.pending.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        if self._on_close is not None:
+            # Deferred: we may be inside a broadcast iterating the room.
+            asyncio.get_running_loop().call_soon(self._on_close, self)
@@ -0,0 +1,103 @@
+"""Heartbeats and idle reaping for every connection on one timer wheel.
+
+Browsers don't expose websocket ping frames, so the heartbeat is a
+``{"type":"ping"}`` message the client answers with ``{"type":"pong"}``. Any
+frame from the client counts as a sign of life. A connection that has been
+quiet for ``interval`` seconds is pinged, and one that stays silent for
+``idle_timeout`` seconds (a phone that lost signal, a half-open TCP
+connection) is closed and reaped.
+"""
+import asyncio
+import math
+from time import monotonic
+
+from app import metrics
+
+PING_FRAME = '{"type":"ping"}'
+# 1001 "Going Away": nothing heard from the client for too long.
+IDLE_CLOSE_CODE = 1001
+
+
+class TimerWheel:
+    """A hashed timing wheel: one task drives every timer.
+
+    ``schedule`` and ``cancel`` are O(1); each tick fires only the items in
+    the current slot. Delays are rounded up to whole ticks and capped at one
+    revolution, so ``on_expire`` should check whether an item is really due.
+    """
+
+    def __init__(self, tick: float, slots: int, on_expire):
+        self.tick = tick
+        self.slots = [set() for _ in range(max(slots, 2))]
+        self.on_expire = on_expire
+        self.position = 0
+        self._slot_of = {}
+        self._task = None
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def schedule(self, item, delay: float):
+        self.cancel(item)
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self.slots) - 1)
+        slot = (self.position + ticks) % len(self.slots)
+        self.slots[slot].add(item)
+        self._slot_of[item] = slot
+
+    def cancel(self, item):
+        slot = self._slot_of.pop(item, None)
+        if slot is not None:
+            self.slots[slot].discard(item)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            deadline += self.tick
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            self.position = (self.position + 1) % len(self.slots)
+            due, self.slots[self.position] = self.slots[self.position], set()
+            for item in due:
+                del self._slot_of[item]
+                self.on_expire(item)
+
+
+class Heartbeat:
+    def __init__(self, interval: float = 25.0, idle_timeout: float = 60.0, tick: float = 1.0):
+        self.interval = interval
+        self.idle_timeout = max(idle_timeout, interval + tick)
+        self.wheel = TimerWheel(tick, math.ceil(self.idle_timeout / tick) + 1, self._check)
+
+    def start(self):
+        self.wheel.start()
+
+    def stop(self):
+        self.wheel.stop()
+
+    def track(self, connection):
+        self.wheel.schedule(connection, self.interval)
+
+    def forget(self, connection):
+        self.wheel.cancel(connection)
+
+    def _check(self, connection):
+        if connection.closed:
+            return
+        idle = monotonic() - connection.last_seen
+        if idle >= self.idle_timeout:
+            metrics.connections_reaped.value += 1
+            connection.close(IDLE_CLOSE_CODE)
+        elif idle >= self.interval:
+            connection.send(PING_FRAME)
+            self.wheel.schedule(connection, self.idle_timeout - idle)
+        else:
+            self.wheel.schedule(connection, self.interval - idle)
@@ -0,0 +1,204 @@
+"""ID-indexed room history.
+
+Every message in a room has a server-assigned sequence number: 1, 2, 3, ...
+in publish order, gap-free (with a durable log, ``seq`` is the log offset plus
+one). The seq is stamped into the message as ``seq`` and doubles as its ``id``;
+an ID the client supplied is kept as ``client_id`` and can still be looked up.
+Recent messages are served from memory, in a ring bounded by count and
+bytes; older ones come from the log when there is one.
+"""
+import asyncio
+from itertools import islice
+
+from app.codec import Envelope, codec
+from app.ring import HistoryRing
+from app.search import SearchIndex
+
+# Rooms with more messages than this get their search index built off the loop.
+INLINE_INDEX = 4096
+
+# Seqs cross the backplane as signed 64-bit integers.
+MAX_SEQ = (1 << 63) - 1
+
+
+class RoomHistory:
+    def __init__(self, size: int = 100, log=None, max_bytes: int = None, spill: bool = False):
+        self.log = log
+        # With ``spill`` a message reaches the log when it leaves ``recent``
+        # (or on close) rather than when it arrives: fewer writes, but a
+        # crash loses what was still only in memory.
+        self.spill = spill and log is not None
+        self.recent = HistoryRing(size, max_bytes, self._evicted)
+        self.last_seq = len(log) if log is not None else 0
+        # client_id -> seq for messages that are only in ``recent``; the log
+        # keeps its own key index.
+        self._ids = {}
+        # Built on the first search, then kept up to date by ``append``.
+        self._index = None
+        self._building = None  # future of the log records being indexed
+        if log is not None:
+            for payload in log.tail(size):
+                self.recent.append(Envelope.decode(str(payload, "utf-8")))
+
+    def __len__(self):
+        return len(self.recent)
+
+    @property
+    def first_seq(self) -> int:
+        """Seq of the oldest message that can still be read."""
+        if self.log is not None:
+            return 1
+        return self.last_seq - len(self.recent) + 1
+
+    def append(self, envelope: Envelope) -> Envelope:
+        """Stamp ``envelope`` with the next seq, store it and return it."""
+        seq = self.last_seq + 1
+        envelope = envelope.sequenced(seq)
+        client_id = _client_id(envelope)
+        if self.log is not None and not self.spill:
+            self.log.append(envelope.data, client_id.encode() if client_id else b"")
+        elif client_id:
+            self._ids[client_id] = seq
+        self.last_seq = seq
+        if self._index is not None:
+            self._index.add(seq, envelope.message)
+        self.recent.append(envelope)
+        return envelope
+
+    def _evicted(self, envelope: Envelope):
+        if self._ids:
+            client_id = _client_id(envelope)
+            if client_id and self._ids.get(client_id) == envelope.seq:
+                del self._ids[client_id]
+        # Messages reloaded from the log on startup are already in it.
+        if self.spill and envelope.seq > len(self.log):
+            self._persist(envelope)
+        elif self.log is None and self._index is not None:
+            self._index.evict_below(envelope.seq + 1)
+
+    def _persist(self, envelope: Envelope):
+        client_id = _client_id(envelope)
+        self.log.append(envelope.data, client_id.encode() if client_id else b"")
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by ``recent``."""
+        return self.recent.nbytes
+
+    def close(self):
+        if self._building is not None:
+            self._building.cancel()
+        if self.spill:
+            for envelope in self.recent:
+                if envelope.seq > len(self.log):
+                    self._persist(envelope)
+
+    async def seq_of(self, message_id: str):
+        """Resolve a client-supplied ID, or a server ID (the seq itself)."""
+        seq = self._ids.get(message_id)
+        if seq is not None:
+            return seq
+        if self.log is not None:
+            offset = await self.log.find(message_id.encode())
+            if offset is not None:
+                return offset + 1
+        if message_id.isascii() and message_id.isdecimal() and 0 < int(message_id) <= self.last_seq:
+            return int(message_id)
+        return None
+
+    def page(self, before_seq: int = None, limit: int = 50):
+        """Up to ``limit`` messages older than ``before_seq``, oldest first.
+
+        Returns ``(first_seq, envelopes)``; ``first_seq`` is the cursor for the
+        next page and ``first_seq > self.first_seq`` means there is more.
+        """
+        stop = self.last_seq + 1 if before_seq is None else min(before_seq, self.last_seq + 1)
+        start = max(stop - limit, self.first_seq)
+        if start >= stop:
+            return stop, []
+        return start, self._read(start, stop)
+
+    def since(self, after_seq: int, limit: int = 100):
+        """Up to ``limit`` messages newer than ``after_seq``, oldest first.
+
+        Returns None when messages right after ``after_seq`` are no longer
+        available, so the caller has to start over from a snapshot.
+        """
+        start = max(after_seq + 1, 1)
+        if start < self.first_seq:
+            return None
+        stop = min(start + limit, self.last_seq + 1)
+        if start >= stop:
+            return []
+        return self._read(start, stop)
+
+    def search_index(self):
+        """The room's search index, covering every readable message.
+
+        Up to ``INLINE_INDEX`` messages are indexed on the spot. Beyond that
+        the first call starts indexing the log's durable records in an
+        executor and returns None, as do calls until that is done.
+        """
+        if self._index is None and self._building is None:
+            stop = 0
+            if self.log is not None and self.last_seq > INLINE_INDEX:
+                stop = min(self.log.durable_offset, self.last_seq - len(self.recent))
+            if stop:
+                self._building = asyncio.get_running_loop().run_in_executor(
+                    None, _index_records, self.log, stop)
+                self._building.add_done_callback(lambda future: self._indexed(future, stop + 1))
+            else:
+                self._finish_index(SearchIndex(), self.first_seq)
+        return self._index
+
+    def _indexed(self, future, start: int):
+        self._building = None
+        # On failure the next search starts over.
+        if not future.cancelled() and future.exception() is None:
+            self._finish_index(future.result(), start)
+
+    def _finish_index(self, index: SearchIndex, start: int):
+        # Adds what arrived since ``start``, mostly the ring; decoded into
+        # locals so ring entries stay text only.
+        if self.log is None:
+            index.evict_below(start)
+        for seq, envelope in enumerate(self._read(start, self.last_seq + 1), start):
+            index.add(seq, codec.loads(envelope.text))
+        self._index = index
+
+    def search(self, query: str, username: str = None, since: float = None, until: float = None,
+               before_seq: int = None, limit: int = 20):
+        """Return ``(has_more, envelopes)`` for messages matching ``query``, newest first.
+
+        None while the search index is still being built.
+        """
+        index = self.search_index()
+        if index is None:
+            return None
+        seqs, has_more = index.search(query, username, since, until, before_seq, limit)
+        return has_more, [self._read(seq, seq + 1)[0] for seq in seqs]
+
+    def _read(self, start: int, stop: int) -> list:
+        recent_first = self.last_seq - len(self.recent) + 1
+        envelopes = []
+        if start < recent_first:
+            payloads = self.log.read(start - 1, min(stop, recent_first) - 1)
+            envelopes = [Envelope.decode(str(payload, "utf-8")) for payload in payloads]
+            start = recent_first
+        if start < stop:
+            envelopes += islice(self.recent, start - recent_first, stop - recent_first)
+        return envelopes
+
+
+def _index_records(log, stop: int) -> SearchIndex:
+    # Runs in an executor, over records that are already on disk.
+    index = SearchIndex()
+    for start in range(0, stop, 4096):
+        for seq, payload in enumerate(log.read(start, min(start + 4096, stop)), start + 1):
+            index.add(seq, codec.loads(payload))
+    return index
+
+
+def _client_id(envelope: Envelope):
+    client_id = envelope.message.get("client_id")
+    return str(client_id) if client_id is not None else None
@@ -0,0 +1,109 @@
+"""Bounded inbound processing.
+
+Receive loops only validate a message and hand it to its room's
+``IngestQueue``; the room's dispatcher task publishes it. A sender's next
+message is read while the previous one is still fanning out, and the work the
+server has accepted is bounded twice: per room by the queue size and across
+all rooms by a shared ``IngestBudget``. When either is exhausted the sender
+is made to wait briefly, then told the server is busy.
+"""
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class IngestBudget:
+    """Messages accepted but not yet dispatched, across every room.
+
+    A released slot goes straight to the longest waiter, if there is one.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.pending = 0
+        self._waiters = deque()
+
+    async def acquire(self, timeout: float) -> bool:
+        """Take a slot, waiting up to ``timeout`` for one; False if none came."""
+        if self.pending < self.limit and not self._waiters:
+            self.pending += 1
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # handed a slot, but no longer wanted
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.pending -= 1
+
+
+class IngestQueue:
+    def __init__(self, handler, maxsize: int, budget: IngestBudget):
+        self.handler = handler
+        self.budget = budget
+        self.queue = asyncio.Queue(maxsize)
+        self._task = asyncio.ensure_future(self._run())
+
+    def __len__(self):
+        return self.queue.qsize()
+
+    async def put(self, item, timeout: float) -> bool:
+        """Queue ``item``, waiting up to ``timeout`` in all for room; False if busy."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        if not await self.budget.acquire(timeout):
+            return False
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+        queued = False
+        try:
+            await asyncio.wait_for(self.queue.put(item), max(deadline - loop.time(), 0))
+            queued = True
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # Also when the sender is cancelled, e.g. on disconnect.
+            if not queued:
+                self.budget.release()
+        return queued
+
+    async def _run(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self.handler(item)
+            except Exception:
+                logger.exception("dropped a message that could not be dispatched")
+            finally:
+                self.budget.release()
+
+    def close(self):
+        self._task.cancel()
+        # Whatever was still queued is dropped with the room.
+        for _ in range(self.queue.qsize()):
+            self.queue.get_nowait()
+            self.budget.release()
@@ -1,9 +1,10 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
-import json
 from collections import deque
 
+from app.codec import Envelope, codec
+
 app = FastAPI()
 
 app.add_middleware(
@@ -133,18 +134,18 @@ html = """
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections = []
+        self.active_connections = set()
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        self.active_connections.discard(websocket)
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            await connection.send_text(json.dumps(message))
+    async def broadcast(self, envelope: Envelope):
+        for connection in list(self.active_connections):
+            await connection.send_text(envelope.text)
 
 
 manager = ConnectionManager()
@@ -162,15 +163,16 @@ async def websocket_endpoint(websocket: WebSocket):
 
     try:
         # Send chat history to the new user
-        for message in chat_history:
-            await websocket.send_text(json.dumps(message))
+        for envelope in chat_history:
+            await websocket.send_text(envelope.text)
 
         while True:
             data = await websocket.receive_text()
-            message = json.loads(data)
+            message = codec.loads(data)
             message["sender"] = "self" if websocket in manager.active_connections else "other"
-            chat_history.append(message)
-            await manager.broadcast(message)
+            envelope = Envelope(message)
+            chat_history.append(envelope)
+            await manager.broadcast(envelope)
 
     except WebSocketDisconnect:
         manager.disconnect(websocket)
@@ -0,0 +1,214 @@
+"""Content-addressed image storage with an out-of-band HTTP upload path.
+
+Images are uploaded as raw request bodies to ``POST /media`` and referenced in
+chat messages by their media ID (the leading hex digits of the SHA-256 of the
+bytes), so websocket frames and chat history never carry image data.
+"""
+import hashlib
+import os
+import uuid
+
+import anyio
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+
+from app import config
+from app.schema import MEDIA_ID_LENGTH, MEDIA_ID_RE
+from app.thumbnails import ThumbnailCache
+
+CHUNK_SIZE = 64 * 1024
+
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def sniff_content_type(head: bytes):
+    for signature, content_type in _SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class UnsupportedMedia(Exception):
+    pass
+
+
+class MediaStore:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._content_types = {}
+
+    def path(self, media_id: str) -> str:
+        if not MEDIA_ID_RE.match(media_id):
+            raise KeyError(media_id)
+        return os.path.join(self.root, media_id[:2], media_id)
+
+    def exists(self, media_id: str) -> bool:
+        try:
+            return os.path.isfile(self.path(media_id))
+        except KeyError:
+            return False
+
+    async def save(self, chunks) -> str:
+        """Stream ``chunks`` to disk and return the media ID of the content."""
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        tmp_path = os.path.join(self.root, f".upload-{uuid.uuid4().hex}")
+        try:
+            async with await anyio.open_file(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise MediaTooLarge(size)
+                    if len(head) < 16:
+                        head += chunk[:16]
+                    digest.update(chunk)
+                    await f.write(chunk)
+            content_type = sniff_content_type(head)
+            if content_type is None:
+                raise UnsupportedMedia()
+            media_id = digest.hexdigest()[:MEDIA_ID_LENGTH]
+            path = self.path(media_id)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            self._content_types[media_id] = content_type
+            return media_id
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def content_type(self, media_id: str) -> str:
+        content_type = self._content_types.get(media_id)
+        if content_type is None:
+            with open(self.path(media_id), "rb") as f:
+                content_type = sniff_content_type(f.read(16)) or "application/octet-stream"
+            self._content_types[media_id] = content_type
+        return content_type
+
+    async def read(self, media_id: str) -> bytes:
+        async with await anyio.open_file(self.path(media_id), "rb") as f:
+            return await f.read()
+
+    async def iter_range(self, media_id: str, start: int, end: int):
+        async with await anyio.open_file(self.path(media_id), "rb") as f:
+            await f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+def parse_range(header: str, size: int):
+    """Return ``(start, end)`` for a single ``bytes=`` range, inclusive."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise ValueError(header)
+    first, _, last = spec.strip().partition("-")
+    if first:
+        start = int(first)
+        end = int(last) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end:
+        raise ValueError(header)
+    return start, end
+
+
+store = MediaStore(config.MEDIA_DIR, config.MEDIA_MAX_BYTES)
+thumbnails = ThumbnailCache(config.THUMBNAIL_CACHE_SIZE, config.THUMBNAIL_WORKERS)
+router = APIRouter()
+
+
+@router.on_event("shutdown")
+def shutdown_thumbnails():
+    thumbnails.shutdown()
+
+
+@router.post("/media")
+async def upload_media(request: Request):
+    # Only a shortcut: the streamed size cap below is what enforces the limit.
+    length = request.headers.get("content-length", "")
+    if length.isascii() and length.isdecimal() and int(length) > store.max_bytes:
+        raise HTTPException(status_code=413, detail="Upload too large")
+    try:
+        media_id = await store.save(request.stream())
+    except MediaTooLarge:
+        raise HTTPException(status_code=413, detail="Upload too large")
+    except UnsupportedMedia:
+        raise HTTPException(status_code=415, detail="Unsupported media type")
+    thumbnails.warm(media_id, store.path(media_id))
+    return {"id": media_id, "url": f"/media/{media_id}", "type": store.content_type(media_id)}
+
+
+@router.get("/media/{media_id}")
+async def get_media(media_id: str, request: Request):
+    if not store.exists(media_id):
+        raise HTTPException(status_code=404, detail="Media not found")
+    etag = f'"{media_id}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # Content-addressed: the bytes behind an ID never change.
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    size = os.path.getsize(store.path(media_id))
+    content_type = store.content_type(media_id)
+    status_code = 200
+    start, end = 0, size - 1
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            start, end = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(store.iter_range(media_id, start, end), status_code=status_code,
+                             headers=headers, media_type=content_type)
+
+
+@router.get("/media/{media_id}/thumbnail")
+async def get_thumbnail(media_id: str, request: Request):
+    if not store.exists(media_id):
+        raise HTTPException(status_code=404, detail="Media not found")
+    etag = f'"{media_id}-thumb"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    try:
+        thumbnail = await thumbnails.get(media_id, store.path(media_id))
+    except Exception:
+        thumbnail = None
+    if thumbnail is None:
+        # No renderer available (or the image would not decode): let the
+        # browser scale the original instead.
+        return RedirectResponse(f"/media/{media_id}")
+    return Response(thumbnail, headers=headers, media_type="image/jpeg")
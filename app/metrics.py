@@ -0,0 +1,110 @@
+"""Hot-path counters and histograms, served in the Prometheus text format.
+
+Everything on the hot path runs on the event loop thread, so a counter is a
+plain integer attribute and an observation is one bisect plus two additions;
+there are no locks. Gauges that describe current state (connections per room,
+queue depths, history size) are computed from the live objects when
+``/metrics`` is scraped instead of being kept up to date as they change.
+"""
+from bisect import bisect_left
+
+# Seconds, from 10us to 1s.
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+_metrics = []
+_collectors = []
+
+
+class Counter:
+    __slots__ = ("name", "help", "value")
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+        _metrics.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        yield f"{self.name} {self.value}"
+
+
+class Histogram:
+    __slots__ = ("name", "help", "bounds", "counts", "sum", "count")
+
+    def __init__(self, name: str, help: str, bounds=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        _metrics.append(self)
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound:g}"}} {cumulative}'
+        yield f'{self.name}_bucket{{le="+Inf"}} {self.count}'
+        yield f"{self.name}_sum {self.sum}"
+        yield f"{self.name}_count {self.count}"
+
+
+def gauge(name: str, help: str, samples, kind: str = "gauge") -> list:
+    """Render ``(labels, value)`` samples of a gauge (or ``kind``); labels may be None."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        if labels:
+            label_text = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+        else:
+            lines.append(f"{name} {value}")
+    return lines
+
+
+def counter(name: str, help: str, value) -> list:
+    """Render a counter kept elsewhere."""
+    return gauge(name, help, [(None, value)], kind="counter")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def register_collector(collect):
+    """``collect()`` returns extra exposition lines at scrape time."""
+    _collectors.append(collect)
+
+
+def utf8_len(text: str) -> int:
+    """Bytes ``text`` takes on the wire; only encodes it when it isn't ASCII."""
+    return len(text) if text.isascii() else len(text.encode())
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+messages_in = Counter("chat_messages_in_total", "Frames received from clients.")
+bytes_in = Counter("chat_bytes_in_total", "Bytes of text received from clients.")
+messages_out = Counter("chat_messages_out_total", "Messages queued to client sockets (one per recipient).")
+frames_out = Counter("chat_frames_out_total", "Websocket frames written to clients.")
+bytes_out = Counter("chat_bytes_out_total", "Bytes of text written to clients.")
+decode_seconds = Histogram("chat_decode_seconds", "Time to size-check, parse and validate one inbound frame.")
+serialize_seconds = Histogram("chat_serialize_seconds", "Time to encode one outbound message.")
+connections_reaped = Counter("chat_connections_reaped_total", "Connections closed for being idle.")
+fanout_seconds = Histogram("chat_fanout_seconds", "Time to queue one broadcast frame to every member of a room.")
@@ -0,0 +1,225 @@
+"""Who is online in a room, and who is typing, pushed to members as deltas.
+
+A member gets the full roster once, when it joins; after that only changes go
+out. Changes are coalesced per room: every join, leave and typing change
+within ``window`` seconds is folded into one ``presence`` frame, and a change
+undone within the window (a quick reconnect, a short burst of typing) is not
+sent at all. Typing is a lease: clients repeat ``typing`` every few seconds
+while the user types and the lease lapses after ``typing_timeout``, so
+keystrokes never reach other members and a client that vanishes mid-sentence
+stops "typing" by itself.
+
+Each worker's ``Presence`` tracks the members connected to it and reports
+their changes through the backplane, where a ``PresenceHub`` merges every
+worker's reports: a user is online while any worker has them online, and
+typing while any worker has them typing. The room-wide deltas come back to
+every worker, which passes them on to its members and keeps the room-wide
+state for rosters.
+"""
+import asyncio
+from time import monotonic
+
+from app.codec import codec
+
+
+class Presence:
+    def __init__(self, publish, window: float = 0.25, typing_timeout: float = 6.0):
+        # Called with each delta (a dict) of this worker's members.
+        self.publish = publish
+        self.window = window
+        self.typing_timeout = typing_timeout
+        self.local = {}  # username -> connections open here
+        self.leases = {}  # username -> typing lease expiry (monotonic), for members here
+        # Room-wide state, as last heard from the backplane (ordered sets).
+        self.online = {}
+        self.typing = {}
+        # username -> (online, typing) as last reported, for users changed since.
+        self._changed = {}
+        self._flush_handle = None
+        self._expire_handle = None
+
+    def roster(self) -> str:
+        """The full state, as sent to a member that just joined."""
+        # Members here are listed before their join has made the round trip.
+        online = {**self.online, **dict.fromkeys(self.local)}
+        typing = {**self.typing, **dict.fromkeys(self.leases)}
+        return codec.dumps({"type": "presence", "online": list(online), "typing": list(typing)})
+
+    def apply(self, update: dict) -> bool:
+        """Take in room-wide state from the backplane.
+
+        A roster replaces it; a delta updates it and returns True, since
+        members are to be sent it.
+        """
+        if "online" in update:
+            self.online = dict.fromkeys(update["online"])
+            self.typing = dict.fromkeys(update.get("typing", ()))
+            return False
+        self.online.update(dict.fromkeys(update.get("joined", ())))
+        for username in update.get("left", ()):
+            self.online.pop(username, None)
+            self.typing.pop(username, None)
+        self.typing.update(dict.fromkeys(update.get("typing", ())))
+        for username in update.get("idle", ()):
+            self.typing.pop(username, None)
+        return True
+
+    def state(self):
+        """This worker's members as one delta, or None if there are none.
+
+        Sent to report them afresh, e.g. to a broker that took over.
+        """
+        if not self.local:
+            return None
+        delta = {"type": "presence", "joined": list(self.local)}
+        if self.leases:
+            delta["typing"] = list(self.leases)
+        return delta
+
+    def join(self, username: str):
+        count = self.local.get(username, 0)
+        if count == 0:
+            self._touch(username)
+        self.local[username] = count + 1
+
+    def leave(self, username: str):
+        count = self.local.get(username, 0)
+        if count > 1:
+            self.local[username] = count - 1
+        elif count == 1:
+            self._touch(username)
+            del self.local[username]
+            self.leases.pop(username, None)
+
+    def set_typing(self, username: str, active: bool = True):
+        if username not in self.local:
+            return
+        if active:
+            if username not in self.leases:
+                self._touch(username)
+            self.leases[username] = monotonic() + self.typing_timeout
+            if self._expire_handle is None:
+                self._expire_handle = asyncio.get_running_loop().call_later(self.typing_timeout, self._expire)
+        elif username in self.leases:
+            self._touch(username)
+            del self.leases[username]
+
+    def _touch(self, username: str):
+        if username not in self._changed:
+            self._changed[username] = (username in self.local, username in self.leases)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def _expire(self):
+        self._expire_handle = None
+        now = monotonic()
+        for username, expiry in list(self.leases.items()):
+            if expiry <= now:
+                self.set_typing(username, False)
+        if self.leases:
+            delay = max(min(self.leases.values()) - now, 0.0)
+            self._expire_handle = asyncio.get_running_loop().call_later(delay, self._expire)
+
+    def flush(self):
+        """Report what changed since the last flush, net of anything undone."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        changed, self._changed = self._changed, {}
+        joined, left, typing, idle = [], [], [], []
+        for username, (was_online, was_typing) in changed.items():
+            is_online = username in self.local
+            is_typing = username in self.leases
+            if is_online != was_online:
+                (joined if is_online else left).append(username)
+            # Leaving implies no longer typing.
+            if is_typing != was_typing and is_online:
+                (typing if is_typing else idle).append(username)
+        delta = _delta(joined, left, typing, idle)
+        if delta is not None:
+            self.publish(delta)
+
+    def close(self):
+        for handle in (self._flush_handle, self._expire_handle):
+            if handle is not None:
+                handle.cancel()
+        self._flush_handle = self._expire_handle = None
+
+
+class PresenceHub:
+    """Room presence merged across the workers reporting it.
+
+    ``source`` identifies a worker (any hashable). ``update`` applies one
+    worker's delta and returns the room-wide delta it amounts to, or None if
+    nothing changed room-wide.
+    """
+
+    def __init__(self):
+        # room -> (online, typing), each mapping a username to its sources
+        self.rooms = {}
+
+    def roster(self, room: str) -> dict:
+        online, typing = self.rooms.get(room, ({}, {}))
+        return {"type": "presence", "online": list(online), "typing": list(typing)}
+
+    def update(self, room: str, source, delta: dict):
+        online, typing = self.rooms.setdefault(room, ({}, {}))
+        joined, left, started, stopped = [], [], [], []
+        for username in delta.get("joined", ()):
+            sources = online.setdefault(username, set())
+            if not sources:
+                joined.append(username)
+            sources.add(source)
+        for username in delta.get("left", ()):
+            stopped_typing = _discard(typing, username, source)
+            if _discard(online, username, source):
+                left.append(username)
+            elif stopped_typing:
+                stopped.append(username)
+        for username in delta.get("typing", ()):
+            if source in online.get(username, ()):
+                sources = typing.setdefault(username, set())
+                if not sources:
+                    started.append(username)
+                sources.add(source)
+        for username in delta.get("idle", ()):
+            if _discard(typing, username, source):
+                stopped.append(username)
+        if not online:
+            del self.rooms[room]
+        return _delta(joined, left, started, stopped)
+
+    def drop(self, source, room: str = None) -> list:
+        """Forget a worker, in one room or all, as if its members had left.
+
+        Returns the resulting ``(room, delta)`` pairs.
+        """
+        deltas = []
+        for name in [room] if room is not None else list(self.rooms):
+            online, _ = self.rooms.get(name, ({}, {}))
+            left = [username for username, sources in online.items() if source in sources]
+            if left:
+                delta = self.update(name, source, {"left": left})
+                if delta is not None:
+                    deltas.append((name, delta))
+        return deltas
+
+
+def _discard(sources_by_user: dict, username: str, source) -> bool:
+    """Remove one source of ``username``; True if it was the last."""
+    sources = sources_by_user.get(username)
+    if sources is None or source not in sources:
+        return False
+    sources.discard(source)
+    if sources:
+        return False
+    del sources_by_user[username]
+    return True
+
+
+def _delta(joined: list, left: list, typing: list, idle: list):
+    delta = {"type": "presence"}
+    for key, names in (("joined", joined), ("left", left), ("typing", typing), ("idle", idle)):
+        if names:
+            delta[key] = names
+    return delta if len(delta) > 1 else None
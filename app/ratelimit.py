@@ -0,0 +1,88 @@
+"""Token-bucket rate limits for incoming messages.
+
+Buckets refill lazily from the elapsed time whenever they are consulted, so
+there are no timers and each check is a few float operations.
+"""
+from time import monotonic
+
+# 1008 "Policy Violation": the client kept sending faster than allowed.
+RATE_LIMIT_CLOSE_CODE = 1008
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def take(self, cost: float, now: float, max_delay: float):
+        """Spend ``cost`` tokens and return how long to wait before acting.
+
+        A bucket may go into debt by up to ``max_delay`` seconds of refill;
+        beyond that nothing is spent and None is returned.
+        """
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = (cost - tokens) / self.rate if tokens < cost else 0.0
+        if wait > max_delay:
+            self.tokens = tokens
+            return None
+        self.tokens = tokens - cost
+        return wait
+
+    def refund(self, cost: float):
+        self.tokens = min(self.burst, self.tokens + cost)
+
+
+class RateLimiter:
+    """A messages/sec and a bytes/sec bucket checked together.
+
+    Occasional bursts over the limit are smoothed out by waiting, but a sender
+    that stays over it for ``grace`` seconds straight is refused.
+    """
+
+    __slots__ = ("messages", "bytes", "max_delay", "grace", "throttled_since")
+
+    def __init__(self, messages_per_second: float, message_burst: float,
+                 bytes_per_second: float, byte_burst: float, max_delay: float = 1.0,
+                 grace: float = 5.0):
+        self.messages = TokenBucket(messages_per_second, message_burst)
+        self.bytes = TokenBucket(bytes_per_second, byte_burst)
+        self.max_delay = max_delay
+        self.grace = grace
+        self.throttled_since = None
+
+    def take(self, size: int, now: float = None):
+        """Seconds to hold back a message of ``size`` bytes, or None to refuse it."""
+        if now is None:
+            now = monotonic()
+        message_wait = self.messages.take(1, now, self.max_delay)
+        if message_wait is None:
+            return None
+        byte_wait = self.bytes.take(size, now, self.max_delay)
+        if byte_wait is None:
+            self.messages.refund(1)
+            return None
+        wait = max(message_wait, byte_wait)
+        if not wait:
+            self.throttled_since = None
+        elif self.throttled_since is None:
+            self.throttled_since = now
+        elif now - self.throttled_since > self.grace:
+            self.messages.refund(1)
+            self.bytes.refund(size)
+            return None
+        return wait
+
+
+def limiter_factory(messages_per_second: float, message_burst: float,
+                    bytes_per_second: float, byte_burst: float,
+                    max_delay: float, grace: float):
+    """A callable making fresh limiters, or None when limiting is disabled."""
+    if messages_per_second <= 0 or bytes_per_second <= 0:
+        return None
+    return lambda: RateLimiter(messages_per_second, message_burst,
+                               bytes_per_second, byte_burst, max_delay, grace)
@@ -0,0 +1,66 @@
+"""A history ring bounded by bytes as well as by message count.
+
+Entries are pre-encoded envelopes stripped down to their text, so a ring's
+footprint is the size of those strings plus a fixed per-entry overhead and
+can be budgeted per room. Appending evicts from the oldest end until both
+budgets hold (the newest entry is always kept), handing each evicted envelope
+to ``on_evict`` so it can be spilled elsewhere.
+"""
+import sys
+from collections import deque
+
+from app.codec import Envelope
+
+# An Envelope object plus its deque slot.
+ENTRY_OVERHEAD = sys.getsizeof(Envelope(text="{}")) + 8
+
+
+class HistoryRing:
+    __slots__ = ("maxlen", "max_bytes", "nbytes", "on_evict", "_entries")
+
+    def __init__(self, maxlen: int = 100, max_bytes: int = None, on_evict=None):
+        self.maxlen = maxlen
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.on_evict = on_evict
+        self._entries = deque()
+
+    @staticmethod
+    def footprint(envelope: Envelope) -> int:
+        return sys.getsizeof(envelope.text) + ENTRY_OVERHEAD
+
+    def append(self, envelope: Envelope):
+        self._entries.append(envelope.compact())
+        self.nbytes += self.footprint(envelope)
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.maxlen
+                or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            evicted = self._entries.popleft()
+            self.nbytes -= self.footprint(evicted)
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def extend(self, envelopes):
+        for envelope in envelopes:
+            self.append(envelope)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def popleft(self) -> Envelope:
+        envelope = self._entries.popleft()
+        self.nbytes -= self.footprint(envelope)
+        return envelope
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __reversed__(self):
+        return reversed(self._entries)
+
+    def __getitem__(self, index: int) -> Envelope:
+        return self._entries[index]
@@ -0,0 +1,228 @@
+import asyncio
+import re
+from time import monotonic, perf_counter
+
+from app import metrics
+from app.codec import Envelope, codec
+from app.ring import HistoryRing
+
+DEFAULT_ROOM = "general"
+# Room names double as log directory names, so no leading dot.
+ROOM_NAME_RE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}$")
+REPLY_PREVIEW_LENGTH = 200
+
+
+def page_frame(first_seq, has_more: bool, envelopes) -> str:
+    """A ``history`` frame answering a scrollback request."""
+    cursor = "null" if first_seq is None else str(first_seq)
+    return ('{"type":"history","first_seq":%s,"has_more":%s,"messages":[%s]}'
+            % (cursor, "true" if has_more else "false", ",".join(e.text for e in envelopes)))
+
+
+def search_frame(has_more: bool, envelopes) -> str:
+    """Search results, newest first."""
+    return ('{"type":"search","has_more":%s,"messages":[%s]}'
+            % ("true" if has_more else "false", ",".join(e.text for e in envelopes)))
+
+
+def resolve_reply(message: dict, lookup):
+    """Replace a client-supplied ``replyTo`` with a compact server-side preview.
+
+    Replies only reference the original message ID; images are previewed via
+    their media ID (and the thumbnail route), never by copying image data.
+    ``lookup`` finds the original by its server ID (e.g. ``Room.lookup``).
+    """
+    reply_to = message.get("replyTo")
+    if not isinstance(reply_to, dict):
+        message.pop("replyTo", None)
+        return
+    reply_id = reply_to.get("id")
+    preview = {"id": reply_id}
+    envelope = lookup(reply_id) if reply_id is not None else None
+    if envelope is not None:
+        # Not ``envelope.message``, which would keep the decoded dict on the ring entry.
+        original = codec.loads(envelope.text)
+        content = original.get("content") or ""
+        if original.get("type") == "text":
+            content = content[:REPLY_PREVIEW_LENGTH]
+        preview.update(username=original.get("username"), type=original.get("type"), content=content)
+    message["replyTo"] = preview
+
+
+class Room:
+    def __init__(self, name: str, history_size: int = 100, join_size: int = 30, limiter=None,
+                 batch_window: float = 0.0, batch_bytes: int = 64 * 1024, history_bytes: int = None):
+        self.name = name
+        self.join_size = join_size
+        self.members = set()
+        self.history = HistoryRing(history_size, history_bytes)
+        self.emptied_at = None
+        # Backplane subscription, created when the first member joins.
+        self.subscription = None
+        # Shared rate limit on what members publish, if any.
+        self.limiter = limiter
+        # Inbound queue and dispatcher, created by the manager on first use.
+        self.ingest = None
+        # Online and typing members, created by the manager on first join.
+        self.presence = None
+        # Micro-batching: broadcasts within ``batch_window`` seconds (or until
+        # ``batch_bytes`` accumulate) go out as one array frame.
+        self.batch_window = batch_window
+        self.batch_bytes = batch_bytes
+        self._batch = []
+        self._batch_size = 0
+        self._flush_handle = None
+        self._snapshot = None
+
+    def append(self, envelope: Envelope):
+        self.history.append(envelope)
+        self._snapshot = None
+
+    def restore(self, envelopes: list):
+        self.flush()
+        self.history.clear()
+        self.history.extend(envelopes)
+        self._snapshot = None
+
+    def since(self, after_seq: int):
+        """Messages newer than ``after_seq`` from the in-memory ring.
+
+        The ring holds consecutive seqs, so this is a slice; None means the
+        ring no longer reaches back that far.
+        """
+        if not self.history:
+            return None if after_seq > 0 else []
+        first_seq = self.history[0].seq
+        last_seq = first_seq + len(self.history) - 1
+        if after_seq >= last_seq:
+            return [] if after_seq == last_seq else None
+        if after_seq + 1 < first_seq:
+            return None
+        return list(self.history)[after_seq + 1 - first_seq:]
+
+    def lookup(self, message_id):
+        """The message with server ID ``message_id``, if it is still in the ring.
+
+        Server IDs are seqs, so this indexes the ring rather than scanning it.
+        """
+        message_id = str(message_id)
+        if not self.history or not (message_id.isascii() and message_id.isdecimal()):
+            return None
+        index = int(message_id) - self.history[0].seq
+        return self.history[index] if 0 <= index < len(self.history) else None
+
+    def snapshot(self) -> str:
+        """The last screenful of history as one pre-encoded frame.
+
+        Rebuilt only when the history changes; older messages are fetched
+        lazily with ``history`` requests.
+        """
+        if self._snapshot is None:
+            recent = list(self.history)[-self.join_size:]
+            has_more = "true" if len(self.history) > len(recent) or len(recent) == self.join_size else "false"
+            self._snapshot = ('{"type":"snapshot","has_more":%s,"messages":[%s]}'
+                              % (has_more, ",".join(e.text for e in recent)))
+        return self._snapshot
+
+    def broadcast(self, envelope: Envelope):
+        if self.batch_window <= 0:
+            self._send(envelope.text, 1)
+            return
+        self._batch.append(envelope.text)
+        self._batch_size += len(envelope.text)
+        if self._batch_size >= self.batch_bytes:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self.flush)
+
+    def flush(self):
+        """Send any batched broadcasts now.
+
+        Called before a member joins, since its snapshot already includes them.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._batch:
+            return
+        batch, self._batch, self._batch_size = self._batch, [], 0
+        # One frame, encoded once for every member.
+        self._send(batch[0] if len(batch) == 1 else "[" + ",".join(batch) + "]", len(batch))
+
+    def _send(self, frame: str, count: int):
+        start = perf_counter()
+        for connection in self.members:
+            connection.send(frame)
+        metrics.fanout_seconds.observe(perf_counter() - start)
+        metrics.messages_out.value += count * len(self.members)
+
+    def history_bytes(self) -> int:
+        return self.history.nbytes
+
+
+class RoomRegistry:
+    """Rooms by name, each with its own member set and history ring.
+
+    Rooms are created on first use. A room that has had no members for
+    ``idle_ttl`` seconds is dropped the next time the registry is consulted,
+    so there is no background sweeper to run. ``on_reclaim`` is called with
+    each dropped room. ``limiter_factory``, if given, makes each new room's
+    rate limiter; ``batch_window`` and ``batch_bytes`` configure micro-batching;
+    ``history_bytes`` caps each room's history ring in bytes.
+    """
+
+    def __init__(self, history_size: int = 100, idle_ttl: float = 3600.0, on_reclaim=None,
+                 join_size: int = 30, limiter_factory=None, batch_window: float = 0.0,
+                 batch_bytes: int = 64 * 1024, history_bytes: int = None):
+        self.history_size = history_size
+        self.history_bytes = history_bytes
+        self.limiter_factory = limiter_factory
+        self.batch_window = batch_window
+        self.batch_bytes = batch_bytes
+        self.join_size = join_size
+        self.idle_ttl = idle_ttl
+        self.on_reclaim = on_reclaim
+        self.rooms = {}
+        self._empty = {}
+        self._next_sweep = monotonic() + idle_ttl
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def get(self, name: str) -> Room:
+        self._reclaim()
+        room = self.rooms.get(name)
+        if room is None:
+            limiter = self.limiter_factory() if self.limiter_factory is not None else None
+            room = self.rooms[name] = Room(name, self.history_size, self.join_size, limiter,
+                                           self.batch_window, self.batch_bytes, self.history_bytes)
+        return room
+
+    def find(self, name: str):
+        return self.rooms.get(name)
+
+    def join(self, room: Room, connection):
+        room.flush()
+        room.members.add(connection)
+        room.emptied_at = None
+        self._empty.pop(room.name, None)
+
+    def leave(self, room: Room, connection):
+        room.members.discard(connection)
+        if not room.members and room.emptied_at is None:
+            room.emptied_at = monotonic()
+            self._empty[room.name] = room
+
+    def _reclaim(self):
+        now = monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.idle_ttl
+        deadline = now - self.idle_ttl
+        for name, room in list(self._empty.items()):
+            if room.emptied_at is not None and room.emptied_at <= deadline:
+                del self._empty[name]
+                if self.rooms.get(name) is room:
+                    del self.rooms[name]
+                    if self.on_reclaim is not None:
+                        self.on_reclaim(room)
@@ -0,0 +1,154 @@
+"""Validation of messages received from clients.
+
+``decode_message`` turns one websocket frame into a clean message dict: the
+frame is size-checked before it is parsed, the fields are type-checked and
+length-limited per message type, image messages must reference an uploaded
+media ID, and unknown fields are dropped. A client-supplied ``id`` comes back
+as ``client_id``.
+
+msgspec decodes and validates in one pass and is used when installed;
+otherwise the pinned pydantic models are.
+"""
+import re
+from typing import Literal, Optional, Union
+
+from app import config
+from app.codec import codec
+
+# Media IDs are the leading hex digits of the SHA-256 of an upload (see
+# app.media, which is not imported here so validation stays light).
+MEDIA_ID_LENGTH = 32
+MEDIA_ID_RE = re.compile(r"^[0-9a-f]{%d}$" % MEDIA_ID_LENGTH)
+
+
+class MessageError(ValueError):
+    """A frame that isn't a valid chat message; ``too_big`` if over the cap."""
+
+    def __init__(self, reason: str, too_big: bool = False):
+        super().__init__(reason)
+        self.too_big = too_big
+
+
+def check_size(data: str):
+    # Characters never outnumber UTF-8 bytes, so only encode when it matters.
+    limit = config.MESSAGE_MAX_BYTES
+    if len(data) > limit or (len(data) * 4 > limit and len(data.encode()) > limit):
+        raise MessageError(f"frame larger than {limit} bytes", too_big=True)
+
+
+try:
+    import msgspec
+    from typing import Annotated
+except ImportError:
+    msgspec = None
+
+
+if msgspec is not None:
+    Username = Annotated[str, msgspec.Meta(min_length=1, max_length=config.USERNAME_MAX_LENGTH)]
+    Short = Annotated[str, msgspec.Meta(max_length=64)]
+
+    class Reply(msgspec.Struct):
+        id: Short
+
+    class _Message(msgspec.Struct, tag_field="type", omit_defaults=True, kw_only=True):
+        username: Username
+        id: Optional[Short] = None
+        timestamp: Optional[Short] = None
+        replyTo: Optional[Reply] = None
+
+    class TextMessage(_Message, tag="text"):
+        content: Annotated[str, msgspec.Meta(min_length=1, max_length=config.TEXT_MAX_LENGTH)]
+
+    class ImageMessage(_Message, tag="image"):
+        content: Annotated[str, msgspec.Meta(pattern=MEDIA_ID_RE.pattern)]
+
+    class HistoryRequest(msgspec.Struct, tag_field="type", tag="history", omit_defaults=True):
+        before: Optional[Short] = None
+        before_seq: Optional[int] = None
+        limit: Optional[int] = None
+
+    class Pong(msgspec.Struct, tag_field="type", tag="pong"):
+        pass
+
+    class Typing(msgspec.Struct, tag_field="type", tag="typing"):
+        active: bool = True
+
+    _decoder = msgspec.json.Decoder(Union[TextMessage, ImageMessage, HistoryRequest, Pong, Typing])
+
+    def _validate(data: str) -> dict:
+        try:
+            parsed = _decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise MessageError(str(e)) from None
+        except RecursionError:
+            raise MessageError("JSON nested too deeply") from None
+        return msgspec.to_builtins(parsed)
+
+else:
+    from pydantic import BaseModel, Extra, StrictBool, StrictInt, ValidationError, constr
+
+    Username = constr(strict=True, min_length=1, max_length=config.USERNAME_MAX_LENGTH)
+    Short = constr(strict=True, max_length=64)
+
+    class _Model(BaseModel):
+        class Config:
+            extra = Extra.ignore
+
+    class Reply(_Model):
+        id: Short
+
+    class _Message(_Model):
+        username: Username
+        id: Optional[Short] = None
+        timestamp: Optional[Short] = None
+        replyTo: Optional[Reply] = None
+
+    class TextMessage(_Message):
+        type: Literal["text"]
+        content: constr(strict=True, min_length=1, max_length=config.TEXT_MAX_LENGTH)
+
+    class ImageMessage(_Message):
+        type: Literal["image"]
+        content: constr(strict=True, regex=MEDIA_ID_RE.pattern)
+
+    class HistoryRequest(_Model):
+        type: Literal["history"]
+        before: Optional[Short] = None
+        before_seq: Optional[StrictInt] = None
+        limit: Optional[StrictInt] = None
+
+    class Pong(_Model):
+        type: Literal["pong"]
+
+    class Typing(_Model):
+        type: Literal["typing"]
+        active: StrictBool = True
+
+    _MODELS = {"text": TextMessage, "image": ImageMessage, "history": HistoryRequest, "pong": Pong,
+               "typing": Typing}
+
+    def _validate(data: str) -> dict:
+        try:
+            raw = codec.loads(data)
+        except (ValueError, TypeError) as e:
+            raise MessageError(f"invalid JSON: {e}") from None
+        except RecursionError:
+            raise MessageError("JSON nested too deeply") from None
+        kind = raw.get("type") if isinstance(raw, dict) else None
+        model = _MODELS.get(kind) if isinstance(kind, str) else None
+        if model is None:
+            raise MessageError("unknown message type")
+        try:
+            return model.parse_obj(raw).dict(exclude_none=True)
+        except ValidationError as e:
+            raise MessageError(str(e)) from None
+
+
+def decode_message(data: str) -> dict:
+    """Size-check, parse and validate one client frame; raises ``MessageError``."""
+    check_size(data)
+    message = _validate(data)
+    client_id = message.pop("id", None)
+    if client_id is not None:
+        message["client_id"] = client_id
+    return message
@@ -0,0 +1,229 @@
+"""Full-text search over a room's history.
+
+``SearchIndex`` is an inverted index whose document IDs are the room's seqs.
+Each term's postings are three flat arrays (seqs, offsets into a positions
+array, and the positions themselves), appended to as messages arrive; seqs
+only grow, so postings stay sorted without ever being re-sorted. Usernames
+get postings of their own, and each document's time is kept in a
+non-decreasing array, so both filters narrow a query instead of scanning it.
+
+Queries are words and "quoted phrases", all of which must match; results
+come back newest first. Matching is on ``\\w+`` tokens, case-folded.
+
+When history is evicted, ``evict_below`` moves a floor up and queries ignore
+anything under it; the dead prefix of every array is cut off once it makes up
+half the index, so eviction costs O(1) amortized.
+"""
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+TOKEN_RE = re.compile(r"\w+")
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+MAX_POSITION = 0xFFFF
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(text.casefold())
+
+
+def parse_time(value):
+    """Seconds since the epoch from a number or an ISO 8601 string, or None."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_query(query: str) -> list:
+    """The query as a list of phrases, each a list of tokens."""
+    phrases = []
+    for quoted, word in QUERY_RE.findall(query):
+        tokens = tokenize(quoted or word)
+        if tokens:
+            phrases.append(tokens)
+    return phrases
+
+
+class Postings:
+    __slots__ = ("seqs", "starts", "positions")
+
+    def __init__(self):
+        self.seqs = array("I")
+        self.starts = array("I")
+        self.positions = array("H")
+
+    def add(self, seq: int, positions: list):
+        self.seqs.append(seq)
+        self.starts.append(len(self.positions))
+        self.positions.extend(positions)
+
+    def positions_at(self, index: int):
+        stop = self.starts[index + 1] if index + 1 < len(self.starts) else len(self.positions)
+        return self.positions[self.starts[index]:stop]
+
+    def trim(self, floor: int):
+        """Drop the documents below ``floor``."""
+        index = bisect_left(self.seqs, floor)
+        if index:
+            cut = self.starts[index] if index < len(self.starts) else len(self.positions)
+            self.seqs = self.seqs[index:]
+            self.positions = self.positions[cut:]
+            self.starts = array("I", (start - cut for start in self.starts[index:]))
+
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.seqs, self.starts, self.positions))
+
+
+class SearchIndex:
+    def __init__(self):
+        self.terms = {}  # token -> Postings
+        self.users = {}  # case-folded username -> array of seqs
+        self.seqs = array("I")  # every indexed document, in order
+        self.times = array("d")  # parallel to ``seqs``, never decreasing
+        self.floor = 1
+        self._live = 0  # index into ``seqs`` of the first document at or above the floor
+
+    def __len__(self):
+        return len(self.seqs) - self._live
+
+    def add(self, seq: int, message: dict):
+        if message.get("type") == "text" and isinstance(message.get("content"), str):
+            positions = {}
+            for position, token in enumerate(tokenize(message["content"])):
+                positions.setdefault(token, []).append(min(position, MAX_POSITION))
+            for token, where in positions.items():
+                postings = self.terms.get(token)
+                if postings is None:
+                    postings = self.terms[token] = Postings()
+                postings.add(seq, where)
+        username = message.get("username")
+        if isinstance(username, str):
+            self.users.setdefault(username.casefold(), array("I")).append(seq)
+        # Server time if stamped, else whatever the client sent; clamped so
+        # that time ranges map to seq ranges by bisection.
+        when = parse_time(message.get("ts")) or parse_time(message.get("timestamp")) or 0.0
+        if self.times and when < self.times[-1]:
+            when = self.times[-1]
+        self.seqs.append(seq)
+        self.times.append(when)
+
+    def evict_below(self, floor: int):
+        self.floor = floor
+        self._live = bisect_left(self.seqs, floor)
+        if self._live > 1024 and self._live * 2 > len(self.seqs):
+            self._compact()
+
+    def _compact(self):
+        for token, postings in list(self.terms.items()):
+            postings.trim(self.floor)
+            if not postings.seqs:
+                del self.terms[token]
+        for username, seqs in list(self.users.items()):
+            seqs = seqs[bisect_left(seqs, self.floor):]
+            if seqs:
+                self.users[username] = seqs
+            else:
+                del self.users[username]
+        self.seqs = self.seqs[self._live:]
+        self.times = self.times[self._live:]
+        self._live = 0
+
+    def nbytes(self) -> int:
+        """Size of the postings and document arrays (not the dicts holding them)."""
+        return (sum(postings.nbytes() for postings in self.terms.values())
+                + sum(seqs.itemsize * len(seqs) for seqs in self.users.values())
+                + self.seqs.itemsize * len(self.seqs) + self.times.itemsize * len(self.times))
+
+    def search(self, query: str, username: str = None, since: float = None, until: float = None,
+               before_seq: int = None, limit: int = 20):
+        """Seqs of up to ``limit`` matches, newest first, and whether there are more."""
+        phrases = parse_query(query)
+        if not phrases:
+            return [], False
+        postings = {}
+        for token in {token for phrase in phrases for token in phrase}:
+            postings[token] = self.terms.get(token)
+            if postings[token] is None:
+                return [], False
+        lists = [p.seqs for p in postings.values()]
+        if username is not None:
+            user_seqs = self.users.get(username.casefold())
+            if user_seqs is None:
+                return [], False
+            lists.append(user_seqs)
+
+        # The seq range that the floor, cursor and time filters leave.
+        low, high = self.floor, before_seq if before_seq is not None else 1 << 32
+        if since is not None:
+            index = bisect_left(self.times, since, self._live)
+            if index == len(self.seqs):
+                return [], False
+            low = max(low, self.seqs[index])
+        if until is not None:
+            index = bisect_right(self.times, until, self._live)
+            if index == self._live:
+                return [], False
+            high = min(high, self.seqs[index - 1] + 1)
+
+        # Walk the shortest list backwards in growing windows, intersecting
+        # each window with the matching stretch of the other lists as sets,
+        # or by bisection when that stretch is much longer than the window.
+        lists.sort(key=len)
+        driver, others = lists[0], lists[1:]
+        positional = any(len(phrase) > 1 for phrase in phrases)
+        stop, end = bisect_left(driver, low), bisect_left(driver, high)
+        window = max(limit * 4, 64)
+        results = []
+        while end > stop:
+            start = max(stop, end - window)
+            chunk = driver[start:end]
+            first, last = chunk[0], chunk[-1]
+            matches = set(chunk)
+            for seqs in others:
+                i, j = bisect_left(seqs, first), bisect_right(seqs, last)
+                if j - i > 16 * len(matches):
+                    matches = {seq for seq in matches if _contains(seqs, seq)}
+                else:
+                    matches.intersection_update(seqs[i:j])
+                if not matches:
+                    break
+            for seq in sorted(matches, reverse=True):
+                if not positional or self._phrases_match(seq, phrases, postings):
+                    if len(results) == limit:
+                        return results, True
+                    results.append(seq)
+            end = start
+            window *= 2
+        return results, False
+
+    @staticmethod
+    def _phrases_match(seq: int, phrases: list, postings: dict) -> bool:
+        for phrase in phrases:
+            if len(phrase) == 1:
+                continue
+            # Start positions of the phrase, narrowed token by token.
+            runs = None
+            for offset, token in enumerate(phrase):
+                here = postings[token].positions_at(bisect_left(postings[token].seqs, seq))
+                if runs is None:
+                    runs = here.tolist()
+                else:
+                    runs = [run for run in runs if run + offset in here]
+                    if not runs:
+                        return False
+        return True
+
+
+def _contains(seqs, seq: int) -> bool:
+    i = bisect_left(seqs, seq)
+    return i < len(seqs) and seqs[i] == seq
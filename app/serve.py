@@ -0,0 +1,23 @@
+"""Run the chat server with the tuned websocket protocol.
+
+    python -m app.serve --host 0.0.0.0 --port 80 --workers 4
+"""
+import argparse
+
+import uvicorn
+
+from app.compression import WebSocketProtocol
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    uvicorn.run("app.app:app", host=args.host, port=args.port, workers=args.workers,
+                ws=WebSocketProtocol)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""The chat over API Gateway websockets, one invocation per event.
+
+API Gateway holds the sockets and invokes the function for each connect,
+message and disconnect, identified by a connection ID; replies and
+broadcasts go back through its management API. Nothing survives between
+invocations, so connections and history live in a store (``SQLiteStore`` by
+default). Messages go through the same validation, reply previews and seq
+stamping as on the long-running server.
+
+The differences: rate limiting, idle timeouts and keepalive are API
+Gateway's job; there is no micro-batching or presence coalescing; and since
+nothing can be sent to a connection until its connect event has returned,
+clients ask for their first page with a ``history`` request instead of
+getting a snapshot.
+
+``handler`` is the Lambda entry point for both websocket events and plain
+HTTP requests, which go to the FastAPI app via Mangum.
+"""
+import time
+
+from app import config
+from app.codec import Envelope, codec
+from app.rooms import DEFAULT_ROOM, ROOM_NAME_RE, page_frame, resolve_reply
+from app.schema import MessageError, decode_message
+from app.sqlitestore import SQLiteStore
+
+
+class ApiGatewaySender:
+    """Posts frames to connections through the API Gateway management API."""
+
+    def __init__(self):
+        self._clients = {}
+
+    def __call__(self, endpoint: str, connection_id: str, frame: str) -> bool:
+        """Send one frame; False if the connection is gone."""
+        client = self._clients.get(endpoint)
+        if client is None:
+            # Only needed on this path, and preinstalled on Lambda.
+            import boto3
+            client = self._clients[endpoint] = boto3.client("apigatewaymanagementapi", endpoint_url=endpoint)
+        try:
+            client.post_to_connection(ConnectionId=connection_id, Data=frame.encode())
+        except client.exceptions.GoneException:
+            return False
+        return True
+
+
+class WebSocketAdapter:
+    """Turns API Gateway websocket events into chat actions.
+
+    ``send(endpoint, connection_id, frame)`` delivers a frame and returns
+    False for a connection that has gone away, which is then forgotten.
+    """
+
+    def __init__(self, store, send):
+        self.store = store
+        self.send = send
+
+    def __call__(self, event: dict, context=None) -> dict:
+        request = event["requestContext"]
+        kind = request["eventType"]
+        connection_id = request["connectionId"]
+        endpoint = f"https://{request.get('domainName')}/{request.get('stage')}"
+        if kind == "CONNECT":
+            return self.connect(connection_id, event.get("queryStringParameters") or {}, endpoint)
+        if kind == "DISCONNECT":
+            return self.disconnect(connection_id, endpoint)
+        return self.message(connection_id, event.get("body") or "", endpoint)
+
+    def connect(self, connection_id: str, params: dict, endpoint: str) -> dict:
+        room = params.get("room") or DEFAULT_ROOM
+        if not ROOM_NAME_RE.match(room):
+            return {"statusCode": 400}
+        username = params.get("username")
+        if username is not None and not 0 < len(username) <= config.USERNAME_MAX_LENGTH:
+            username = None
+        self.store.add_connection(connection_id, room, username)
+        if username is not None:
+            self._broadcast(room, codec.dumps({"type": "presence", "joined": [username]}), endpoint,
+                            exclude=connection_id)
+        return {"statusCode": 200}
+
+    def disconnect(self, connection_id: str, endpoint: str) -> dict:
+        row = self.store.remove_connection(connection_id)
+        if row is not None and row[1] is not None:
+            self._broadcast(row[0], codec.dumps({"type": "presence", "left": [row[1]]}), endpoint)
+        return {"statusCode": 200}
+
+    def message(self, connection_id: str, body: str, endpoint: str) -> dict:
+        row = self.store.connection(connection_id)
+        if row is None:
+            return {"statusCode": 410}
+        room, username = row
+        try:
+            message = decode_message(body)
+        except MessageError as e:
+            self._send(endpoint, connection_id, codec.dumps({"type": "error", "reason": str(e)}))
+            return {"statusCode": 200}
+        kind = message["type"]
+        if kind == "history":
+            self._send(endpoint, connection_id, self.history_page(room, message))
+        elif kind == "typing":
+            if username is not None:
+                delta = {"type": "presence", ("typing" if message["active"] else "idle"): [username]}
+                self._broadcast(room, codec.dumps(delta), endpoint, exclude=connection_id)
+        elif kind != "pong":
+            if username is None:
+                self.store.set_username(connection_id, message["username"])
+            if "replyTo" in message:
+                resolve_reply(message, lambda seq: self._lookup(room, seq))
+            message["ts"] = round(time.time(), 3)
+            envelope = self.store.append(room, Envelope(message))
+            self._broadcast(room, envelope.text, endpoint)
+        return {"statusCode": 200}
+
+    def history_page(self, room: str, request: dict) -> str:
+        before, before_seq, limit = request.get("before"), request.get("before_seq"), request.get("limit")
+        if before is not None:
+            before_seq = self.store.seq_of(room, str(before))
+            if before_seq is None:
+                return page_frame(None, False, [])
+        limit = max(1, min(limit if isinstance(limit, int) else config.JOIN_HISTORY_SIZE, config.HISTORY_PAGE_MAX))
+        first_seq, has_more, envelopes = self.store.page(room, before_seq, limit)
+        return page_frame(first_seq, has_more, envelopes)
+
+    def _lookup(self, room: str, message_id):
+        message_id = str(message_id)
+        return self.store.lookup(room, int(message_id)) if message_id.isascii() and message_id.isdecimal() else None
+
+    def _send(self, endpoint: str, connection_id: str, frame: str):
+        if not self.send(endpoint, connection_id, frame):
+            self.store.remove_connection(connection_id)
+
+    def _broadcast(self, room: str, frame: str, endpoint: str, exclude: str = None):
+        for member in self.store.members(room):
+            if member != exclude:
+                self._send(endpoint, member, frame)
+
+
+_adapter = None
+
+
+def handler(event: dict, context=None):
+    """Lambda entry point: websocket events here, anything else to the HTTP app."""
+    global _adapter
+    if "eventType" not in event.get("requestContext", {}):
+        from app.app import handler as http_handler
+        return http_handler(event, context)
+    if _adapter is None:
+        _adapter = WebSocketAdapter(SQLiteStore(config.SERVERLESS_DB), ApiGatewaySender())
+    return _adapter(event, context)
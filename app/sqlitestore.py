@@ -0,0 +1,122 @@
+"""Connection and history state for the serverless websocket path.
+
+Invocations share nothing in memory, so everything the long-running server
+keeps in ``ConnectionManager`` and the backplane lives here instead: which
+connections are in which room, and each room's messages with their seqs.
+``SQLiteStore`` keeps both in one SQLite file, which suits local runs, the
+event harness and single-host deployments; anything with the same methods
+(a DynamoDB table, say) can stand in for it.
+"""
+import os
+import sqlite3
+import threading
+
+from app.codec import Envelope
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS connections (
+    id TEXT PRIMARY KEY,
+    room TEXT NOT NULL,
+    username TEXT
+);
+CREATE INDEX IF NOT EXISTS connections_room ON connections (room);
+CREATE TABLE IF NOT EXISTS messages (
+    room TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    client_id TEXT,
+    text TEXT NOT NULL,
+    PRIMARY KEY (room, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS messages_client_id ON messages (room, client_id);
+"""
+
+
+class SQLiteStore:
+    def __init__(self, path: str):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit; ``append`` takes the write lock itself.
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        if path != ":memory:":
+            self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def add_connection(self, connection_id: str, room: str, username: str = None):
+        self.db.execute("INSERT OR REPLACE INTO connections VALUES (?, ?, ?)", (connection_id, room, username))
+
+    def connection(self, connection_id: str):
+        """``(room, username)`` for an open connection, or None."""
+        return self.db.execute("SELECT room, username FROM connections WHERE id = ?",
+                               (connection_id,)).fetchone()
+
+    def set_username(self, connection_id: str, username: str):
+        self.db.execute("UPDATE connections SET username = ? WHERE id = ?", (username, connection_id))
+
+    def remove_connection(self, connection_id: str):
+        """Forget a connection; returns its ``(room, username)``, or None."""
+        row = self.connection(connection_id)
+        if row is not None:
+            self.db.execute("DELETE FROM connections WHERE id = ?", (connection_id,))
+        return row
+
+    def members(self, room: str) -> list:
+        return [row[0] for row in self.db.execute("SELECT id FROM connections WHERE room = ?", (room,))]
+
+    def append(self, room: str, envelope: Envelope) -> Envelope:
+        """Stamp ``envelope`` with the room's next seq, store it and return it."""
+        client_id = envelope.message.get("client_id")
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so concurrent writers
+            # (other processes on the host) cannot hand out the same seq.
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                last_seq = self.last_seq(room)
+                envelope = envelope.sequenced(last_seq + 1)
+                self.db.execute("INSERT INTO messages VALUES (?, ?, ?, ?)",
+                                (room, last_seq + 1, None if client_id is None else str(client_id), envelope.text))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return envelope
+
+    def last_seq(self, room: str) -> int:
+        return self.db.execute("SELECT COALESCE(MAX(seq), 0) FROM messages WHERE room = ?", (room,)).fetchone()[0]
+
+    def lookup(self, room: str, seq: int):
+        # Checked first: sqlite cannot bind an integer past 64 bits.
+        if not 0 < seq <= self.last_seq(room):
+            return None
+        row = self.db.execute("SELECT text FROM messages WHERE room = ? AND seq = ?", (room, seq)).fetchone()
+        return Envelope.decode(row[0]) if row is not None else None
+
+    def seq_of(self, room: str, message_id: str):
+        """Resolve a client-supplied ID, or a server ID (the seq itself)."""
+        row = self.db.execute("SELECT MAX(seq) FROM messages WHERE room = ? AND client_id = ?",
+                              (room, message_id)).fetchone()
+        if row[0] is not None:
+            return row[0]
+        if message_id.isascii() and message_id.isdecimal() and 0 < int(message_id) <= self.last_seq(room):
+            return int(message_id)
+        return None
+
+    def page(self, room: str, before_seq: int = None, limit: int = 50):
+        """Return ``(first_seq, has_more, envelopes)``, oldest first, like ``Hub.page``."""
+        if before_seq is not None:
+            # Clamped, since it may come straight from the client.
+            before_seq = min(max(before_seq, 0), self.last_seq(room) + 1)
+        if before_seq is None:
+            rows = self.db.execute("SELECT seq, text FROM messages WHERE room = ? ORDER BY seq DESC LIMIT ?",
+                                   (room, limit)).fetchall()
+        else:
+            rows = self.db.execute("SELECT seq, text FROM messages WHERE room = ? AND seq < ? "
+                                   "ORDER BY seq DESC LIMIT ?", (room, before_seq, limit)).fetchall()
+        if not rows:
+            return before_seq, False, []
+        rows.reverse()
+        first_seq = rows[0][0]
+        return first_seq, first_seq > 1, [Envelope.decode(text) for _, text in rows]
+
+    def close(self):
+        self.db.close()
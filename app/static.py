@@ -0,0 +1,116 @@
+"""The browser client, served from ``app/static`` with precompressed variants.
+
+On first request each asset is read once and compressed once (gzip, plus
+brotli when the ``brotli`` package is installed); requests then pick a variant
+by ``Accept-Encoding`` and get the stored bytes. The stylesheet and script are
+served under content-hashed names (``chat.<hash>.js``) that ``index.html`` is
+rewritten to reference, so they can be cached forever, while the page itself
+is revalidated with its ETag on every load.
+"""
+import gzip
+import hashlib
+import os
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+VERSIONED = ("chat.css", "chat.js")
+CONTENT_TYPES = {
+    ".html": "text/html",
+    ".css": "text/css",
+    ".js": "text/javascript",
+}
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+router = APIRouter()
+
+
+class Asset:
+    __slots__ = ("content_type", "cache_control", "digest", "variants")
+
+    def __init__(self, body: bytes, content_type: str, cache_control: str):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {"identity": body, "gzip": gzip.compress(body, 9, mtime=0)}
+        brotli = _brotli()
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+
+    def response(self, request: Request) -> Response:
+        encoding = _choose_encoding(request.headers.get("accept-encoding", ""), self.variants)
+        etag = f'"{self.digest}-{encoding}"'
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], headers=headers, media_type=self.content_type)
+
+
+def _choose_encoding(accept_encoding: str, variants: dict) -> str:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(name.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in variants and (encoding in accepted or "*" in accepted):
+            return encoding
+    return "identity"
+
+
+def _brotli():
+    # Optional, and only needed when the assets are first built.
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _read(name: str) -> bytes:
+    with open(os.path.join(STATIC_DIR, name), "rb") as f:
+        return f.read()
+
+
+def _content_type(name: str) -> str:
+    return CONTENT_TYPES.get(os.path.splitext(name)[1], "application/octet-stream")
+
+
+_assets = None
+
+
+def assets() -> dict:
+    """URL name -> ``Asset``, built on first use."""
+    global _assets
+    if _assets is None:
+        built = {}
+        page = _read("index.html")
+        for name in VERSIONED:
+            body = _read(name)
+            asset = Asset(body, _content_type(name), IMMUTABLE)
+            stem, ext = os.path.splitext(name)
+            versioned = f"{stem}.{asset.digest}{ext}"
+            built[versioned] = asset
+            # The plain name still works, but has to be revalidated.
+            built[name] = Asset(body, asset.content_type, REVALIDATE)
+            page = page.replace(f'"/static/{name}"'.encode(), f'"/static/{versioned}"'.encode())
+        built["index.html"] = Asset(page, _content_type("index.html"), REVALIDATE)
+        _assets = built
+    return _assets
+
+
+@router.get("/")
+async def get_index(request: Request):
+    return assets()["index.html"].response(request)
+
+
+@router.get("/static/{name}")
+async def get_static(name: str, request: Request):
+    asset = assets().get(name)
+    if asset is None or name == "index.html":
+        raise HTTPException(status_code=404, detail="Not found")
+    return asset.response(request)
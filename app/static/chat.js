@@ -0,0 +1,362 @@
+const room = new URLSearchParams(window.location.search).get("room");
+const wsPath = room ? `/ws/chat/${encodeURIComponent(room)}` : "/ws/chat";
+let ws;
+let lastSeq = null;
+let reconnectDelay = 500;
+const messages = document.getElementById("messages");
+const messageInput = document.getElementById("messageText");
+const imageInput = document.getElementById("imageInput");
+const usernameInput = document.getElementById("usernameInput");
+const usernameDialog = document.getElementById("usernameDialog");
+const setUsernameButton = document.getElementById("setUsername");
+const replyPreview = document.getElementById("replyPreview");
+const replyToUsername = document.getElementById("replyToUsername");
+const replyToContent = document.getElementById("replyToContent");
+const presenceLabel = document.getElementById("presence");
+const typingLabel = document.getElementById("typing");
+
+let username = localStorage.getItem("username");
+let replyingTo = null;
+
+if (username) {
+    usernameDialog.style.display = "none";
+}
+
+setUsernameButton.addEventListener("click", () => {
+    username = usernameInput.value.trim();
+    if (username) {
+        localStorage.setItem("username", username);
+        usernameDialog.style.display = "none";
+    } else {
+        usernameInput.classList.add("error");
+    }
+});
+
+function compressImage(file) {
+    return new Promise((resolve) => {
+        const reader = new FileReader();
+        reader.onload = (e) => {
+            const img = new Image();
+            img.onload = () => {
+                const canvas = document.createElement('canvas');
+                let width = img.width;
+                let height = img.height;
+
+                // Max dimensions
+                const MAX_WIDTH = 1200;
+                const MAX_HEIGHT = 1200;
+
+                if (width > height) {
+                    if (width > MAX_WIDTH) {
+                        height *= MAX_WIDTH / width;
+                        width = MAX_WIDTH;
+                    }
+                } else {
+                    if (height > MAX_HEIGHT) {
+                        width *= MAX_HEIGHT / height;
+                        height = MAX_HEIGHT;
+                    }
+                }
+
+                canvas.width = width;
+                canvas.height = height;
+
+                const ctx = canvas.getContext('2d');
+                ctx.drawImage(img, 0, 0, width, height);
+
+                canvas.toBlob(resolve, 'image/jpeg', 0.8);
+            };
+            img.src = e.target.result;
+        };
+        reader.readAsDataURL(file);
+    });
+}
+
+// Images travel out of band: upload the bytes, send only the media ID.
+async function uploadImage(blob) {
+    const response = await fetch("/media", {
+        method: "POST",
+        headers: { "Content-Type": blob.type },
+        body: blob
+    });
+    if (!response.ok) {
+        throw new Error(`Image upload failed: ${response.status}`);
+    }
+    return (await response.json()).id;
+}
+
+function mediaUrl(content) {
+    // Older history entries may still carry inline data URLs.
+    return content.startsWith("data:") ? content : `/media/${content}`;
+}
+
+function thumbnailUrl(content) {
+    return content.startsWith("data:") ? content : `/media/${content}/thumbnail`;
+}
+
+function setReply(messageId, replyUsername, content, type) {
+    replyingTo = messageId;
+    replyToUsername.textContent = replyUsername;
+
+    if (type === 'image') {
+        replyToContent.innerHTML = `<img src="${thumbnailUrl(content)}" style="max-height: 50px;">`;
+    } else {
+        replyToContent.textContent = content;
+    }
+
+    replyPreview.style.display = "flex";
+    messageInput.focus();
+}
+
+function cancelReply() {
+    replyingTo = null;
+    replyPreview.style.display = "none";
+}
+
+let hasMoreHistory = false;
+let loadingHistory = false;
+
+function connect() {
+    const params = new URLSearchParams();
+    const savedUsername = localStorage.getItem("username");
+    if (savedUsername) {
+        params.set("username", savedUsername);
+    }
+    // After a drop, ask only for the messages we missed.
+    if (lastSeq !== null) {
+        params.set("resume_from", lastSeq);
+    }
+    const query = params.toString() ? `?${params}` : "";
+    ws = new WebSocket(`wss://${window.location.host}${wsPath}${query}`);
+    ws.onopen = () => {
+        reconnectDelay = 500;
+    };
+    ws.onmessage = handleFrame;
+    ws.onclose = () => {
+        setTimeout(connect, reconnectDelay);
+        reconnectDelay = Math.min(reconnectDelay * 2, 10000);
+    };
+}
+
+function handleFrame(event) {
+    const data = JSON.parse(event.data);
+    // Batched broadcasts and slow connections' backlogs arrive as an
+    // array of frames.
+    const frames = Array.isArray(data) ? data : [data];
+    const incoming = [];
+    frames.forEach((frame) => {
+        if (frame.type === "snapshot") {
+            // A fresh start: replaces whatever we were showing.
+            messages.replaceChildren();
+            incoming.length = 0;
+            hasMoreHistory = frame.has_more;
+            incoming.push(...frame.messages);
+        } else if (frame.type === "history") {
+            prependMessages(frame);
+        } else if (frame.type === "ping") {
+            ws.send(JSON.stringify({ type: "pong" }));
+        } else if (frame.type === "presence") {
+            updatePresence(frame);
+        } else if (frame.type === "error") {
+            console.warn("Message rejected:", frame.reason);
+        } else {
+            incoming.push(frame);
+        }
+    });
+    if (incoming.length) {
+        renderMessages(incoming);
+    }
+}
+
+// Older messages are fetched a page at a time when scrolled to the top.
+messages.addEventListener("scroll", () => {
+    const oldest = messages.firstElementChild;
+    if (messages.scrollTop === 0 && hasMoreHistory && !loadingHistory && oldest) {
+        loadingHistory = true;
+        ws.send(JSON.stringify({
+            type: "history",
+            before_seq: Number(oldest.getAttribute("data-seq"))
+        }));
+    }
+});
+
+// Presence arrives as a full roster on connect, then as deltas.
+const online = new Set();
+const typing = new Set();
+
+function updatePresence(frame) {
+    if (frame.online) {
+        online.clear();
+        typing.clear();
+        frame.online.forEach((name) => online.add(name));
+    }
+    (frame.joined || []).forEach((name) => online.add(name));
+    (frame.left || []).forEach((name) => {
+        online.delete(name);
+        typing.delete(name);
+    });
+    (frame.typing || []).forEach((name) => typing.add(name));
+    (frame.idle || []).forEach((name) => typing.delete(name));
+    presenceLabel.textContent = `${online.size} online`;
+    const others = [...typing].filter((name) => name !== username);
+    typingLabel.textContent = others.length === 0 ? ""
+        : others.length > 3 ? "Several people are typing..."
+        : `${others.join(", ")} ${others.length === 1 ? "is" : "are"} typing...`;
+}
+
+// Typing is a lease the server lets lapse, so renew it while typing rather
+// than reporting every keystroke.
+const TYPING_RENEW_MS = 3000;
+let typingSentAt = 0;
+
+messageInput.addEventListener("input", () => {
+    if (!ws || ws.readyState !== WebSocket.OPEN || !username) {
+        return;
+    }
+    const now = Date.now();
+    if (messageInput.value && now - typingSentAt > TYPING_RENEW_MS) {
+        typingSentAt = now;
+        ws.send(JSON.stringify({ type: "typing" }));
+    } else if (!messageInput.value && typingSentAt) {
+        typingSentAt = 0;
+        ws.send(JSON.stringify({ type: "typing", active: false }));
+    }
+});
+
+function prependMessages(frame) {
+    loadingHistory = false;
+    hasMoreHistory = frame.has_more;
+    const fragment = document.createDocumentFragment();
+    frame.messages.forEach((data) => fragment.appendChild(buildMessage(data)));
+    const previousHeight = messages.scrollHeight;
+    messages.insertBefore(fragment, messages.firstChild);
+    messages.scrollTop = messages.scrollHeight - previousHeight;
+}
+
+// Build every card first and insert them in one DOM pass.
+function renderMessages(list) {
+    const fragment = document.createDocumentFragment();
+    list.forEach((data) => {
+        fragment.appendChild(buildMessage(data));
+        if (data.seq && (lastSeq === null || data.seq > lastSeq)) {
+            lastSeq = data.seq;
+        }
+    });
+    messages.appendChild(fragment);
+    messages.scrollTop = messages.scrollHeight;
+}
+
+function buildMessage(data) {
+    const messageCard = document.createElement("li");
+    messageCard.classList.add("message-card");
+    messageCard.setAttribute("data-message-id", data.id);
+    messageCard.setAttribute("data-seq", data.seq);
+    messageCard.setAttribute("data-message-type", data.type);
+    if (data.type === "image") {
+        messageCard.setAttribute("data-media-id", data.content);
+    }
+
+    if (data.username === username) {
+        messageCard.classList.add("self");
+    }
+
+    const usernameDiv = document.createElement("div");
+    usernameDiv.classList.add("username");
+
+    const usernameText = document.createElement("span");
+    usernameText.textContent = data.username;
+    usernameDiv.appendChild(usernameText);
+
+    const actions = document.createElement("div");
+    actions.classList.add("message-actions");
+
+    const replyButton = document.createElement("button");
+    replyButton.classList.add("action-button");
+    replyButton.innerHTML = '<span class="material-icons">reply</span>';
+    replyButton.onclick = () => setReply(data.id, data.username, data.content, data.type);
+    actions.appendChild(replyButton);
+
+    usernameDiv.appendChild(actions);
+
+    const messageContentDiv = document.createElement("div");
+    messageContentDiv.classList.add("message-content");
+
+    if (data.replyTo) {
+        const replyDiv = document.createElement("div");
+        replyDiv.classList.add("reply-content");
+
+        const replyUsername = document.createElement("div");
+        replyUsername.classList.add("reply-username");
+        replyUsername.textContent = data.replyTo.username || "";
+
+        const replyContent = document.createElement("div");
+        if (data.replyTo.type === 'image') {
+            replyContent.innerHTML = `<img src="${thumbnailUrl(data.replyTo.content)}" style="max-height: 50px;">`;
+        } else if (data.replyTo.type === 'text') {
+            replyContent.textContent = data.replyTo.content;
+        } else {
+            replyContent.textContent = "Original message unavailable";
+        }
+
+        replyDiv.appendChild(replyUsername);
+        replyDiv.appendChild(replyContent);
+        messageContentDiv.appendChild(replyDiv);
+    }
+
+    if (data.type === "text") {
+        messageContentDiv.appendChild(document.createTextNode(data.content));
+    } else if (data.type === "image") {
+        const img = document.createElement("img");
+        img.src = mediaUrl(data.content);
+        messageContentDiv.appendChild(img);
+    }
+
+    messageCard.appendChild(usernameDiv);
+    messageCard.appendChild(messageContentDiv);
+    return messageCard;
+}
+
+connect();
+
+async function sendMessage(event) {
+    event.preventDefault();
+
+    if (!username) {
+        alert("Please set your username first!");
+        return;
+    }
+
+    // The server assigns the message ID and sequence number.
+    const messageData = {
+        username: username,
+        timestamp: new Date().toISOString()
+    };
+
+    if (replyingTo) {
+        // The server fills in the preview from the original message.
+        messageData.replyTo = { id: replyingTo };
+        cancelReply();
+    }
+
+    if (messageInput.value) {
+        ws.send(JSON.stringify({
+            ...messageData,
+            type: "text",
+            content: messageInput.value
+        }));
+        messageInput.value = "";
+        // Sending a message ends the typing lease on the server too.
+        typingSentAt = 0;
+    }
+
+    if (imageInput.files.length > 0) {
+        const compressedImage = await compressImage(imageInput.files[0]);
+        const mediaId = await uploadImage(compressedImage);
+        ws.send(JSON.stringify({
+            ...messageData,
+            type: "image",
+            content: mediaId
+        }));
+        imageInput.value = "";
+    }
+}
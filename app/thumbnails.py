@@ -0,0 +1,119 @@
+"""Server-side reply thumbnails, rendered off the event loop and LRU-cached.
+
+Thumbnails are keyed by media ID, which is already a content hash, so each
+image is rendered at most once while it stays cached (in memory, then on disk
+next to the original). Rendering needs Pillow; without it ``get`` returns None
+and callers fall back to the full image.
+"""
+import asyncio
+import importlib.util
+import io
+import os
+from collections import OrderedDict
+
+# Checked without importing it; Pillow is only loaded by the worker processes.
+PIL_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+THUMB_SIZE = 100
+THUMB_QUALITY = 70
+
+
+def render_thumbnail(data: bytes, size: int = THUMB_SIZE) -> bytes:
+    # Runs in a worker process.
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img.thumbnail((size, size))
+        out = io.BytesIO()
+        img.convert("RGB").save(out, "JPEG", quality=THUMB_QUALITY)
+        return out.getvalue()
+
+
+class ThumbnailCache:
+    def __init__(self, max_entries: int = 1024, max_workers: int = None):
+        self.max_entries = max_entries
+        self.max_workers = max_workers
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._executor = None
+
+    @property
+    def available(self) -> bool:
+        return PIL_AVAILABLE
+
+    def _pool(self):
+        if self._executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # Not fork: the server already runs threads (the log's IO pool,
+            # the default executor), which a forked child could deadlock on.
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context("forkserver"))
+        return self._executor
+
+    def _remember(self, key: str, thumbnail: bytes):
+        self._entries[key] = thumbnail
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str, source_path: str):
+        """Return the JPEG thumbnail for the image stored at ``source_path``."""
+        thumbnail = self._entries.get(key)
+        if thumbnail is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return thumbnail
+        if not self.available:
+            return None
+        # Concurrent requests for the same image share one render.
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._load(key, source_path))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _load(self, key: str, source_path: str) -> bytes:
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        thumb_path = source_path + ".thumb"
+        try:
+            thumbnail = await loop.run_in_executor(None, _read_file, thumb_path)
+        except FileNotFoundError:
+            data = await loop.run_in_executor(None, _read_file, source_path)
+            thumbnail = await loop.run_in_executor(self._pool(), render_thumbnail, data)
+            await loop.run_in_executor(None, _write_file, thumb_path, thumbnail)
+        self._remember(key, thumbnail)
+        return thumbnail
+
+    def warm(self, key: str, source_path: str):
+        """Render in the background, e.g. right after an upload."""
+        if self.available and key not in self._entries:
+            asyncio.ensure_future(self.get(key, source_path)).add_done_callback(_discard_result)
+
+    def shutdown(self):
+        if self._executor is not None:
+            # Waits for a render in progress, so the pool is cleaned up before exit.
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+def _discard_result(task: asyncio.Future):
+    # A broken upload just won't get a thumbnail; don't log it as unretrieved.
+    if not task.cancelled():
+        task.exception()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_file(path: str, data: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,85 @@
+"""Outbound micro-batching: frames sent and delivery latency per batch window.
+
+Broadcasts a lunch-rush burst into one room and compares sending every
+message as its own frame against batching them per window::
+
+    python -m bench.batching --sockets 1000 --windows 0,5,20
+"""
+import argparse
+import asyncio
+import json
+from time import perf_counter
+
+from app.codec import Envelope
+from app.fanout import Connection
+from app.rooms import Room
+
+
+class FakeSocket:
+    def __init__(self, stats: dict, latencies: list):
+        self.stats = stats
+        self.latencies = latencies
+
+    async def send_text(self, text: str):
+        await asyncio.sleep(0)
+        now = perf_counter()
+        self.stats["frames"] += 1
+        self.stats["bytes"] += len(text)
+        data = json.loads(text)
+        for message in data if isinstance(data, list) else [data]:
+            self.latencies.append(now - message["sent_at"])
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+async def _run(args, window: float, stats: dict, latencies: list):
+    room = Room("bench", batch_window=window, batch_bytes=args.batch_bytes)
+    connections = []
+    for _ in range(args.sockets):
+        connection = Connection(FakeSocket(stats, latencies), args.queue_size)
+        connection.start()
+        room.members.add(connection)
+        connections.append(connection)
+    for _ in range(args.messages):
+        room.broadcast(Envelope({"type": "text", "username": "kitchen",
+                                 "content": "x" * 64, "sent_at": perf_counter()}))
+        await asyncio.sleep(args.interval)
+    room.flush()
+    while any(c.pending for c in connections):
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.01)
+    for connection in connections:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sockets", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.002, help="seconds between broadcasts")
+    parser.add_argument("--windows", default="0,5,20", help="batch windows in ms, comma separated")
+    parser.add_argument("--batch-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--queue-size", type=int, default=256)
+    args = parser.parse_args()
+
+    for window_ms in (float(w) for w in args.windows.split(",")):
+        stats = {"frames": 0, "bytes": 0}
+        latencies = []
+        start = perf_counter()
+        asyncio.run(_run(args, window_ms / 1000, stats, latencies))
+        elapsed = perf_counter() - start
+        print(f"window={window_ms:5.1f}ms elapsed={elapsed:6.2f}s frames={stats['frames']:8d} "
+              f"delivered={len(latencies) / elapsed:10.0f} msg/s "
+              f"p50={_percentile(latencies, 50) * 1e3:7.2f}ms p99={_percentile(latencies, 99) * 1e3:7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Sustained ingest throughput and tail-read latency of the durable chat log.
+
+    python -m bench.chatlog --records 200000 --size 200
+"""
+import argparse
+import asyncio
+import shutil
+import tempfile
+from time import perf_counter
+
+from app.chatlog import SegmentedLog
+
+
+async def _ingest(log: SegmentedLog, records: int, payload: bytes, burst: int) -> float:
+    start = perf_counter()
+    for i in range(0, records, burst):
+        for _ in range(min(burst, records - i)):
+            log.append(payload)
+        # Yield like a busy server would; the next burst joins the next commit.
+        await asyncio.sleep(0)
+    await log.flush()
+    return perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--size", type=int, default=200, help="payload bytes per record")
+    parser.add_argument("--burst", type=int, default=100, help="appends per event loop turn")
+    parser.add_argument("--segment-bytes", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--no-fsync", action="store_true")
+    parser.add_argument("--dir", help="log directory (default: a temporary one)")
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="chatlog-bench-")
+    payload = b'{"type":"text","content":"' + b"x" * max(args.size - 28, 0) + b'"}'
+    try:
+        log = SegmentedLog(directory, args.segment_bytes, sync=not args.no_fsync)
+        elapsed = asyncio.run(_ingest(log, args.records, payload, args.burst))
+        mb = args.records * len(payload) / 1e6
+        print(f"ingest   {args.records} records, {mb:.1f} MB in {elapsed:.3f}s: "
+              f"{args.records / elapsed:,.0f} records/s, {mb / elapsed:.1f} MB/s, "
+              f"{len(log.segments)} segment(s)")
+
+        for count in (100, 1000):
+            start = perf_counter()
+            rounds = 100
+            for _ in range(rounds):
+                log.tail(count)
+            print(f"tail({count}) {(perf_counter() - start) / rounds * 1e6:9.1f} us")
+        log.close()
+
+        start = perf_counter()
+        log = SegmentedLog(directory, args.segment_bytes)
+        print(f"reopen   {(perf_counter() - start) * 1e3:9.1f} ms for {len(log)} records")
+        log.close()
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Connect/disconnect churn: list-based bookkeeping vs the connection registry.
+
+Simulates a reconnect storm after a deploy::
+
+    python -m bench.churn --connections 10000
+"""
+import argparse
+import asyncio
+import os
+import random
+from time import perf_counter
+
+# History in memory only: the bench must not write a log into the checkout,
+# or fail because a running server holds it.
+os.environ["CHAT_LOG_DIR"] = ""
+
+from app.app import ConnectionManager  # noqa: E402
+
+
+class FakeSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class ListManager:
+    """The previous bookkeeping: a plain list with O(n) remove and lookup."""
+
+    def __init__(self):
+        self.active_connections = []
+
+    async def connect(self, websocket):
+        await websocket.accept()
+        self.active_connections.append(websocket)
+        return websocket
+
+    def disconnect(self, websocket):
+        self.active_connections.remove(websocket)
+
+
+async def _churn(manager, sockets, order, lookup):
+    start = perf_counter()
+    connections = []
+    for socket in sockets:
+        connections.append(await manager.connect(socket))
+    for i in order:
+        lookup(manager, connections[i])
+        manager.disconnect(connections[i])
+    return perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=10000)
+    args = parser.parse_args()
+
+    sockets = [FakeSocket() for _ in range(args.connections)]
+    order = list(range(args.connections))
+    random.Random(1).shuffle(order)
+
+    elapsed = asyncio.run(_churn(ListManager(), sockets, order,
+                                 lambda m, ws: ws in m.active_connections))
+    print(f"{'list':<10} {args.connections} connects+disconnects in {elapsed * 1e3:9.1f} ms")
+
+    async def registry():
+        manager = ConnectionManager()
+        room = manager.rooms.get("bench")
+
+        class Adapter:
+            async def connect(self, websocket):
+                return await manager.connect(websocket, room)
+
+            def disconnect(self, connection):
+                manager.disconnect(connection)
+
+        return await _churn(Adapter(), sockets, order, lambda m, c: c in manager)
+
+    elapsed = asyncio.run(registry())
+    print(f"{'registry':<10} {args.connections} connects+disconnects in {elapsed * 1e3:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Broadcast delivery latency with a fraction of artificially slow sockets.
+
+Compares the old sequential ``await send_text`` loop against the per-connection
+queue fan-out from ``app.fanout``::
+
+    python -m bench.fanout --sockets 1000 --slow-ratio 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+from time import perf_counter
+
+from app.fanout import Connection, OVERFLOW_POLICIES
+
+
+class FakeSocket:
+    def __init__(self, delay: float, latencies: list):
+        self.delay = delay
+        self.latencies = latencies
+
+    async def send_text(self, text: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            await asyncio.sleep(0)
+        now = perf_counter()
+        for message in _unpack(text):
+            self.latencies.append(now - message["sent_at"])
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def _unpack(text: str):
+    data = json.loads(text)
+    return data if isinstance(data, list) else [data]
+
+
+def _make_sockets(args, fast: list, slow: list):
+    rng = random.Random(42)
+    slow_ids = set(rng.sample(range(args.sockets), int(args.sockets * args.slow_ratio)))
+    return [
+        FakeSocket(args.slow_delay, slow) if i in slow_ids else FakeSocket(0, fast)
+        for i in range(args.sockets)
+    ]
+
+
+async def _sequential(args, fast: list, slow: list):
+    sockets = _make_sockets(args, fast, slow)
+    for _ in range(args.messages):
+        message = {"type": "text", "content": "x" * 64, "sent_at": perf_counter()}
+        for socket in sockets:
+            await socket.send_text(json.dumps(message))
+        await asyncio.sleep(args.interval)
+
+
+async def _fanout(args, fast: list, slow: list):
+    connections = []
+    for socket in _make_sockets(args, fast, slow):
+        connection = Connection(socket, args.queue_size, args.policy)
+        connection.start()
+        connections.append(connection)
+    for _ in range(args.messages):
+        frame = json.dumps({"type": "text", "content": "x" * 64, "sent_at": perf_counter()})
+        for connection in connections:
+            connection.send(frame)
+        await asyncio.sleep(args.interval)
+    # Let the writers drain before measuring.
+    deadline = perf_counter() + args.messages * args.slow_delay + 1
+    while perf_counter() < deadline and any(c.pending for c in connections if not c.closed):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(args.slow_delay * 2)  # last frames still in flight
+    for connection in connections:
+        connection.close()
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+def _report(name: str, fast: list, slow: list, elapsed: float):
+    print(f"{name:<12} elapsed={elapsed:7.3f}s  "
+          f"fast p50={_percentile(fast, 50) * 1e3:8.2f}ms p99={_percentile(fast, 99) * 1e3:8.2f}ms  "
+          f"slow p99={_percentile(slow, 99) * 1e3:8.2f}ms  delivered={len(fast) + len(slow)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sockets", type=int, default=1000)
+    parser.add_argument("--slow-ratio", type=float, default=0.05)
+    parser.add_argument("--slow-delay", type=float, default=0.01, help="seconds per send on slow sockets")
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.005, help="seconds between broadcasts")
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--policy", choices=OVERFLOW_POLICIES, default="drop_oldest")
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+
+    runs = [("fanout", _fanout)]
+    if not args.skip_sequential:
+        runs.insert(0, ("sequential", _sequential))
+    for name, run in runs:
+        fast, slow = [], []
+        start = perf_counter()
+        asyncio.run(run(args, fast, slow))
+        _report(name, fast, slow, perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
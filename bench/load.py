@@ -0,0 +1,260 @@
+"""End-to-end load test: simulated websocket clients against a running server.
+
+Starts the app (in a uvicorn subprocess by default, or in this process), opens
+``--clients`` connections spread over ``--rooms`` rooms, drives a mix of text,
+image and reply messages with some join/leave churn, and reports throughput
+and p50/p95/p99 latency. Results are written as JSON for comparing commits::
+
+    python -m bench.load --clients 500 --rooms 5 --duration 20 --output results.json
+    python -m bench.load --url ws://127.0.0.1:8000 --clients 200
+
+Latency is from the sender stamping a message to each member receiving it, so
+it covers validation, ingest, history, fan-out and the socket write.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import urllib.request
+from time import perf_counter, sleep, time
+
+from websockets.asyncio.client import connect
+
+
+def _percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] * 1e3, 3)
+
+    return {"count": len(ordered), "p50_ms": at(50), "p95_ms": at(95), "p99_ms": at(99),
+            "max_ms": round(ordered[-1] * 1e3, 3)}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _upload_image(http_url: str) -> str:
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (200, 80, 40)).save(buffer, "PNG")
+    request = urllib.request.Request(http_url + "/media", data=buffer.getvalue(), method="POST",
+                                     headers={"Content-Type": "image/png"})
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)["id"]
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self.rejected = 0
+        self.latencies = []
+        self.connect_times = []
+
+
+class Client:
+    def __init__(self, args, stats: Stats, url: str, name: str, rng: random.Random, media_id: str):
+        self.args = args
+        self.stats = stats
+        self.url = url
+        self.name = name
+        self.rng = rng
+        self.media_id = media_id
+        self.recent_ids = []
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                await self._session(stop)
+            except Exception:
+                self.stats.errors += 1
+                await asyncio.sleep(0.1)
+
+    async def _session(self, stop: asyncio.Event):
+        start = perf_counter()
+        async with connect(self.url, max_size=None) as ws:
+            self.stats.connect_times.append(perf_counter() - start)
+            reader = asyncio.ensure_future(self._read(ws))
+            try:
+                # Churn: some sessions end early and reconnect.
+                lifetime = (self.rng.expovariate(self.args.churn) if self.args.churn > 0 else float("inf"))
+                deadline = perf_counter() + lifetime
+                while not stop.is_set() and perf_counter() < deadline:
+                    if self.rng.random() < self.args.sender_ratio:
+                        await ws.send(self._message())
+                        self.stats.sent += 1
+                    await asyncio.sleep(self.rng.expovariate(1 / self.args.interval))
+            finally:
+                reader.cancel()
+
+    def _message(self) -> str:
+        message = {"username": self.name, "timestamp": f"{time():.6f}"}
+        roll = self.rng.random()
+        if roll < self.args.image_ratio:
+            message.update(type="image", content=self.media_id)
+        else:
+            message.update(type="text", content="order up " * self.rng.randint(1, 12))
+            if self.recent_ids and roll < self.args.image_ratio + self.args.reply_ratio:
+                message["replyTo"] = {"id": self.rng.choice(self.recent_ids)}
+        return json.dumps(message)
+
+    async def _read(self, ws):
+        async for raw in ws:
+            now = time()
+            data = json.loads(raw)
+            for frame in data if isinstance(data, list) else [data]:
+                kind = frame.get("type")
+                if kind == "ping":
+                    await ws.send('{"type":"pong"}')
+                elif kind == "error":
+                    self.stats.rejected += 1
+                elif kind in ("text", "image") and "timestamp" in frame:
+                    self.stats.received += 1
+                    self.stats.latencies.append(now - float(frame["timestamp"]))
+                    self.recent_ids = (self.recent_ids + [frame["id"]])[-20:]
+
+
+async def _drive(args, ws_url: str, http_url: str) -> dict:
+    rng = random.Random(args.seed)
+    # On a thread: with --in-process the server shares this event loop.
+    media_id = await asyncio.to_thread(_upload_image, http_url) if args.image_ratio > 0 else None
+    stats = Stats()
+    stop = asyncio.Event()
+    tasks = []
+    start = perf_counter()
+    for i in range(args.clients):
+        room = f"load-{i % args.rooms}"
+        client = Client(args, stats, f"{ws_url}/ws/chat/{room}", f"user{i}", random.Random(rng.random()), media_id)
+        tasks.append(asyncio.ensure_future(client.run(stop)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.clients)
+    ramp_elapsed = perf_counter() - start
+    measure_start = perf_counter()
+    sent_before, received_before = stats.sent, stats.received
+    latencies_before = len(stats.latencies)
+    await asyncio.sleep(args.duration)
+    elapsed = perf_counter() - measure_start
+    sent, received = stats.sent - sent_before, stats.received - received_before
+    latencies = stats.latencies[latencies_before:]
+    stop.set()
+    await asyncio.sleep(args.interval * 2)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        "ramp_seconds": round(ramp_elapsed, 3),
+        "duration_seconds": round(elapsed, 3),
+        "sent": sent,
+        "delivered": received,
+        "sent_per_second": round(sent / elapsed, 1),
+        "delivered_per_second": round(received / elapsed, 1),
+        "rejected": stats.rejected,
+        "errors": stats.errors,
+        "latency": _percentiles(latencies),
+        "connect": _percentiles(stats.connect_times),
+    }
+
+
+async def _in_process(args, port: int) -> dict:
+    import uvicorn
+    from app.compression import WebSocketProtocol
+    server = uvicorn.Server(uvicorn.Config("app.app:app", host="127.0.0.1", port=port,
+                                           ws=WebSocketProtocol, log_level="warning"))
+    serving = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    try:
+        return await _drive(args, f"ws://127.0.0.1:{port}", f"http://127.0.0.1:{port}")
+    finally:
+        server.should_exit = True
+        await serving
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="ws:// base URL of a running server; otherwise one is started")
+    parser.add_argument("--in-process", action="store_true", help="run the server in this process")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds measured after ramp-up")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds to open all connections over")
+    parser.add_argument("--interval", type=float, default=1.0, help="mean seconds between a sender's messages")
+    parser.add_argument("--sender-ratio", type=float, default=0.5, help="chance a client sends each interval")
+    parser.add_argument("--image-ratio", type=float, default=0.1)
+    parser.add_argument("--reply-ratio", type=float, default=0.2)
+    parser.add_argument("--churn", type=float, default=0.02,
+                        help="reconnects per client per second (0 for none)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON result here")
+    args = parser.parse_args()
+
+    server = None
+    data_dir = None
+    if args.url:
+        ws_url = args.url.rstrip("/")
+        http_url = "http" + ws_url[2:]
+    else:
+        port = _free_port()
+        ws_url, http_url = f"ws://127.0.0.1:{port}", f"http://127.0.0.1:{port}"
+        # A throwaway data directory, and no per-client rate limits: the
+        # simulated clients share one address and deliberately send a lot.
+        data_dir = tempfile.TemporaryDirectory(prefix="chat-load-")
+        os.environ.update({
+            "CHAT_LOG_DIR": os.path.join(data_dir.name, "log"),
+            "CHAT_MEDIA_DIR": os.path.join(data_dir.name, "media"),
+            "CHAT_RATE_LIMIT_MESSAGES": os.environ.get("CHAT_RATE_LIMIT_MESSAGES", "0"),
+            "CHAT_ROOM_RATE_LIMIT_MESSAGES": os.environ.get("CHAT_ROOM_RATE_LIMIT_MESSAGES", "0"),
+        })
+        if not args.in_process:
+            server = subprocess.Popen([sys.executable, "-m", "app.serve", "--port", str(port)],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for _ in range(100):
+                try:
+                    urllib.request.urlopen(http_url + "/metrics").close()
+                    break
+                except OSError:
+                    sleep(0.1)
+
+    try:
+        if args.in_process and server is None and not args.url:
+            result = asyncio.run(_in_process(args, port))
+        else:
+            result = asyncio.run(_drive(args, ws_url, http_url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if data_dir is not None:
+            data_dir.cleanup()
+
+    report = {"commit": _git_commit(), "timestamp": round(time()), "config": vars(args), "result": result}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Broadcast cost versus room size and total connected users.
+
+Broadcasting into a room should scale with that room's membership only::
+
+    python -m bench.rooms --total 1000 10000 --room-size 10 100 1000
+"""
+import argparse
+import asyncio
+from time import perf_counter
+
+from app.codec import Envelope
+from app.fanout import Connection
+from app.rooms import RoomRegistry
+
+
+class NullSocket:
+    async def send_text(self, text: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def _populate(total: int, room_size: int) -> RoomRegistry:
+    registry = RoomRegistry()
+    target = registry.get("target")
+    for i in range(total):
+        connection = Connection(NullSocket(), maxsize=8)
+        room = target if i < room_size else registry.get(f"room-{i % 64}")
+        connection.room = room
+        registry.join(room, connection)
+    return registry
+
+
+async def _measure(total: int, room_size: int, rounds: int) -> float:
+    registry = _populate(total, room_size)
+    room = registry.get("target")
+    envelope = Envelope({"type": "text", "content": "order up", "username": "kitchen"})
+    start = perf_counter()
+    for _ in range(rounds):
+        room.broadcast(envelope)
+    return (perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--total", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--room-size", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'total users':>12} {'room size':>10} {'us/broadcast':>14}")
+    for total in args.total:
+        for room_size in args.room_size:
+            if room_size > total:
+                continue
+            cost = asyncio.run(_measure(total, room_size, args.rounds))
+            print(f"{total:>12} {room_size:>10} {cost * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
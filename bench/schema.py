@@ -0,0 +1,45 @@
+"""Per-message cost of decode+validate vs the old raw ``json.loads``.
+
+    python -m bench.schema --messages 100000
+"""
+import argparse
+import json
+from time import perf_counter
+
+from app import config, schema
+from app.schema import MessageError, decode_message
+
+
+def _time(fn, frames) -> float:
+    start = perf_counter()
+    for frame in frames:
+        try:
+            fn(frame)
+        except MessageError:
+            pass
+    return (perf_counter() - start) / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    args = parser.parse_args()
+
+    base = {"username": "kitchen", "timestamp": "2024-01-01T12:00:00.000Z", "id": "c1700000000000"}
+    cases = {
+        "text": {**base, "type": "text", "content": "Table 4 needs another round of drinks"},
+        "reply": {**base, "type": "text", "content": "On it", "replyTo": {"id": "42"}},
+        "image": {**base, "type": "image", "content": "0123456789abcdef0123456789abcdef"},
+        "oversized": {**base, "type": "text", "content": "A" * (config.MESSAGE_MAX_BYTES * 64)},
+    }
+    print(f"validator: {'msgspec' if schema.msgspec is not None else 'pydantic'}")
+    print(f"{'message':<12} {'json.loads':>12} {'decode_message':>16}")
+    for name, message in cases.items():
+        frames = [json.dumps(message)] * (args.messages if name != "oversized" else max(args.messages // 100, 1))
+        raw = _time(json.loads, frames)
+        validated = _time(decode_message, frames)
+        print(f"{name:<12} {raw * 1e6:9.2f} us {validated * 1e6:13.2f} us")
+
+
+if __name__ == "__main__":
+    main()
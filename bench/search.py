@@ -0,0 +1,76 @@
+"""Search index build time, size and query latency at scale.
+
+Indexes ``--messages`` synthetic chat messages (words drawn from a Zipf-like
+vocabulary, a few hundred users, one message a second) and times a set of
+queries against them::
+
+    python -m bench.search --messages 1000000
+"""
+import argparse
+import itertools
+import json
+import random
+from time import perf_counter
+
+from app.search import SearchIndex
+from bench.load import _percentiles
+
+
+def _vocabulary(size: int) -> list:
+    rng = random.Random(0)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200, help="runs of each query kind")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = _vocabulary(args.vocabulary)
+    # Zipf-ish: word i drawn with weight 1 / (i + 1).
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(words))))
+    index = SearchIndex()
+    start = perf_counter()
+    for seq in range(1, args.messages + 1):
+        content = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 20)))
+        index.add(seq, {"type": "text", "username": f"user{rng.randrange(args.users)}",
+                        "content": content, "ts": 1_700_000_000 + seq})
+    build = perf_counter() - start
+
+    end = 1_700_000_000 + args.messages
+    kinds = {
+        "common word": lambda: (words[rng.randrange(10)],),
+        "rare word": lambda: (words[rng.randrange(1000, len(words))],),
+        "two words": lambda: (f"{words[rng.randrange(100)]} {words[rng.randrange(100)]}",),
+        "phrase": lambda: (f'"{words[rng.randrange(5)]} {words[rng.randrange(5)]}"',),
+        "word + user": lambda: (words[rng.randrange(100)], f"user{rng.randrange(args.users)}"),
+        "word + last hour": lambda: (words[rng.randrange(100)], None, end - 3600, end),
+    }
+    latencies = {}
+    for kind, make in kinds.items():
+        times = []
+        for _ in range(args.queries):
+            query = make()
+            started = perf_counter()
+            index.search(*query, limit=20)
+            times.append(perf_counter() - started)
+        latencies[kind] = _percentiles(times)
+
+    print(json.dumps({
+        "config": vars(args),
+        "build_seconds": round(build, 2),
+        "terms": len(index.terms),
+        "index_mb": round(index.nbytes() / 1e6, 1),
+        "bytes_per_message": round(index.nbytes() / args.messages, 1),
+        "latency": latencies,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Encoding cost of one broadcast: per-listener ``json.dumps`` vs encode-once.
+
+    python -m bench.serialize --listeners 500 --payload-kb 300
+"""
+import argparse
+import json
+from time import perf_counter
+
+from app.codec import BACKENDS, Envelope, get_codec
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listeners", type=int, default=500)
+    parser.add_argument("--payload-kb", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    message = {
+        "id": "1700000000000",
+        "username": "kitchen",
+        "timestamp": "2024-01-01T12:00:00.000Z",
+        "type": "image",
+        "content": "data:image/jpeg;base64," + "A" * (args.payload_kb * 1024),
+    }
+
+    start = perf_counter()
+    for _ in range(args.rounds):
+        for _ in range(args.listeners):
+            json.dumps(message)
+    per_listener = (perf_counter() - start) / args.rounds
+    print(f"{'per-listener json.dumps':<28} {per_listener * 1e3:9.2f} ms/broadcast")
+
+    for name in BACKENDS:
+        try:
+            codec = get_codec(name)
+        except ImportError:
+            print(f"{'encode-once ' + name:<28} {'not installed':>12}")
+            continue
+        start = perf_counter()
+        for _ in range(args.rounds):
+            Envelope(message, codec.dumps(message))
+        once = (perf_counter() - start) / args.rounds
+        print(f"{'encode-once ' + name:<28} {once * 1e3:9.2f} ms/broadcast")
+
+
+if __name__ == "__main__":
+    main()
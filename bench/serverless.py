@@ -0,0 +1,120 @@
+"""Cold start and per-invocation latency of the serverless websocket handler.
+
+Feeds ``app.serverless`` simulated API Gateway events (connect, a mix of
+text, reply, typing and history messages, then disconnect) with frames
+"posted" to an in-memory sender, against a throwaway SQLite store::
+
+    python -m bench.serverless --clients 50 --rooms 2 --messages 20
+
+Cold start is measured in fresh interpreters: importing the handler module,
+and handling a first connect event (which also opens the store).
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+from bench.load import _percentiles
+
+_COLD_START = """
+import json, sys
+from time import perf_counter
+start = perf_counter()
+import app.serverless
+imported = perf_counter()
+app.serverless._adapter = app.serverless.WebSocketAdapter(
+    app.serverless.SQLiteStore(sys.argv[1]), lambda endpoint, connection_id, frame: True)
+app.serverless.handler({"requestContext": {"eventType": "CONNECT", "connectionId": "cold",
+                                           "domainName": "localhost", "stage": "bench"}})
+print(json.dumps({"import": imported - start, "first_event": perf_counter() - imported}))
+"""
+
+
+def _event(kind: str, connection_id: str, body: str = None, params: dict = None) -> dict:
+    event = {"requestContext": {"eventType": kind, "connectionId": connection_id,
+                                "domainName": "localhost", "stage": "bench"}}
+    if body is not None:
+        event["body"] = body
+    if params is not None:
+        event["queryStringParameters"] = params
+    return event
+
+
+def cold_starts(runs: int, directory: str) -> dict:
+    imports, first_events = [], []
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", _COLD_START, os.path.join(directory, f"cold{i}.db")])
+        result = json.loads(output)
+        imports.append(result["import"])
+        first_events.append(result["first_event"])
+    return {"import": _percentiles(imports), "first_event": _percentiles(first_events)}
+
+
+def warm(args, directory: str) -> dict:
+    from app.serverless import SQLiteStore, WebSocketAdapter
+
+    frames = {"count": 0, "bytes": 0}
+
+    def send(endpoint, connection_id, frame):
+        frames["count"] += 1
+        frames["bytes"] += len(frame)
+        return True
+
+    store = SQLiteStore(os.path.join(directory, "warm.db"))
+    adapter = WebSocketAdapter(store, send)
+    rng = random.Random(args.seed)
+    latencies = {"connect": [], "text": [], "reply": [], "typing": [], "history": [], "disconnect": []}
+
+    def invoke(kind, event):
+        start = perf_counter()
+        response = adapter(event)
+        latencies[kind].append(perf_counter() - start)
+        assert response["statusCode"] == 200, response
+
+    clients = [(f"conn{i}", f"user{i}", f"bench-{i % args.rooms}") for i in range(args.clients)]
+    for connection_id, username, room in clients:
+        invoke("connect", _event("CONNECT", connection_id, params={"room": room, "username": username}))
+    seqs = {}
+    for _ in range(args.messages):
+        for connection_id, username, room in clients:
+            roll = rng.random()
+            if roll < 0.1:
+                invoke("typing", _event("MESSAGE", connection_id, '{"type":"typing"}'))
+            elif roll < 0.15:
+                invoke("history", _event("MESSAGE", connection_id, '{"type":"history","limit":30}'))
+            else:
+                message = {"type": "text", "username": username, "content": "order up " * rng.randint(1, 12)}
+                kind = "text"
+                if roll < 0.35 and seqs.get(room):
+                    message["replyTo"] = {"id": str(rng.randint(1, seqs[room]))}
+                    kind = "reply"
+                invoke(kind, _event("MESSAGE", connection_id, json.dumps(message)))
+                seqs[room] = seqs.get(room, 0) + 1
+    for connection_id, _, _ in clients:
+        invoke("disconnect", _event("DISCONNECT", connection_id))
+    store.close()
+    return {"frames_sent": frames["count"], "bytes_sent": frames["bytes"],
+            "latency": {kind: _percentiles(values) for kind, values in latencies.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--rooms", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=20, help="rounds of one event per client")
+    parser.add_argument("--cold-starts", type=int, default=5, help="fresh interpreters to time")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="chat-serverless-") as directory:
+        report = {"config": vars(args), "cold_start": cold_starts(args.cold_starts, directory),
+                  "warm": warm(args, directory)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
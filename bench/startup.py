@@ -0,0 +1,101 @@
+"""Startup cost: module import time and time to the first accepted websocket.
+
+Each measurement runs in a fresh interpreter. Import time comes from
+``python -X importtime``, reported for the whole module and broken down by
+top-level package; time to first websocket is from spawning ``app.serve`` to
+completing a websocket handshake with it::
+
+    python -m bench.startup --runs 5 --output startup.json
+
+Results include the commit, so they can be compared across changes.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, sleep, time
+
+from websockets.sync.client import connect
+
+from bench.load import _free_port, _git_commit
+
+MODULES = ("app.app", "app.serverless")
+
+
+def import_times(module: str) -> tuple:
+    """Cumulative import time of ``module`` and self time per top-level package, in ms."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    total = None
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1e3
+        if name == module:
+            total = int(cumulative_us) / 1e3
+    return total, packages
+
+
+def first_websocket(directory: str, timeout: float = 30.0) -> float:
+    """Seconds from spawning the server to an accepted websocket."""
+    port = _free_port()
+    env = dict(os.environ, CHAT_LOG_DIR=os.path.join(directory, "log"),
+               CHAT_MEDIA_DIR=os.path.join(directory, "media"))
+    start = perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "app.serve", "--port", str(port)], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while perf_counter() - start < timeout:
+            try:
+                with connect(f"ws://127.0.0.1:{port}/ws/chat/startup", open_timeout=timeout):
+                    return perf_counter() - start
+            except OSError:
+                sleep(0.005)
+        raise TimeoutError("server did not accept a websocket in time")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="packages to list by import time")
+    parser.add_argument("--output", help="write the JSON result here")
+    args = parser.parse_args()
+
+    result = {}
+    for module in MODULES:
+        totals, packages = [], {}
+        for _ in range(args.runs):
+            total, by_package = import_times(module)
+            totals.append(total)
+            for package, ms in by_package.items():
+                packages.setdefault(package, []).append(ms)
+        medians = {package: round(statistics.median(values), 1) for package, values in packages.items()}
+        top = sorted(medians.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        result[module] = {"import_ms": {"median": round(statistics.median(totals), 1),
+                                        "min": round(min(totals), 1)},
+                          "by_package_ms": dict(top)}
+    with tempfile.TemporaryDirectory(prefix="chat-startup-") as directory:
+        times = [first_websocket(directory) for _ in range(args.runs)]
+    result["first_websocket_ms"] = {"median": round(statistics.median(times) * 1e3, 1),
+                                    "min": round(min(times) * 1e3, 1)}
+
+    report = {"commit": _git_commit(), "timestamp": round(time()), "config": vars(args), "result": result}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+
+import pytest
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import app.app as app_module
+from app import config
+from app.app import ConnectionManager, app, manager
+from app.ratelimit import RATE_LIMIT_CLOSE_CODE, limiter_factory
+
+
+@pytest.fixture(autouse=True)
+def no_log(monkeypatch):
+    monkeypatch.setattr(config, "LOG_DIR", "")
+
+
+def _send(websocket, content):
+    websocket.send_text(json.dumps({"type": "text", "username": "u", "content": content}))
+
+
+def _next_message(websocket):
+    while True:
+        frame = json.loads(websocket.receive_text())
+        if isinstance(frame, list) or frame.get("type") != "presence":
+            return frame
+
+
+def test_resume_sends_only_what_was_missed():
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws/chat/resume") as websocket:
+            for i in range(1, 4):
+                _send(websocket, f"m{i}")
+                assert _next_message(websocket)["seq"] == i
+        with client.websocket_connect("/ws/chat/resume?resume_from=1") as websocket:
+            assert [m["content"] for m in _next_message(websocket)] == ["m2", "m3"]
+        # Unusable cursors get a snapshot instead.
+        for resume_from in ("9" * 40, "²", "-1"):
+            with client.websocket_connect(f"/ws/chat/resume?resume_from={resume_from}") as websocket:
+                frame = _next_message(websocket)
+                assert frame["type"] == "snapshot" and len(frame["messages"]) == 3
+
+
+def test_client_seqs_are_clamped_for_the_broker(tmp_path):
+    async def run():
+        manager = ConnectionManager(backplane_url="unix:" + os.path.join(str(tmp_path), "b.sock"))
+        await manager.start()
+        try:
+            for before_seq in (1 << 70, -(1 << 70)):
+                page = json.loads(await manager.history_page("r", before_seq=before_seq))
+                assert page["messages"] == []
+                results = json.loads(await manager.search("r", "word", before_seq=before_seq))
+                assert results["messages"] == []
+        finally:
+            await manager.stop()
+    asyncio.run(run())
+
+
+def test_invalid_frames_get_an_error_and_oversized_ones_close():
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws/chat/schema") as websocket:
+            for data in (json.dumps({"type": []}), "[" * 5000, "not json"):
+                websocket.send_text(data)
+                assert _next_message(websocket)["type"] == "error"
+            _send(websocket, "still open")
+            assert _next_message(websocket)["content"] == "still open"
+            websocket.send_text("x" * (config.MESSAGE_MAX_BYTES + 1))
+            with pytest.raises(WebSocketDisconnect) as closed:
+                _next_message(websocket)
+            assert closed.value.code == 1009
+        assert not manager.rooms.find("schema").members
+
+
+def test_senders_over_the_rate_limit_are_closed(monkeypatch):
+    monkeypatch.setattr(app_module, "new_connection_limiter", limiter_factory(1, 2, 10 ** 6, 10 ** 6, 0.0, 0.0))
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws/chat/limited") as websocket:
+            for i in range(3):
+                _send(websocket, f"m{i}")
+            received = []
+            with pytest.raises(WebSocketDisconnect) as closed:
+                while True:
+                    received.append(_next_message(websocket)["content"])
+            assert closed.value.code == RATE_LIMIT_CLOSE_CODE
+            assert "m2" not in received
@@ -0,0 +1,149 @@
+import asyncio
+import os
+
+import pytest
+
+from app.backplane import InProcessBackplane, UnixSocketBackplane
+from app.chatlog import ChatLogStore
+from app.codec import Envelope
+from app.history import MAX_SEQ
+
+
+class Worker:
+    """A backplane plus what its callbacks received."""
+
+    def __init__(self, path, store_factory=None):
+        self.backplane = UnixSocketBackplane(path, 10, store_factory)
+        self.delivered = []
+        self.restored = {}
+
+    async def start(self):
+        await self.backplane.start(lambda room, envelope: self.delivered.append(envelope.message["content"]),
+                                   lambda room, envelopes: self.restored.__setitem__(
+                                       room, [e.message["content"] for e in envelopes]),
+                                   lambda room, frame: None)
+        return self
+
+
+def _text(content):
+    return Envelope({"type": "text", "username": "u", "content": content})
+
+
+async def _settle():
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+
+
+def _workers(tmp_path, test, store=False):
+    path = os.path.join(str(tmp_path), "b.sock")
+    factory = (lambda: ChatLogStore(os.path.join(str(tmp_path), "log"), sync=False)) if store else None
+
+    async def run():
+        a = await Worker(path, factory).start()
+        b = await Worker(path, factory).start()
+        try:
+            await test(a, b)
+        finally:
+            await b.backplane.close()
+            await a.backplane.close()
+    asyncio.run(run())
+
+
+def test_one_worker_becomes_the_broker(tmp_path):
+    async def test(a, b):
+        assert a.backplane.is_broker and not b.backplane.is_broker
+        await a.backplane.subscribe("r")
+        await b.backplane.subscribe("r")
+        await b.backplane.publish("r", _text("hi"))
+        await a.backplane.publish("r", _text("there"))
+        await _settle()
+        assert a.delivered == b.delivered == ["hi", "there"]
+        c = await Worker(a.backplane.path).start()
+        await c.backplane.subscribe("r")
+        assert c.restored["r"] == ["hi", "there"]
+        await c.backplane.close()
+    _workers(tmp_path, test)
+
+
+def test_page_and_search_round_trip(tmp_path):
+    async def test(a, b):
+        await b.backplane.subscribe("r")
+        for i in range(1, 6):
+            await b.backplane.publish("r", _text(f"word m{i}"))
+        await _settle()
+        first_seq, has_more, envelopes = await b.backplane.page("r", before_seq=4, limit=2)
+        assert (first_seq, has_more) == (2, True)
+        assert [e.message["content"] for e in envelopes] == ["word m2", "word m3"]
+        assert await b.backplane.page("r", before="nope") == (None, False, [])
+        has_more, envelopes = await b.backplane.search("r", "word", limit=2)
+        assert has_more and [e.seq for e in envelopes] == [5, 4]
+        assert await b.backplane.search("empty", "word") == (False, [])
+    _workers(tmp_path, test)
+
+
+def test_out_of_range_cursors_cross_the_broker(tmp_path):
+    async def test(a, b):
+        await b.backplane.subscribe("r")
+        for i in range(1, 4):
+            await b.backplane.publish("r", _text(f"m{i}"))
+        await _settle()
+        # The reply's first seq used to overflow the wire format and cost
+        # the worker its broker connection.
+        assert await b.backplane.page("r", after_seq=MAX_SEQ) == (4, False, [])
+        first_seq, _, envelopes = await b.backplane.page("r", before_seq=MAX_SEQ, limit=1)
+        assert (first_seq, [e.seq for e in envelopes]) == (3, [3])
+        assert (await b.backplane.search("r", "m2", before_seq=MAX_SEQ))[1][0].seq == 2
+        await b.backplane.publish("r", _text("m4"))
+        await _settle()
+        assert b.delivered[-1] == "m4"
+    _workers(tmp_path, test)
+
+
+def test_a_failed_request_keeps_the_connection(tmp_path):
+    async def test(a, b):
+        await b.backplane.subscribe("r")
+
+        async def fail(*args):
+            raise RuntimeError("log is broken")
+        a.backplane.hub.page = fail
+        with pytest.raises(RuntimeError):
+            await b.backplane.page("r")
+        await b.backplane.publish("r", _text("still here"))
+        await _settle()
+        assert b.delivered == ["still here"]
+        # A subscription whose history fails still completes.
+        a.backplane.hub.history = fail
+        await asyncio.wait_for(b.backplane.subscribe("other"), 1)
+        assert b.restored["other"] == []
+    _workers(tmp_path, test)
+
+
+def test_takeover_keeps_rooms_and_history(tmp_path):
+    async def test(a, b):
+        await b.backplane.subscribe("r")
+        await b.backplane.publish("r", _text("before"))
+        await _settle()
+        await a.backplane.close()
+        await b.backplane.publish("r", _text("after"))
+        await _settle()
+        assert b.backplane.is_broker
+        assert b.delivered == ["before", "after"]
+        first_seq, _, envelopes = await b.backplane.page("r")
+        assert [(e.seq, e.message["content"]) for e in envelopes] == [(1, "before"), (2, "after")]
+    _workers(tmp_path, test, store=True)
+
+
+def test_in_process_backplane():
+    async def run():
+        backplane = InProcessBackplane(10)
+        delivered, restored = [], []
+        await backplane.start(lambda room, envelope: delivered.append(envelope.seq),
+                              lambda room, envelopes: restored.append(len(envelopes)), lambda room, frame: None)
+        await backplane.subscribe("r")
+        await backplane.publish("r", _text("one"))
+        backplane.unsubscribe("r")
+        await backplane.publish("r", _text("two"))
+        await backplane.subscribe("r")
+        await backplane.close()
+        return delivered, restored
+    assert asyncio.run(run()) == ([1], [0, 2])
@@ -0,0 +1,155 @@
+import asyncio
+import os
+
+import pytest
+
+from app import chatlog
+from app.chatlog import SegmentedLog
+from app.codec import Envelope
+from app.history import RoomHistory
+
+
+def _write(directory, payloads, keys=()):
+    async def write():
+        log = SegmentedLog(directory, sync=False)
+        for i, payload in enumerate(payloads):
+            log.append(payload, keys[i] if i < len(keys) else b"")
+        await log.flush()
+        log.close()
+    asyncio.run(write())
+
+
+def _read(directory):
+    log = SegmentedLog(directory, sync=False)
+    try:
+        return [bytes(payload) for payload in log.read(0, len(log))]
+    finally:
+        log.close()
+
+
+def _segment(directory, suffix):
+    return os.path.join(directory, f"{0:020d}{suffix}")
+
+
+def test_reopen_reads_back(tmp_path):
+    _write(str(tmp_path), [b"a", b"bb", b"ccc"])
+    assert _read(str(tmp_path)) == [b"a", b"bb", b"ccc"]
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    _write(str(tmp_path), [b"a", b"bb", b"ccc"])
+    log_path = _segment(str(tmp_path), ".log")
+    size = os.path.getsize(log_path)
+    with open(log_path, "ab") as f:
+        f.write(b"\x00\x00\x00\x10half a record")
+    assert _read(str(tmp_path)) == [b"a", b"bb", b"ccc"]
+    assert os.path.getsize(log_path) == size
+
+
+def test_torn_last_record_is_dropped(tmp_path):
+    _write(str(tmp_path), [b"a", b"bb", b"ccc"])
+    log_path = _segment(str(tmp_path), ".log")
+    with open(log_path, "r+b") as f:
+        f.truncate(os.path.getsize(log_path) - 1)
+    assert _read(str(tmp_path)) == [b"a", b"bb"]
+
+
+def test_corrupt_record_ends_the_log(tmp_path):
+    _write(str(tmp_path), [b"a", b"bb", b"ccc"])
+    log_path = _segment(str(tmp_path), ".log")
+    with open(log_path, "r+b") as f:
+        f.seek(os.path.getsize(log_path) - 2)
+        f.write(b"X")
+    assert _read(str(tmp_path)) == [b"a", b"bb"]
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    _write(str(tmp_path), [b"a", b"bb", b"ccc"])
+    os.remove(_segment(str(tmp_path), ".idx"))
+    assert _read(str(tmp_path)) == [b"a", b"bb", b"ccc"]
+    assert os.path.getsize(_segment(str(tmp_path), ".idx")) == 3 * 8
+
+
+def test_unindexed_records_are_recovered(tmp_path):
+    _write(str(tmp_path), [b"a", b"bb", b"ccc"])
+    with open(_segment(str(tmp_path), ".idx"), "r+b") as f:
+        f.truncate(8 + 3)  # one position and a torn one
+    assert _read(str(tmp_path)) == [b"a", b"bb", b"ccc"]
+
+
+def test_appends_continue_after_recovery(tmp_path):
+    _write(str(tmp_path), [b"a", b"bb"])
+    with open(_segment(str(tmp_path), ".log"), "ab") as f:
+        f.write(b"junk")
+    _write(str(tmp_path), [b"ccc"])
+    assert _read(str(tmp_path)) == [b"a", b"bb", b"ccc"]
+
+
+def test_segments_roll_over(tmp_path):
+    payloads = [b"%03d" % i * 10 for i in range(50)]
+
+    async def write():
+        log = SegmentedLog(str(tmp_path), segment_bytes=256, sync=False)
+        for payload in payloads:
+            log.append(payload)
+        await log.flush()
+        assert len(log.segments) > 1
+        log.close()
+    asyncio.run(write())
+    assert _read(str(tmp_path)) == payloads
+
+
+def test_find(tmp_path):
+    _write(str(tmp_path), [b"a", b"bb", b"ccc"], [b"k1", b"", b"k3"])
+
+    async def find():
+        log = SegmentedLog(str(tmp_path), sync=False)
+        log.append(b"dddd", b"k1")
+        found = [await log.find(key) for key in (b"k1", b"k3", b"nope")]
+        log.append(b"eeeee", b"k5")
+        found.append(await log.find(b"k5"))
+        await log.flush()
+        log.close()
+        return found
+    assert asyncio.run(find()) == [3, 2, None, 4]
+
+
+def test_failed_commit_fails_the_log(tmp_path, monkeypatch):
+    _write(str(tmp_path), [b"a"])
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    async def write():
+        log = SegmentedLog(str(tmp_path), sync=False)
+        monkeypatch.setattr(chatlog.Segment, "write", fail)
+        log.append(b"bb")
+        with pytest.raises(OSError):
+            await log.flush()
+        assert log.durable_offset == 1
+        with pytest.raises(RuntimeError):
+            log.append(b"ccc")
+        with pytest.raises(RuntimeError):
+            await log.flush()
+        log.close()
+        monkeypatch.undo()
+    asyncio.run(write())
+    assert _read(str(tmp_path)) == [b"a"]
+
+
+def test_room_history_reloads_from_the_log(tmp_path):
+    async def check():
+        log = SegmentedLog(str(tmp_path), sync=False)
+        history = RoomHistory(3, log)
+        for i in range(1, 6):
+            history.append(Envelope({"type": "text", "content": f"m{i}"}))
+        await log.flush()
+        log.close()
+        log = SegmentedLog(str(tmp_path), sync=False)
+        history = RoomHistory(3, log)
+        assert history.last_seq == 5
+        assert [e.message["content"] for e in history.recent] == ["m3", "m4", "m5"]
+        assert history.append(Envelope({"type": "text", "content": "m6"})).seq == 6
+        await log.flush()
+        log.close()
+    asyncio.run(check())
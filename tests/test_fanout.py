@@ -0,0 +1,96 @@
+import asyncio
+
+from app import metrics
+from app.fanout import COALESCE, DISCONNECT, DROP_OLDEST, SLOW_CONSUMER_CLOSE_CODE, Connection
+
+
+class FakeWebSocket:
+    """Records frames; ``send_text`` blocks while ``stalled`` is set."""
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.stalled = False
+        self._resume = asyncio.Event()
+
+    async def send_text(self, text):
+        while self.stalled:
+            await self._resume.wait()
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+    def resume(self):
+        self.stalled = False
+        self._resume.set()
+
+
+def _run(policy, frames, maxsize=3):
+    async def run():
+        websocket = FakeWebSocket()
+        websocket.stalled = True
+        closed = []
+        connection = Connection(websocket, maxsize, policy, on_close=closed.append)
+        connection.start()
+        results = [connection.send(frame) for frame in frames]
+        await asyncio.sleep(0)
+        websocket.resume()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        connection.close()
+        await asyncio.sleep(0)
+        return websocket, connection, results, closed
+    return asyncio.run(run())
+
+
+def test_sends_in_order():
+    websocket, connection, results, _ = _run(DROP_OLDEST, ["1", "2"])
+    assert results == [True, True]
+    assert websocket.sent == ["1", "2"] and connection.dropped == 0
+
+
+def test_bytes_out_counts_utf8_bytes():
+    before = metrics.bytes_out.value
+    _run(DROP_OLDEST, ["ab", "é€"])
+    assert metrics.bytes_out.value - before == 2 + 5
+
+
+def test_drop_oldest():
+    websocket, connection, results, _ = _run(DROP_OLDEST, ["1", "2", "3", "4", "5"])
+    assert all(results)
+    assert websocket.sent == ["3", "4", "5"] and connection.dropped == 2
+
+
+def test_coalesce_folds_the_backlog():
+    websocket, connection, results, _ = _run(COALESCE, ["1", "2", "3", "4", "[5,6]", "7"])
+    assert all(results)
+    # A full queue is folded into one batch frame (splicing in batches
+    # already queued), cut down to the newest ``maxsize`` entries.
+    assert websocket.sent == ["[3,4,5,6]", "7"]
+    assert connection.dropped == 2
+
+
+def test_disconnect_closes_slow_consumers():
+    websocket, connection, results, closed = _run(DISCONNECT, ["1", "2", "3", "4", "5"])
+    assert results == [True, True, True, False, False]
+    assert websocket.closed_with == SLOW_CONSUMER_CLOSE_CODE
+    assert closed == [connection] and connection.closed
+    assert websocket.sent == []
+    assert connection.send("6") is False
+
+
+def test_send_error_finishes_the_connection():
+    async def run():
+        class Broken(FakeWebSocket):
+            async def send_text(self, text):
+                raise RuntimeError("gone")
+        closed = []
+        connection = Connection(Broken(), on_close=closed.append)
+        connection.start()
+        connection.send("1")
+        for _ in range(3):
+            await asyncio.sleep(0)
+        return connection, closed
+    connection, closed = asyncio.run(run())
+    assert connection.closed and closed == [connection]
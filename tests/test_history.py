@@ -0,0 +1,137 @@
+import asyncio
+import os
+
+from app.backplane import Hub
+from app.chatlog import ChatLogStore, SegmentedLog
+from app.codec import Envelope
+from app.history import MAX_SEQ, RoomHistory
+
+
+def _message(i):
+    return Envelope({"type": "text", "username": "u", "content": f"m{i}", "client_id": f"c{i}"})
+
+
+def _contents(envelopes):
+    return [envelope.message["content"] for envelope in envelopes]
+
+
+def _filled(count, size, log=None):
+    history = RoomHistory(size, log)
+    for i in range(1, count + 1):
+        history.append(_message(i))
+    return history
+
+
+def test_page_in_memory():
+    history = _filled(8, 5)
+    assert history.first_seq == 4
+    first_seq, envelopes = history.page(limit=3)
+    assert first_seq == 6 and _contents(envelopes) == ["m6", "m7", "m8"]
+    first_seq, envelopes = history.page(before_seq=first_seq, limit=3)
+    assert first_seq == 4 and _contents(envelopes) == ["m4", "m5"]
+    assert history.page(before_seq=4) == (4, [])
+
+
+def test_page_reaches_into_the_log(tmp_path):
+    async def check():
+        log = SegmentedLog(str(tmp_path), sync=False)
+        history = _filled(10, 3, log)
+        assert history.first_seq == 1
+        first_seq, envelopes = history.page(before_seq=4, limit=2)
+        assert first_seq == 2 and _contents(envelopes) == ["m2", "m3"]
+        first_seq, envelopes = history.page(limit=5)
+        assert first_seq == 6 and _contents(envelopes) == ["m6", "m7", "m8", "m9", "m10"]
+        await log.flush()
+        log.close()
+    asyncio.run(check())
+
+
+def test_hub_pages_by_message_id(tmp_path):
+    async def check():
+        hub = Hub(3, lambda: ChatLogStore(str(tmp_path), sync=False))
+        for i in range(1, 8):
+            await hub.append("r", _message(i))
+        first_seq, has_more, envelopes = await hub.page("r", before="c4", limit=2)
+        assert (first_seq, has_more, _contents(envelopes)) == (2, True, ["m2", "m3"])
+        first_seq, has_more, envelopes = await hub.page("r", before="3", limit=5)
+        assert (first_seq, has_more, _contents(envelopes)) == (1, False, ["m1", "m2"])
+        assert await hub.page("r", before="unknown") == (None, False, [])
+        await hub.close()
+    asyncio.run(check())
+
+
+def test_reading_an_unknown_room_creates_nothing(tmp_path):
+    async def check():
+        hub = Hub(3, lambda: ChatLogStore(str(tmp_path), sync=False))
+        assert await hub.page("nobody") == (1, False, [])
+        assert await hub.search("nobody", "word") == (False, [])
+        assert hub.histories == {}
+        await hub.close()
+    asyncio.run(check())
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_released_rooms_are_closed_and_reopened(tmp_path):
+    async def check():
+        store = ChatLogStore(str(tmp_path), sync=False)
+        hub = Hub(3, lambda: store)
+        await hub.append("r", _message(1))
+        hub.release("r")
+        assert "r" not in hub.histories
+        await asyncio.sleep(0.05)
+        assert store.logs == {}
+        assert _contents(await hub.history("r")) == ["m1"]
+        await hub.close()
+    asyncio.run(check())
+
+
+def test_append_stamps_seqs():
+    history = _filled(3, 10)
+    assert [envelope.seq for envelope in history.recent] == [1, 2, 3]
+    assert history.recent[0].message["id"] == "1"
+    assert history.recent[0].message["client_id"] == "c1"
+
+
+def test_since():
+    history = _filled(8, 5)
+    assert _contents(history.since(5)) == ["m6", "m7", "m8"]
+    assert _contents(history.since(3, limit=2)) == ["m4", "m5"]
+    assert history.since(8) == []
+    assert history.since(2) is None
+
+
+def test_since_reaches_into_the_log(tmp_path):
+    async def check():
+        log = SegmentedLog(str(tmp_path), sync=False)
+        history = _filled(10, 3, log)
+        assert _contents(history.since(0, limit=4)) == ["m1", "m2", "m3", "m4"]
+        assert _contents(history.since(6)) == ["m7", "m8", "m9", "m10"]
+        await log.flush()
+        log.close()
+    asyncio.run(check())
+
+
+def test_seq_of():
+    async def check():
+        history = _filled(3, 10)
+        assert await history.seq_of("c3") == 3
+        assert await history.seq_of("2") == 2
+        assert await history.seq_of("4") is None
+        assert await history.seq_of("²") is None
+        assert await history.seq_of("9" * 40) is None
+    asyncio.run(check())
+
+
+def test_hub_keeps_cursors_in_range():
+    async def check():
+        hub = Hub(10)
+        for i in range(1, 4):
+            await hub.append("r", _message(i))
+        assert await hub.page("r", after_seq=MAX_SEQ) == (4, False, [])
+        first_seq, has_more, envelopes = await hub.page("r", after_seq=-5, limit=1)
+        assert (first_seq, has_more, _contents(envelopes)) == (1, True, ["m1"])
+        assert await hub.page("r", before_seq=-5) == (1, False, [])
+        first_seq, _, envelopes = await hub.page("r", before_seq=MAX_SEQ, limit=1)
+        assert (first_seq, _contents(envelopes)) == (3, ["m3"])
+        await hub.close()
+    asyncio.run(check())
@@ -0,0 +1,117 @@
+import asyncio
+
+from app.ingest import IngestBudget, IngestQueue
+
+
+async def _idle(item):
+    pass
+
+
+def test_budget_hands_released_slots_to_waiters():
+    async def run():
+        budget = IngestBudget(1)
+        assert await budget.acquire(0)
+        waiter = asyncio.ensure_future(budget.acquire(1))
+        await asyncio.sleep(0)
+        assert not await budget.acquire(0.01)
+        budget.release()
+        assert await waiter
+        assert budget.pending == 1
+        budget.release()
+        assert budget.pending == 0
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_takes_no_slot():
+    async def run():
+        budget = IngestBudget(1)
+        await budget.acquire(0)
+        waiter = asyncio.ensure_future(budget.acquire(1))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        budget.release()
+        assert budget.pending == 0 and not budget._waiters
+    asyncio.run(run())
+
+
+def test_queue_dispatches_in_order_and_releases():
+    async def run():
+        handled = []
+
+        async def handler(item):
+            handled.append(item)
+        budget = IngestBudget(10)
+        queue = IngestQueue(handler, 5, budget)
+        assert all([await queue.put(i, 0.1) for i in range(3)])
+        await asyncio.sleep(0.01)
+        queue.close()
+        return handled, budget.pending
+    assert asyncio.run(run()) == ([0, 1, 2], 0)
+
+
+def test_full_queue_is_busy_after_the_timeout():
+    async def run():
+        gate = asyncio.Event()
+
+        async def handler(item):
+            await gate.wait()
+        budget = IngestBudget(10)
+        queue = IngestQueue(handler, 1, budget)
+        assert await queue.put(1, 0.1)
+        await asyncio.sleep(0)  # the dispatcher takes 1 and blocks on it
+        assert await queue.put(2, 0.1)
+        assert not await queue.put(3, 0.05)
+        assert budget.pending == 2
+        gate.set()
+        await asyncio.sleep(0.01)
+        assert budget.pending == 0
+        queue.close()
+    asyncio.run(run())
+
+
+def test_cancelled_put_releases_its_slot():
+    async def run():
+        gate = asyncio.Event()
+
+        async def handler(item):
+            await gate.wait()
+        budget = IngestBudget(10)
+        queue = IngestQueue(handler, 1, budget)
+        await queue.put(1, 1)
+        await asyncio.sleep(0)
+        await queue.put(2, 1)
+        sender = asyncio.ensure_future(queue.put(3, 10))
+        await asyncio.sleep(0.01)
+        assert budget.pending == 3
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        assert budget.pending == 2
+        gate.set()
+        await asyncio.sleep(0.01)
+        queue.close()
+        return budget.pending
+    assert asyncio.run(run()) == 0
+
+
+def test_global_budget_bounds_every_room():
+    async def run():
+        gate = asyncio.Event()
+
+        async def handler(item):
+            await gate.wait()
+        budget = IngestBudget(2)
+        rooms = [IngestQueue(handler, 10, budget) for _ in range(3)]
+        assert await rooms[0].put(1, 0.1)
+        assert await rooms[1].put(1, 0.1)
+        assert not await rooms[2].put(1, 0.05)
+        # Waits for a slot to free up rather than failing at once.
+        late = asyncio.ensure_future(rooms[2].put(2, 1))
+        await asyncio.sleep(0.01)
+        gate.set()
+        assert await late
+        await asyncio.sleep(0.01)
+        for room in rooms:
+            room.close()
+        return budget.pending
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,75 @@
+import pytest
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from app import media
+from app.media import parse_range, sniff_content_type
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(media.store, "root", str(tmp_path))
+    monkeypatch.setattr(media.store, "max_bytes", 2048)
+    monkeypatch.setattr(media.thumbnails, "warm", lambda media_id, path: None)
+    app = FastAPI()
+    app.include_router(media.router)
+    with TestClient(app) as client:
+        yield client
+
+
+def test_sniff_content_type():
+    assert sniff_content_type(PNG[:16]) == "image/png"
+    assert sniff_content_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert sniff_content_type(b"<html>") is None
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    for header in ("bytes=100-", "bytes=9-2", "bytes=0-1,4-5", "items=0-1", "bytes=x-"):
+        with pytest.raises(ValueError):
+            parse_range(header, 100)
+
+
+def test_upload_and_read_back(client):
+    response = client.post("/media", content=PNG)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["type"] == "image/png"
+    assert client.post("/media", content=PNG).json()["id"] == body["id"]
+    response = client.get(body["url"])
+    assert response.content == PNG
+    assert client.get(body["url"], headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+
+def test_upload_rejects(client):
+    assert client.post("/media", content=b"not an image").status_code == 415
+    assert client.post("/media", content=PNG * 3).status_code == 413
+    assert client.post("/media", content=PNG, headers={"Content-Length": "999999"}).status_code == 413
+
+
+def test_upload_with_malformed_content_length(client):
+    # Checked by the streamed size cap rather than failing on the header.
+    response = client.post("/media", content=PNG, headers={"Content-Length": "abc"})
+    assert response.status_code != 500
+
+
+def test_ranges(client):
+    url = client.post("/media", content=PNG).json()["url"]
+    response = client.get(url, headers={"Range": "bytes=0-7"})
+    assert response.status_code == 206
+    assert response.content == PNG[:8]
+    assert response.headers["content-range"] == f"bytes 0-7/{len(PNG)}"
+    response = client.get(url, headers={"Range": "bytes=-4"})
+    assert response.content == PNG[-4:]
+    response = client.get(url, headers={"Range": f"bytes={len(PNG)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(PNG)}"
+    # A stale If-Range gets the whole file.
+    response = client.get(url, headers={"Range": "bytes=0-7", "If-Range": '"other"'})
+    assert response.status_code == 200 and response.content == PNG
+    assert client.get("/media/" + "0" * 32).status_code == 404
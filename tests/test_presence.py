@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+from app.presence import Presence, PresenceHub
+
+
+def _presence(test):
+    async def run():
+        deltas = []
+        presence = Presence(deltas.append, window=60)
+        try:
+            test(presence, deltas)
+        finally:
+            presence.close()
+    asyncio.run(run())
+
+
+def test_changes_in_a_window_are_coalesced():
+    def test(presence, deltas):
+        presence.join("alice")
+        presence.join("bob")
+        presence.set_typing("alice")
+        presence.flush()
+        assert deltas == [{"type": "presence", "joined": ["alice", "bob"], "typing": ["alice"]}]
+    _presence(test)
+
+
+def test_undone_changes_are_not_sent():
+    def test(presence, deltas):
+        presence.join("alice")
+        presence.flush()
+        presence.leave("alice")
+        presence.join("alice")  # a quick reconnect
+        presence.set_typing("alice")
+        presence.set_typing("alice", False)
+        presence.flush()
+        assert deltas == [{"type": "presence", "joined": ["alice"]}]
+    _presence(test)
+
+
+def test_online_until_the_last_connection_leaves():
+    def test(presence, deltas):
+        presence.join("alice")
+        presence.join("alice")
+        presence.set_typing("alice")
+        presence.flush()
+        presence.leave("alice")
+        presence.flush()
+        assert len(deltas) == 1
+        presence.leave("alice")
+        presence.flush()
+        # Leaving implies idle; it isn't sent separately.
+        assert deltas[-1] == {"type": "presence", "left": ["alice"]}
+        assert presence.state() is None
+    _presence(test)
+
+
+def test_only_members_can_type():
+    def test(presence, deltas):
+        presence.set_typing("mallory")
+        presence.flush()
+        assert deltas == [] and not presence.leases
+    _presence(test)
+
+
+def test_typing_lease_lapses():
+    async def run():
+        deltas = []
+        presence = Presence(deltas.append, window=0.01, typing_timeout=0.02)
+        presence.join("alice")
+        presence.set_typing("alice")
+        await asyncio.sleep(0.1)
+        presence.close()
+        return deltas
+    deltas = asyncio.run(run())
+    assert deltas[-1] == {"type": "presence", "idle": ["alice"]}
+
+
+def test_apply_and_roster():
+    def test(presence, deltas):
+        assert presence.apply({"type": "presence", "online": ["alice", "bob"], "typing": ["bob"]}) is False
+        assert presence.apply({"type": "presence", "joined": ["carol"], "left": ["bob"]}) is True
+        presence.join("dave")
+        roster = json.loads(presence.roster())
+        assert roster == {"type": "presence", "online": ["alice", "carol", "dave"], "typing": []}
+        assert presence.state() == {"type": "presence", "joined": ["dave"]}
+    _presence(test)
+
+
+def test_hub_merges_workers():
+    hub = PresenceHub()
+    assert hub.update("r", 1, {"joined": ["alice"], "typing": ["alice"]}) == {
+        "type": "presence", "joined": ["alice"], "typing": ["alice"]}
+    # Already online and typing through worker 1: nothing changes room-wide.
+    assert hub.update("r", 2, {"joined": ["alice"], "typing": ["alice"]}) is None
+    assert hub.update("r", 1, {"left": ["alice"]}) is None
+    assert hub.update("r", 2, {"idle": ["alice"]}) == {"type": "presence", "idle": ["alice"]}
+    assert hub.roster("r") == {"type": "presence", "online": ["alice"], "typing": []}
+    assert hub.update("r", 2, {"left": ["alice"]}) == {"type": "presence", "left": ["alice"]}
+    assert "r" not in hub.rooms
+
+
+def test_hub_ignores_typing_from_workers_without_the_user():
+    hub = PresenceHub()
+    hub.update("r", 1, {"joined": ["alice"]})
+    assert hub.update("r", 2, {"typing": ["alice"]}) is None
+    assert hub.roster("r")["typing"] == []
+
+
+def test_hub_drops_a_worker():
+    hub = PresenceHub()
+    hub.update("a", 1, {"joined": ["alice", "bob"], "typing": ["bob"]})
+    hub.update("a", 2, {"joined": ["bob"]})
+    hub.update("b", 1, {"joined": ["carol"]})
+    deltas = dict(hub.drop(1))
+    assert deltas == {"a": {"type": "presence", "left": ["alice"], "idle": ["bob"]},
+                      "b": {"type": "presence", "left": ["carol"]}}
+    assert hub.roster("a") == {"type": "presence", "online": ["bob"], "typing": []}
@@ -0,0 +1,74 @@
+import pytest
+
+from app.ratelimit import RateLimiter, TokenBucket, limiter_factory
+
+
+def test_burst_then_wait():
+    bucket = TokenBucket(rate=2.0, burst=3.0)
+    now = bucket.updated
+    assert [bucket.take(1, now, max_delay=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(1, now, max_delay=0.0) is None
+    assert bucket.take(1, now, max_delay=1.0) == pytest.approx(0.5)
+    assert bucket.take(1, now, max_delay=1.0) == pytest.approx(1.0)
+    assert bucket.take(1, now, max_delay=1.0) is None
+
+
+def test_refused_take_spends_nothing():
+    bucket = TokenBucket(rate=1.0, burst=1.0)
+    now = bucket.updated
+    assert bucket.take(5, now, max_delay=1.0) is None
+    assert bucket.tokens == pytest.approx(1.0)
+
+
+def test_refill_is_capped_at_burst():
+    bucket = TokenBucket(rate=10.0, burst=5.0)
+    now = bucket.updated
+    bucket.take(5, now, max_delay=0.0)
+    assert bucket.take(3, now + 0.25, max_delay=0.0) is None
+    assert bucket.take(2, now + 0.25, max_delay=0.0) == 0.0
+    bucket.take(0, now + 100, max_delay=0.0)
+    assert bucket.tokens == pytest.approx(5.0)
+
+
+def test_refund():
+    bucket = TokenBucket(rate=1.0, burst=2.0)
+    now = bucket.updated
+    bucket.take(2, now, max_delay=0.0)
+    bucket.refund(1)
+    assert bucket.tokens == pytest.approx(1.0)
+    bucket.refund(5)
+    assert bucket.tokens == pytest.approx(2.0)
+
+
+def test_limiter_checks_messages_and_bytes():
+    limiter = RateLimiter(messages_per_second=10, message_burst=10, bytes_per_second=100, byte_burst=100)
+    now = limiter.bytes.updated
+    assert limiter.take(50, now) == 0.0
+    # Within the message budget but over the byte one: held back.
+    assert limiter.take(100, now) == pytest.approx(0.5)
+    # Refused on bytes; the message token is given back.
+    assert limiter.take(200, now) is None
+    assert limiter.messages.tokens == pytest.approx(8.0)
+
+
+def test_sustained_throttling_is_refused_after_the_grace_period():
+    limiter = RateLimiter(messages_per_second=1, message_burst=1, bytes_per_second=1000, byte_burst=1000,
+                          max_delay=1.0, grace=2.0)
+    start = now = limiter.messages.updated
+    assert limiter.take(1, now) == 0.0
+    while True:
+        wait = limiter.take(1, now)
+        if wait is None:
+            break
+        assert 0 < wait <= 1.0
+        now += wait
+    assert now - start > 2.0
+    # A quiet spell resets it.
+    assert limiter.take(1, now + 10) == 0.0
+    assert limiter.throttled_since is None
+
+
+def test_limiter_factory():
+    assert limiter_factory(0, 10, 100, 100, 1.0, 5.0) is None
+    make = limiter_factory(5, 10, 100, 100, 1.0, 5.0)
+    assert make() is not make() and isinstance(make(), RateLimiter)
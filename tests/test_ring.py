@@ -0,0 +1,41 @@
+from app.codec import Envelope
+from app.ring import HistoryRing
+
+
+def _envelope(seq, size=10):
+    return Envelope(text=f'{{"seq":{seq},"content":"{"x" * size}"}}')
+
+
+def test_count_bound_evicts_oldest():
+    evicted = []
+    ring = HistoryRing(3, on_evict=evicted.append)
+    ring.extend(_envelope(seq) for seq in range(1, 6))
+    assert [e.text for e in ring] == [_envelope(seq).text for seq in (3, 4, 5)]
+    assert [e.text for e in evicted] == [_envelope(seq).text for seq in (1, 2)]
+
+
+def test_byte_bound_evicts_and_accounts():
+    one = HistoryRing.footprint(_envelope(1))
+    ring = HistoryRing(100, max_bytes=one * 3)
+    ring.extend(_envelope(seq) for seq in range(1, 8))
+    assert len(ring) == 3 and ring.nbytes == one * 3
+    ring.popleft()
+    assert ring.nbytes == one * 2
+    ring.clear()
+    assert len(ring) == 0 and ring.nbytes == 0
+
+
+def test_newest_entry_is_always_kept():
+    ring = HistoryRing(100, max_bytes=1)
+    ring.append(_envelope(1, size=1000))
+    ring.append(_envelope(2, size=1000))
+    assert [e.text for e in ring] == [_envelope(2, size=1000).text]
+    assert ring.nbytes == HistoryRing.footprint(ring[0])
+
+
+def test_large_messages_take_more_of_the_budget():
+    small = HistoryRing.footprint(_envelope(1))
+    ring = HistoryRing(100, max_bytes=small * 4)
+    ring.extend(_envelope(seq) for seq in range(1, 5))
+    ring.append(_envelope(5, size=small * 2))
+    assert len(ring) < 4
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from app import config
+from app.schema import MessageError, decode_message
+
+MEDIA_ID = "0123456789abcdef" * 2
+
+
+def _decode(message):
+    return decode_message(json.dumps(message))
+
+
+def test_text_message():
+    message = _decode({"type": "text", "username": "alice", "content": "hi", "id": "c1", "extra": 1,
+                       "replyTo": {"id": "7", "content": "dropped"}})
+    assert message == {"type": "text", "username": "alice", "content": "hi", "client_id": "c1",
+                       "replyTo": {"id": "7"}}
+
+
+def test_other_message_types():
+    assert _decode({"type": "image", "username": "a", "content": MEDIA_ID})["content"] == MEDIA_ID
+    assert _decode({"type": "history", "before_seq": 5, "limit": 10}) == {
+        "type": "history", "before_seq": 5, "limit": 10}
+    assert _decode({"type": "pong"}) == {"type": "pong"}
+    assert _decode({"type": "typing"}) == {"type": "typing", "active": True}
+
+
+@pytest.mark.parametrize("message", [
+    {"type": "text", "content": "no username"},
+    {"type": "text", "username": "", "content": "x"},
+    {"type": "text", "username": "a" * (config.USERNAME_MAX_LENGTH + 1), "content": "x"},
+    {"type": "text", "username": "a", "content": ""},
+    {"type": "text", "username": "a", "content": 5},
+    {"type": "image", "username": "a", "content": "data:image/png;base64,AAAA"},
+    {"type": "history", "before_seq": "5"},
+    {"type": "typing", "active": "yes"},
+    {"type": "unknown"},
+    {"type": []},
+    {"type": {"nested": 1}},
+    {"content": "no type"},
+])
+def test_invalid_messages(message):
+    with pytest.raises(MessageError) as error:
+        _decode(message)
+    assert not error.value.too_big
+
+
+@pytest.mark.parametrize("data", ["not json", "[1, 2]", "null", "[" * 5000, '{"type": "text"'])
+def test_malformed_frames(data):
+    with pytest.raises(MessageError):
+        decode_message(data)
+
+
+def test_oversized_frames_are_refused_unparsed():
+    limit = config.MESSAGE_MAX_BYTES
+    with pytest.raises(MessageError) as error:
+        decode_message("x" * (limit + 1))
+    assert error.value.too_big
+    # Counted in UTF-8 bytes, not characters.
+    with pytest.raises(MessageError) as error:
+        decode_message("é" * (limit // 2 + 1))
+    assert error.value.too_big
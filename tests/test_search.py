@@ -0,0 +1,87 @@
+import asyncio
+
+from app.chatlog import SegmentedLog
+from app.codec import Envelope
+from app.history import INLINE_INDEX, RoomHistory
+from app.search import SearchIndex, parse_query
+
+
+def _index(count, content=lambda seq: f"hello message {seq}", username=lambda seq: "alice"):
+    index = SearchIndex()
+    for seq in range(1, count + 1):
+        index.add(seq, {"type": "text", "content": content(seq), "username": username(seq), "ts": seq})
+    return index
+
+
+def test_parse_query():
+    assert parse_query('Hello "Big World"') == [["hello"], ["big", "world"]]
+    assert parse_query("  ") == []
+
+
+def test_search_newest_first_with_paging():
+    index = _index(10)
+    assert index.search("hello", limit=3) == ([10, 9, 8], True)
+    assert index.search("hello", before_seq=3) == ([2, 1], False)
+    assert index.search("message 7") == ([7], False)
+    assert index.search("nothing") == ([], False)
+
+
+def test_phrases_and_filters():
+    index = _index(6, content=lambda seq: "big red dog" if seq % 2 else "red big dog",
+                   username=lambda seq: "Alice" if seq <= 3 else "bob")
+    assert index.search('"big red"') == ([5, 3, 1], False)
+    assert index.search("big red") == ([6, 5, 4, 3, 2, 1], False)
+    assert index.search("dog", username="ALICE") == ([3, 2, 1], False)
+    assert index.search("dog", since=2, until=4) == ([4, 3, 2], False)
+    assert index.search("dog", username="carol") == ([], False)
+
+
+def test_evict_below_hides_old_documents():
+    index = _index(10)
+    index.evict_below(8)
+    assert len(index) == 3
+    assert index.search("hello") == ([10, 9, 8], False)
+    assert index.search("message 3") == ([], False)
+    # Small evictions only move the floor.
+    assert len(index.seqs) == 10
+
+
+def test_evict_below_compacts():
+    index = _index(3000, content=lambda seq: f"hello m{seq}")
+    size = index.nbytes()
+    index.evict_below(2001)
+    assert len(index.seqs) == 1000 and len(index) == 1000
+    assert index.nbytes() < size
+    assert "m5" not in index.terms
+    assert index.search("hello", limit=2) == ([3000, 2999], True)
+    assert index.search("hello", before_seq=2003) == ([2002, 2001], False)
+    assert index.search("hello", username="alice", until=2001.5) == ([2001], False)
+    index.add(3001, {"type": "text", "content": "hello again", "username": "alice", "ts": 3001})
+    assert index.search("again") == ([3001], False)
+
+
+def test_non_text_messages_index_only_metadata():
+    index = SearchIndex()
+    index.add(1, {"type": "image", "content": "hello", "username": "alice"})
+    index.add(2, {"type": "text", "content": "hello", "username": "alice"})
+    assert index.search("hello") == ([2], False)
+    assert len(index) == 2
+
+
+def test_large_histories_are_indexed_off_the_loop(tmp_path):
+    async def check():
+        log = SegmentedLog(str(tmp_path), sync=False)
+        history = RoomHistory(10, log)
+        count = INLINE_INDEX + 10
+        for seq in range(1, count + 1):
+            history.append(Envelope({"type": "text", "username": "u", "content": f"needle {seq}"}))
+        await log.flush()
+        assert history.search("needle") is None
+        await history._building
+        has_more, envelopes = history.search("needle", limit=2)
+        assert has_more and [e.seq for e in envelopes] == [count, count - 1]
+        # The oldest records came from the log, the newest from the ring.
+        assert history.search('"needle 1"')[1][0].seq == 1
+        history.close()
+        log.close()
+    asyncio.run(check())
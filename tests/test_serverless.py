@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from app.serverless import WebSocketAdapter
+from app.sqlitestore import SQLiteStore
+
+
+class Sender:
+    def __init__(self):
+        self.frames = []
+        self.gone = set()
+
+    def __call__(self, endpoint, connection_id, frame):
+        if connection_id in self.gone:
+            return False
+        self.frames.append((connection_id, json.loads(frame)))
+        return True
+
+    def take(self, connection_id=None):
+        frames, self.frames = self.frames, []
+        return [frame for to, frame in frames if connection_id in (None, to)]
+
+
+@pytest.fixture
+def adapter():
+    adapter = WebSocketAdapter(SQLiteStore(":memory:"), Sender())
+    yield adapter
+    adapter.store.close()
+
+
+def _event(kind, connection_id, body=None, **params):
+    event = {"requestContext": {"eventType": kind, "connectionId": connection_id,
+                                "domainName": "example.com", "stage": "prod"}}
+    if params:
+        event["queryStringParameters"] = params
+    if body is not None:
+        event["body"] = json.dumps(body)
+    return event
+
+
+def _say(adapter, connection_id, content, **extra):
+    return adapter(_event("MESSAGE", connection_id, {"type": "text", "username": "alice",
+                                                      "content": content, **extra}))
+
+
+def test_connect_announces_and_messages_fan_out(adapter):
+    assert adapter(_event("CONNECT", "a", room="r", username="alice"))["statusCode"] == 200
+    assert adapter(_event("CONNECT", "b", room="r", username="bob"))["statusCode"] == 200
+    assert adapter.send.take("a") == [{"type": "presence", "joined": ["bob"]}]
+    _say(adapter, "a", "hi")
+    frames = adapter.send.take()
+    assert len(frames) == 2 and all(f["content"] == "hi" and f["seq"] == 1 for f in frames)
+    adapter(_event("DISCONNECT", "b"))
+    assert adapter.send.take() == [{"type": "presence", "left": ["bob"]}]
+
+
+def test_bad_rooms_and_unknown_connections(adapter):
+    assert adapter(_event("CONNECT", "a", room="no spaces"))["statusCode"] == 400
+    assert _say(adapter, "nobody", "hi")["statusCode"] == 410
+
+
+def test_invalid_message_gets_an_error(adapter):
+    adapter(_event("CONNECT", "a", room="r"))
+    adapter(_event("MESSAGE", "a", {"type": "text"}))
+    assert adapter.send.take("a")[0]["type"] == "error"
+
+
+def test_history_pages(adapter):
+    adapter(_event("CONNECT", "a", room="r"))
+    for n in range(5):
+        _say(adapter, "a", f"m{n}", id=f"c{n}")
+    adapter.send.take()
+    adapter(_event("MESSAGE", "a", {"type": "history", "limit": 2}))
+    page = adapter.send.take("a")[0]
+    assert (page["first_seq"], page["has_more"]) == (4, True)
+    adapter(_event("MESSAGE", "a", {"type": "history", "before": "c2"}))
+    assert [m["content"] for m in adapter.send.take("a")[0]["messages"]] == ["m0", "m1"]
+
+
+def test_out_of_range_ids_are_not_found(adapter):
+    adapter(_event("CONNECT", "a", room="r"))
+    _say(adapter, "a", "first")
+    huge = "9" * 40
+    adapter.send.take()
+    _say(adapter, "a", "reply", replyTo={"id": huge})
+    assert adapter.send.take("a")[0]["replyTo"] == {"id": huge}
+    adapter(_event("MESSAGE", "a", {"type": "history", "before": huge}))
+    assert adapter.send.take("a")[0] == {"type": "history", "first_seq": None, "has_more": False, "messages": []}
+    adapter(_event("MESSAGE", "a", {"type": "history", "before_seq": 1 << 63}))
+    assert [m["content"] for m in adapter.send.take("a")[0]["messages"]] == ["first", "reply"]
+
+
+def test_gone_connections_are_forgotten(adapter):
+    adapter(_event("CONNECT", "a", room="r"))
+    adapter(_event("CONNECT", "b", room="r"))
+    adapter.send.gone.add("b")
+    _say(adapter, "a", "hi")
+    assert adapter.store.members("r") == ["a"]
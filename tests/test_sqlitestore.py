@@ -0,0 +1,55 @@
+from app.codec import Envelope
+from app.sqlitestore import SQLiteStore
+
+HUGE = "9" * 40
+
+
+def _store(count=5):
+    store = SQLiteStore(":memory:")
+    for seq in range(1, count + 1):
+        store.append("r", Envelope({"type": "text", "content": f"m{seq}", "client_id": f"c{seq}"}))
+    return store
+
+
+def test_append_stamps_seqs_per_room():
+    store = _store(2)
+    assert store.append("other", Envelope({"type": "text", "content": "x"})).seq == 1
+    assert store.append("r", Envelope({"type": "text", "content": "x"})).seq == 3
+    assert store.last_seq("r") == 3 and store.last_seq("empty") == 0
+
+
+def test_connections():
+    store = SQLiteStore(":memory:")
+    store.add_connection("a", "r")
+    store.add_connection("b", "r", "bob")
+    store.set_username("a", "alice")
+    assert store.connection("a") == ("r", "alice")
+    assert sorted(store.members("r")) == ["a", "b"]
+    assert store.remove_connection("b") == ("r", "bob")
+    assert store.remove_connection("b") is None
+    assert store.members("r") == ["a"]
+
+
+def test_page():
+    store = _store()
+    first_seq, has_more, envelopes = store.page("r", limit=2)
+    assert (first_seq, has_more) == (4, True)
+    assert [e.message["content"] for e in envelopes] == ["m4", "m5"]
+    first_seq, has_more, envelopes = store.page("r", before_seq=first_seq, limit=10)
+    assert (first_seq, has_more, len(envelopes)) == (1, False, 3)
+    assert store.page("r", before_seq=1) == (1, False, [])
+
+
+def test_out_of_range_ids_and_cursors():
+    store = _store()
+    assert store.seq_of("r", "c2") == 2
+    assert store.seq_of("r", "3") == 3
+    assert store.seq_of("r", "6") is None
+    assert store.seq_of("r", HUGE) is None
+    assert store.seq_of("r", "0") is None
+    assert store.lookup("r", int(HUGE)) is None
+    assert store.lookup("r", -int(HUGE)) is None
+    assert store.lookup("r", 5).message["content"] == "m5"
+    # Past the end is the newest page; before the start is nothing.
+    assert store.page("r", before_seq=int(HUGE), limit=1)[0] == 5
+    assert store.page("r", before_seq=-int(HUGE)) == (0, False, [])
@@ -0,0 +1,64 @@
+import gzip
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import static
+from app.app import app
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def test_choose_encoding():
+    variants = {"identity": b"", "gzip": b"", "br": b""}
+    assert static._choose_encoding("gzip, br", variants) == "br"
+    assert static._choose_encoding("gzip, br;q=0", variants) == "gzip"
+    assert static._choose_encoding("GZIP", variants) == "gzip"
+    assert static._choose_encoding("*", variants) == "br"
+    assert static._choose_encoding("deflate", variants) == "identity"
+    assert static._choose_encoding("", variants) == "identity"
+    assert static._choose_encoding("br", {"identity": b"", "gzip": b""}) == "identity"
+
+
+def test_index_references_versioned_assets(client):
+    response = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == static.REVALIDATE
+    for name in static.VERSIONED:
+        stem, ext = name.rsplit(".", 1)
+        versioned = re.search(rf'"/static/({stem}\.[0-9a-f]{{16}}\.{ext})"', response.text).group(1)
+        asset = client.get(f"/static/{versioned}")
+        assert asset.status_code == 200
+        assert asset.headers["cache-control"] == static.IMMUTABLE
+        assert asset.content == static._read(name)
+
+
+def test_gzip_variant(client):
+    response = client.get("/static/chat.js", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"].endswith('-gzip"')
+    # The client decodes it for us; the stored bytes must round-trip.
+    assert response.content == static._read("chat.js")
+    assert gzip.decompress(static.assets()["chat.js"].variants["gzip"]) == static._read("chat.js")
+
+
+def test_etag_revalidation_per_encoding(client):
+    plain = client.get("/static/chat.css", headers={"Accept-Encoding": "identity"})
+    etag = plain.headers["etag"]
+    assert "content-encoding" not in plain.headers
+    cached = client.get("/static/chat.css", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+    assert cached.headers["etag"] == etag
+    # The gzip variant is a different representation with its own tag.
+    other = client.get("/static/chat.css", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert other.status_code == 200 and other.headers["etag"] != etag
+
+
+def test_unknown_assets_are_not_found(client):
+    assert client.get("/static/nope.js").status_code == 404
+    assert client.get("/static/index.html").status_code == 404
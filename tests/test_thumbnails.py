@@ -0,0 +1,28 @@
+import asyncio
+import io
+
+import pytest
+
+from app.thumbnails import ThumbnailCache
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def test_renders_once_and_caches(tmp_path):
+    source = tmp_path / "image"
+    data = io.BytesIO()
+    Image.new("RGB", (400, 300), "red").save(data, "PNG")
+    source.write_bytes(data.getvalue())
+
+    async def render():
+        cache = ThumbnailCache(max_workers=1)
+        try:
+            first, second = await asyncio.gather(cache.get("k", str(source)), cache.get("k", str(source)))
+            assert first == second and cache.misses == 1
+            assert await cache.get("k", str(source)) == first and cache.hits == 1
+            return first
+        finally:
+            cache.shutdown()
+    thumbnail = asyncio.run(render())
+    assert Image.open(io.BytesIO(thumbnail)).size == (100, 75)
+    assert (tmp_path / "image.thumb").read_bytes() == thumbnail